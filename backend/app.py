@@ -1,81 +1,370 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify, g, has_request_context, stream_with_context
 from flask_cors import CORS
-import mysql.connector
-from config import MYSQL_CONFIG
+from config import (STORAGE_BACKEND, MYSQL_CONFIG, DB_POOL_CONFIG, SQLITE_CONFIG,
+                    MYSQL_REPLICA_CONFIGS, READ_YOUR_WRITES_SECONDS, REPLICA_RETRY_AFTER,
+                    MYSQL_SHARD_CONFIGS, SHARDING_CONFIG,
+                    TASKS_PAGE_DEFAULT_LIMIT, TASKS_PAGE_MAX_LIMIT,
+                    AUTH_CACHE_CONFIG, BATCH_MAX_OPERATIONS, IMPORT_BATCH_SIZE, SYNC_MAX_CHANGES, TOMBSTONE_RETENTION_DAYS,
+                    ARCHIVE_AFTER_DAYS,
+                    STREAM_TASK_LISTS, STREAM_BATCH_SIZE, SEARCH_MAX_LIMIT, SEARCH_MAX_OFFSET,
+                    PASSWORD_HASH_CONFIG, METRICS_ENABLED, QUERY_BUDGET_MODE, LOGGING_CONFIG, MIGRATE_ON_START,
+                    JSON_PROVIDER, COMPRESSION_CONFIG, RATE_LIMIT_CONFIG, ADMISSION_CONFIG,
+                    WRITE_BEHIND_TOGGLES, WRITE_BEHIND_CONFIG, SSE_HEARTBEAT_SECONDS, SSE_MAX_QUEUE)
+from storage import StorageBusyError, create_storage
+from migrations import LATEST_VERSION, current_version, migrate, pending_migrations
+from auth_cache import AuthCache, TTLCache
+from task_sync import ResyncRequired
+from streaming import NDJSON_MIMETYPE, json_encoder, stream_format, stream_rows
+from task_import import EXPORT_COLUMNS, InvalidImportRow, export_row, import_batches, parse_csv, parse_ndjson
+from password_hasher import HasherBusyError, PasswordHasher
+from logging_setup import configure_logging
+from json_provider import create_json_provider
+from compression import ResponseCompression
+from rate_limit import AdmissionController, OverloadedError, RateLimitedError, RateLimiter, retry_after_header
+from write_behind import ToggleCoalescer
+from events import HEARTBEAT, ChangeFeed, EventBroker
+from sharding import ShardedStorage
+import metrics
+import query_budget
 import jwt
 import datetime
-import bcrypt
-import traceback
 import logging
 import os
+import base64
+import io
+import time
+import re
+import hashlib
+import click
 from functools import wraps
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('access')
 
-app = Flask(__name__)
-# Configure CORS properly
-CORS(app, resources={
+CORS_CONFIG = {
     r"/*": {
         "origins": ["http://localhost:5173", "http://127.0.0.1:5173"],
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "If-None-Match", "Last-Event-ID"],
         "supports_credentials": True,
-        "expose_headers": ["Content-Type", "Authorization"]
+        "expose_headers": ["Content-Type", "Authorization", "ETag", "X-Data-Version"]
     }
-})
+}
 
-# JWT configuration
-app.config['SECRET_KEY'] = 'your-secret-key'  # Change this to a secure secret key
+# Routes, hooks and CLI commands; attached to an app by create_app()
+bp = Blueprint('api', __name__, cli_group=None)
 
-def init_db():
+# Process-wide services, built by create_app() in each worker process
+storage = None
+auth_cache = None
+password_hasher = None
+replica_pins = None
+compression = None
+rate_limiter = None
+admission = None
+coalescer = None
+event_broker = None
+
+def create_app():
+    # Builds the app and everything it holds open (connection pool, bcrypt
+    # threads, log listener). Call it in each worker after the server forks;
+    # nothing is opened at import time.
+    global storage, auth_cache, password_hasher, replica_pins, compression, rate_limiter, admission, coalescer, event_broker
+
+    # Configure logging: asynchronous, level and sampling set from the environment
+    configure_logging(**LOGGING_CONFIG)
+    metrics.enabled = METRICS_ENABLED
+    query_budget.mode = QUERY_BUDGET_MODE
+
+    app = Flask(__name__)
+    app.json = create_json_provider(app, JSON_PROVIDER)
+    compression = ResponseCompression(**COMPRESSION_CONFIG)
+    # Configure CORS properly
+    CORS(app, resources=CORS_CONFIG)
+
+    # JWT configuration
+    app.config['SECRET_KEY'] = 'your-secret-key'  # Change this to a secure secret key
+
+    # All data access goes through the configured storage backend
+    storage = create_storage(STORAGE_BACKEND, MYSQL_CONFIG, DB_POOL_CONFIG, SQLITE_CONFIG,
+                             MYSQL_REPLICA_CONFIGS, REPLICA_RETRY_AFTER, MYSQL_SHARD_CONFIGS, SHARDING_CONFIG)
+    metrics.register_gauges('db_pool', 'Connection pool state.', storage.stats)
+    for index in range(len(storage.replica_stats())):
+        metrics.register_gauges(f'db_replica{index}', 'Replica connection pool state.',
+                                lambda index=index: storage.replica_stats()[index])
+    for index in range(len(storage.shard_stats())):
+        metrics.register_gauges(f'db_shard{index}', 'Shard connection pool state.',
+                                lambda index=index: storage.shard_stats()[index])
+    # Users who wrote recently, whose reads must not go to a lagging replica
+    replica_pins = TTLCache(100000, READ_YOUR_WRITES_SECONDS)
+    metrics.register_gauges('replica_pins', 'Users pinned to the primary after a write.', replica_pins.stats)
+
+    auth_cache = AuthCache(**AUTH_CACHE_CONFIG)
+    password_hasher = PasswordHasher(**PASSWORD_HASH_CONFIG)
+    metrics.register_gauges('password_hasher', 'bcrypt worker pool state.', password_hasher.stats)
+    metrics.register_gauges('auth_cache_tokens', 'Verified token cache.', auth_cache.tokens.stats)
+    metrics.register_gauges('auth_cache_users', 'User row cache.', auth_cache.users.stats)
+
+    # Load shedding in front of the database for the authenticated API
+    rate_limiter = RateLimiter(**RATE_LIMIT_CONFIG)
+    admission = AdmissionController(queue_depth=storage.queue_depth, **ADMISSION_CONFIG)
+    metrics.register_gauges('rate_limiter', 'Per-user rate limiter.', rate_limiter.stats)
+    metrics.register_gauges('admission', 'Admission control state.', admission.stats)
+
+    # Live change feed: write routes publish to this worker's subscribers
+    event_broker = EventBroker(SSE_MAX_QUEUE)
+    metrics.register_gauges('events', 'Live change feed subscribers.', event_broker.stats)
+
+    # Optional write-behind for completion toggles; a previous app instance
+    # writes what it still holds first
+    if coalescer is not None:
+        coalescer.close()
+    coalescer = None
+    if WRITE_BEHIND_TOGGLES:
+        coalescer = ToggleCoalescer(storage, on_flush=toggles_written, **WRITE_BEHIND_CONFIG)
+        metrics.register_gauges('write_behind', 'Coalesced completion toggles.', coalescer.stats)
+
+    app.register_blueprint(bp)
+    check_schema()
+    return app
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # Statements are counted against the budget declared on the view
+    view = current_app.view_functions.get(request.endpoint)
+    query_budget.begin(request.url_rule.rule if request.url_rule else 'unmatched',
+                       getattr(view, 'query_budget', None))
+
+@bp.after_app_request
+def record_request(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    budget = query_budget.end()
+    if metrics.enabled:
+        metrics.REQUEST_LATENCY.observe(elapsed, request.method, route, response.status_code)
+        if budget is not None and budget.exceeded:
+            metrics.QUERY_BUDGET_EXCEEDED.inc(route)
+    if budget is not None and query_budget.mode == 'strict':
+        response.headers['X-Query-Count'] = str(budget.count)
+    # One structured access line per request replaces per-handler logging
+    if access_logger.isEnabledFor(logging.INFO):
+        access_logger.info(
+            "method=%s path=%s route=%s status=%s duration_ms=%.2f user=%s bytes=%s queries=%s",
+            request.method, request.path, route, response.status_code, elapsed * 1000,
+            g.get('user_id', '-'), response.content_length if response.content_length is not None else '-',
+            budget.count if budget is not None else '-'
+        )
+    return response
+
+@bp.after_app_request
+def compress_response(response):
+    # Registered after record_request so it runs first (after_request hooks
+    # run in reverse) and the access line shows the bytes actually sent
+    return compression.apply(response)
+
+def acquire_db_connection(readonly=False, user_id=None):
+    if not metrics.enabled:
+        return storage.acquire(readonly, user_id)
+    start = time.perf_counter()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Read the schema file
-        with open('schema.sql', 'r') as f:
-            schema_sql = f.read()
-        
-        # Split the SQL file into individual statements
-        statements = schema_sql.split(';')
-        
-        # Execute each statement separately
-        for statement in statements:
-            if statement.strip():  # Skip empty statements
-                cursor.execute(statement)
-        
-        conn.commit()
-        logger.info("Database schema initialized successfully")
-        
-    except Exception as e:
-        logger.error(f"Error initializing database schema: {str(e)}")
-        logger.error(traceback.format_exc())
+        return storage.acquire(readonly, user_id)
     finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+        metrics.POOL_ACQUIRE.observe(time.perf_counter() - start)
 
-def get_db_connection():
+def get_db_connection(readonly=False, user_id=None):
+    # Inside a request every caller (token_required and the handler) shares one
+    # pooled connection; it is returned to the pool in release_db_connection.
+    # Outside a request the caller owns the connection and must close() it.
+    # readonly=True allows a replica connection (see get_read_connection).
+    # With sharded storage the connection is to the shard of user_id, which
+    # inside a request defaults to the authenticated user (the catalog
+    # before authentication).
+    slot = 'db_read_conn' if readonly else 'db_conn'
     try:
-        connection = mysql.connector.connect(**MYSQL_CONFIG)
-        logger.info("Successfully connected to MySQL database")
-        return connection
-    except mysql.connector.Error as err:
-        logger.error(f"Error connecting to MySQL database: {err}")
+        if has_request_context():
+            conn = g.get(slot)
+            if conn is None:
+                conn = acquire_db_connection(readonly, user_id if user_id is not None else g.get('user_id'))
+                conn.request_scoped = True
+                setattr(g, slot, conn)
+            return conn
+        return acquire_db_connection(readonly, user_id)
+    except storage.Error as err:
+        logger.error("Error connecting to the database: %s", err)
         raise
 
-# Initialize database on startup
-init_db()
+@bp.teardown_app_request
+def release_db_connection(exc):
+    for slot in ('db_conn', 'db_read_conn'):
+        conn = g.pop(slot, None)
+        if conn is not None:
+            conn.release()
+
+@bp.teardown_app_request
+def leave_admission(exc):
+    # After the response is sent, so a streamed list keeps its slot while
+    # it holds its connection
+    if g.pop('admitted', False):
+        admission.leave()
+
+def get_read_connection(user_id=None):
+    # Connection for reads that may be served by a replica. A user who wrote
+    # in the last READ_YOUR_WRITES_SECONDS reads from the primary instead, so
+    # they always see their own writes.
+    if not storage.has_replicas or (user_id is not None and replica_pins.get(user_id)):
+        return get_db_connection(user_id=user_id)
+    return get_db_connection(readonly=True, user_id=user_id)
+
+def pin_to_primary(user_id):
+    # Call after each committed write by the user
+    if storage.has_replicas:
+        replica_pins.set(user_id, True)
+
+def toggles_written(user_ids):
+    # Called by write-behind after each flush. The feed learns what changed
+    # from the database, like a write served by another worker.
+    for user_id in user_ids:
+        pin_to_primary(user_id)
+        event_broker.publish(user_id, None)
+
+def publish_changes(user_id, version, changed=(), deleted=()):
+    # Call after commit with the data version the write stamped (returned
+    # by the storage), not one read afterwards: concurrent writers can
+    # publish out of order, and a feed catches up from an older event's
+    # exact version (see events.ChangeFeed)
+    if version is None or not event_broker.has_subscribers(user_id):
+        return
+    event_broker.publish(user_id, {'version': version, 'changed': list(changed), 'deleted': list(deleted)})
+
+def read_feed_changes(feed, user_id, only_if_newer=False):
+    # Catches a live feed up from the database: the SSE message for what
+    # changed since feed.last_id (a resync if too much did), or b''.
+    # Uses its own connection, as the feed outlives the request.
+    conn = storage.acquire(user_id=user_id)
+    try:
+        if only_if_newer and storage.get_data_version(conn, user_id) <= feed.last_id:
+            return b''
+        try:
+            version, changed, deleted = storage.get_changes(conn, user_id, feed.last_id, SYNC_MAX_CHANGES)
+        except ResyncRequired:
+            return feed.resync(storage.get_data_version(conn, user_id))
+        if not changed and not deleted:
+            feed.last_id = max(feed.last_id, version)
+            return b''
+        return feed.changes(version, changed, deleted)
+    finally:
+        conn.close()
+
+def flush_pending_toggles(user_id):
+    # Call before reading or writing a user's tasks (other than a toggle):
+    # completion toggles acknowledged by write-behind are written first, on
+    # the request's primary connection
+    if coalescer is not None and coalescer.has_pending(user_id):
+        with query_budget.paused():
+            coalescer.flush(user_id, get_db_connection(user_id=user_id))
+
+def check_schema():
+    # Runs in every worker at boot: a single read of the schema version, no
+    # DDL. Migrations are applied out of band with `flask --app app migrate`
+    # (or here when MIGRATE_ON_START is set, e.g. for a single SQLite node).
+    # Every shard of a sharded storage has its own schema.
+    for index, shard in enumerate(storage.shards):
+        where = f" of shard {index}" if len(storage.shards) > 1 else ""
+        try:
+            conn = shard.acquire()
+            try:
+                version = current_version(shard, conn)
+            finally:
+                conn.close()
+
+            if version < LATEST_VERSION and MIGRATE_ON_START:
+                applied = migrate(shard)
+                logger.info("Applied migrations %s%s", applied, where)
+            elif version < LATEST_VERSION:
+                logger.error(
+                    "Database schema%s is at version %s but this code needs %s; run `flask --app app migrate`",
+                    where, version, LATEST_VERSION
+                )
+            elif version > LATEST_VERSION:
+                logger.warning("Database schema version %s%s is newer than this code (%s)",
+                               version, where, LATEST_VERSION)
+        except Exception as e:
+            logger.exception("Error checking database schema%s: %s", where, e)
+
 
 def generate_token(user_id):
     payload = {
         'user_id': user_id,
         'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
     }
-    return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+    return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+
+def encode_cursor(task_id):
+    return base64.urlsafe_b64encode(f"v1:{task_id}".encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    # Returns the last seen task id, or raises ValueError for a malformed cursor
+    padded = cursor + '=' * (-len(cursor) % 4)
+    version, _, task_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').partition(':')
+    if version != 'v1':
+        raise ValueError(f"Unsupported cursor version: {version}")
+    return int(task_id)
+
+def make_tasks_etag(user_id, version, query_string, fmt=None):
+    # Strong validator: same user, same data version, same query parameters
+    # and same output format always serialize to the same bytes
+    digest = hashlib.sha1(query_string + str(fmt).encode('utf-8')).hexdigest()[:16]
+    return f"{user_id}-{version}-{digest}"
+
+def search_terms(q):
+    # Every word must match, as a prefix; search operators typed by the user
+    # are dropped rather than interpreted
+    return re.findall(r'\w+', q)[:20]
+
+def parse_bool_arg(value):
+    if value is None:
+        return None
+    value = value.lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Invalid boolean value: {value}")
+
+def retry_later_response(error, status, retry_after):
+    response = jsonify({'error': error})
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response, status
+
+def hasher_busy_response():
+    return retry_later_response('Server busy, please retry', 503, 1)
+
+def authenticate_token(token):
+    # Returns the user row for a token (None if the user no longer exists).
+    # Raises jwt.InvalidTokenError / jwt.ExpiredSignatureError for bad tokens.
+    user_id = auth_cache.get_token_user_id(token)
+    if user_id is None:
+        data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        user_id = data['user_id']
+        auth_cache.put_token(token, user_id, data['exp'])
+
+    current_user = auth_cache.get_user(user_id)
+    if current_user is None:
+        conn = get_read_connection(user_id)
+        current_user = storage.get_user(conn, user_id)
+        conn.close()
+        if current_user is None and conn.readonly:
+            # A user who signed up moments ago may not be on the replica yet
+            conn = get_db_connection(user_id=user_id)
+            current_user = storage.get_user(conn, user_id)
+            conn.close()
+        if current_user:
+            auth_cache.put_user(current_user)
+    return current_user
 
 def get_user_from_token():
     auth_header = request.headers.get('Authorization')
@@ -84,42 +373,59 @@ def get_user_from_token():
     
     token = auth_header.split(' ')[1]
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        return payload['user_id']
+        current_user = authenticate_token(token)
+        return current_user['id'] if current_user else None
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
-@app.route('/health')
+@bp.route('/health')
 def health_check():
     try:
-        # Test database connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        result = cursor.fetchone()
-        cursor.close()
+        # Test a read connection (a replica when one is up)
+        conn = get_read_connection()
+        storage.ping(conn)
         conn.close()
         
         return jsonify({
             "status": "healthy",
             "database": "connected",
+            "storage": storage.dialect,
+            "pool": storage.stats(),
             "timestamp": datetime.datetime.now().isoformat()
         }), 200
     except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
+        logger.error("Health check failed: %s", e)
         return jsonify({
             "status": "unhealthy",
             "error": str(e),
+            "pool": storage.stats(),
             "timestamp": datetime.datetime.now().isoformat()
         }), 500
 
-@app.route('/api/auth/signup', methods=['POST'])
+@bp.route('/health/pool')
+def pool_stats():
+    return jsonify(storage.stats()), 200
+
+@bp.route('/health/auth-cache')
+def auth_cache_stats():
+    return jsonify(auth_cache.stats()), 200
+
+@bp.route('/health/password-hasher')
+def password_hasher_stats():
+    return jsonify(password_hasher.stats()), 200
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/auth/signup', methods=['POST'])
 def signup():
     try:
         data = request.json
-        logger.debug(f"Signup request data: {data}")
         
         name = data.get('name')
         email = data.get('email')
@@ -128,26 +434,17 @@ def signup():
         if not all([name, email, password]):
             return jsonify({'error': 'All fields are required'}), 400
 
-        # Hash password
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        # Hash password on the bcrypt worker pool
+        hashed_password = password_hasher.hash(password)
 
         conn = get_db_connection()
-        cursor = conn.cursor()
 
         try:
-            # Check if user already exists
-            cursor.execute("SELECT id FROM users WHERE username = %s", (email,))
-            if cursor.fetchone():
+            # Insert new user unless the email is taken
+            user_id = storage.create_user(conn, email, hashed_password)
+            if user_id is None:
                 return jsonify({'error': 'Email already registered'}), 400
 
-            # Insert new user
-            cursor.execute(
-                "INSERT INTO users (username, password_hash) VALUES (%s, %s)",
-                (email, hashed_password)
-            )
-            conn.commit()
-            user_id = cursor.lastrowid
-
             # Generate token
             token = generate_token(user_id)
 
@@ -161,23 +458,23 @@ def signup():
                 }
             }), 201
 
-        except mysql.connector.Error as err:
-            logger.error(f"MySQL error during signup: {err}")
+        except storage.Error as err:
+            logger.error("Database error during signup: %s", err)
             return jsonify({'error': 'Database error occurred'}), 500
         finally:
-            cursor.close()
             conn.close()
 
+    except HasherBusyError as e:
+        logger.warning("Signup rejected: %s", e)
+        return hasher_busy_response()
     except Exception as e:
-        logger.error(f"Signup error: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Signup error: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/auth/login', methods=['POST'])
+@bp.route('/api/auth/login', methods=['POST'])
 def login():
     try:
         data = request.json
-        logger.debug(f"Login request data: {data}")
         
         email = data.get('email')
         password = data.get('password')
@@ -186,16 +483,22 @@ def login():
             return jsonify({'error': 'Email and password are required'}), 400
 
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
 
         try:
             # Get user
-            cursor.execute("SELECT * FROM users WHERE username = %s", (email,))
-            user = cursor.fetchone()
+            user = storage.get_user_by_email(conn, email)
 
-            if not user or not bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+            if not user or not password_hasher.verify(password, user['password_hash']):
                 return jsonify({'error': 'Invalid email or password'}), 401
 
+            # Upgrade hashes made with a different work factor while we
+            # still have the plaintext password
+            if password_hasher.needs_rehash(user['password_hash']):
+                try:
+                    storage.set_password_hash(conn, user['id'], password_hasher.hash(password))
+                except (HasherBusyError, storage.Error) as e:
+                    logger.warning("Password rehash skipped for user %s: %s", user['id'], e)
+
             # Generate token
             token = generate_token(user['id'])
 
@@ -208,16 +511,17 @@ def login():
                 }
             }), 200
 
-        except mysql.connector.Error as err:
-            logger.error(f"MySQL error during login: {err}")
+        except storage.Error as err:
+            logger.error("Database error during login: %s", err)
             return jsonify({'error': 'Database error occurred'}), 500
         finally:
-            cursor.close()
             conn.close()
 
+    except HasherBusyError as e:
+        logger.warning("Login rejected: %s", e)
+        return hasher_busy_response()
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Login error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 def token_required(f):
@@ -235,83 +539,371 @@ def token_required(f):
             return jsonify({'error': 'Token is missing'}), 401
             
         try:
-            # Decode the token
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            logger.info(f"Decoded token data: {data}")
-            
-            # Get user from database
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT id, username FROM users WHERE id = %s", (data['user_id'],))
-            current_user = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            # Shed load before any database work when this worker is saturated
+            admission.enter()
+            g.admitted = True
+
+            # Decode the token and load the user (served from auth_cache when warm)
+            current_user = authenticate_token(token)
             
             if not current_user:
-                logger.warning(f"User not found for token: {data['user_id']}")
+                logger.warning("User not found for token")
                 return jsonify({'error': 'User not found'}), 401
-                
-            logger.info(f"Current user found: {current_user}")
+
+            g.user_id = current_user['id']
+            # 503 while the user is being moved to another shard
+            storage.check_routable(current_user['id'])
+            rate_limiter.check(current_user['id'])
             return f(current_user, *args, **kwargs)
             
+        except RateLimitedError as e:
+            logger.info("Rate limited user %s", g.user_id)
+            return retry_later_response('Too many requests', 429, e.retry_after)
+        except OverloadedError as e:
+            logger.warning("Request shed by admission control: %s", e)
+            return retry_later_response('Server busy, please retry', 503, e.retry_after)
         except jwt.ExpiredSignatureError:
             logger.warning("Token has expired")
             return jsonify({'error': 'Token has expired'}), 401
         except jwt.InvalidTokenError as e:
-            logger.warning(f"Invalid token: {str(e)}")
+            logger.warning("Invalid token: %s", e)
             return jsonify({'error': 'Invalid token'}), 401
+        except StorageBusyError as e:
+            # Pool exhausted, or the user's shard is being moved
+            logger.warning("Database busy: %s", e)
+            return jsonify({'error': 'Server busy, please retry'}), 503
         except Exception as e:
-            logger.error(f"Error in token_required: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error in token_required: %s", e)
             return jsonify({'error': 'Internal server error'}), 500
             
     return decorated
 
-@app.route('/api/tasks', methods=['GET'])
+@bp.route('/api/tasks', methods=['GET'])
+@query_budget.limit(3)
 @token_required
 def get_tasks(current_user):
     try:
-        logger.info(f"Fetching tasks for user: {current_user['id']}")
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+
+        # Without limit/cursor the full list is returned as a plain array for
+        # older clients; otherwise a page is returned with an opaque next_cursor
+        paginate = 'limit' in request.args or 'cursor' in request.args
+        try:
+            limit = request.args.get('limit', TASKS_PAGE_DEFAULT_LIMIT, type=int)
+            limit = max(1, min(limit, TASKS_PAGE_MAX_LIMIT))
+            cursor_arg = request.args.get('cursor')
+            after_id = decode_cursor(cursor_arg) if cursor_arg else None
+            completed = parse_bool_arg(request.args.get('completed'))
+            include_archived = bool(parse_bool_arg(request.args.get('include_archived')))
+        except ValueError:
+            return jsonify({"error": "Invalid pagination parameters"}), 400
+
+        # Pages are already bounded by limit; only the full list is streamed
+        fmt = None if paginate else stream_format(STREAM_TASK_LISTS)
+
+        conn = get_read_connection(current_user['id'])
+        cursor = None
         
         try:
-            # Get tasks for the current user
-            cursor.execute(
-                "SELECT id, title, description, completed, user_id FROM tasks WHERE user_id = %s ORDER BY id DESC",
-                (current_user['id'],)
+            flush_pending_toggles(current_user['id'])
+
+            # Conditional GET: a matching If-None-Match is answered from the
+            # user's data version without touching the tasks table. Weak
+            # comparison: compressed responses carry the ETag as W/"..."
+            version = storage.get_data_version(conn, current_user['id'])
+            etag = make_tasks_etag(current_user['id'], version, request.query_string, fmt)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+
+            # Keyset pagination: each page is a range scan on
+            # (user_id, id) or (user_id, completed, id), however deep it is
+            # (plus one on archived_tasks with include_archived). Pages fetch
+            # one extra row to know whether another page exists.
+            cursor = storage.query_tasks(
+                conn, current_user['id'], completed, after_id, limit + 1 if paginate else None, include_archived
             )
-            tasks = cursor.fetchall()
-            
-            # Convert completed field to boolean
-            for task in tasks:
-                task['completed'] = bool(task['completed'])
-            
-            logger.info(f"Successfully fetched {len(tasks)} tasks")
-            return jsonify(tasks), 200
+
+            if fmt:
+                # Rows are encoded as they arrive from the server-side cursor
+                response = stream_rows(cursor, fmt, STREAM_BATCH_SIZE)
+                cursor = None  # closed by the stream after the last row
+                logger.info("Streaming tasks as %s", fmt)
+            elif not paginate:
+                tasks = cursor.fetchall()
+                logger.info("Successfully fetched %s tasks", len(tasks))
+                response = jsonify(tasks)
+            else:
+                tasks = cursor.fetchall()
+                next_cursor = None
+                if len(tasks) > limit:
+                    tasks = tasks[:limit]
+                    next_cursor = encode_cursor(tasks[-1]['id'])
+
+                logger.info("Successfully fetched page of %s tasks", len(tasks))
+                response = jsonify({
+                    "tasks": tasks,
+                    "next_cursor": next_cursor,
+                    "limit": limit
+                })
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.headers['Vary'] = 'Accept'
+            # Starting point for GET /api/tasks/changes
+            response.headers['X-Data-Version'] = str(version)
+            return response, 200
             
-        except mysql.connector.Error as err:
-            logger.error(f"MySQL error while fetching tasks: {err}")
-            logger.error(f"Error code: {err.errno}")
-            logger.error(f"SQL state: {err.sqlstate}")
-            logger.error(f"Error message: {err.msg}")
+        except storage.Error as err:
+            logger.error("Database error while fetching tasks: %s", err)
             return jsonify({"error": "Database error occurred"}), 500
             
         finally:
-            cursor.close()
+            if cursor is not None:
+                cursor.close()
             conn.close()
             
     except Exception as e:
-        logger.error(f"Error fetching tasks: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error fetching tasks: %s", e)
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/api/tasks/archive', methods=['GET'])
+@query_budget.limit(2)
+@token_required
+def get_archived_tasks(current_user):
+    try:
+        try:
+            limit = request.args.get('limit', TASKS_PAGE_DEFAULT_LIMIT, type=int)
+            limit = max(1, min(limit, TASKS_PAGE_MAX_LIMIT))
+            cursor_arg = request.args.get('cursor')
+            after_id = decode_cursor(cursor_arg) if cursor_arg else None
+        except ValueError:
+            return jsonify({"error": "Invalid pagination parameters"}), 400
+
+        conn = get_read_connection(current_user['id'])
+        cursor = None
+
+        try:
+            # Keyset pages over archived_tasks (user_id, id), newest first;
+            # archiving never touches a page the client already has
+            cursor = storage.query_archived_tasks(conn, current_user['id'], after_id, limit + 1)
+            tasks = cursor.fetchall()
+            next_cursor = None
+            if len(tasks) > limit:
+                tasks = tasks[:limit]
+                next_cursor = encode_cursor(tasks[-1]['id'])
+
+            logger.info("Successfully fetched page of %s archived tasks", len(tasks))
+            return jsonify({
+                "tasks": tasks,
+                "next_cursor": next_cursor,
+                "limit": limit
+            }), 200
+
+        except storage.Error as err:
+            logger.error("Database error while fetching archived tasks: %s", err)
+            return jsonify({"error": "Database error occurred"}), 500
+        finally:
+            if cursor is not None:
+                cursor.close()
+            conn.close()
+
+    except Exception as e:
+        logger.exception("Error fetching archived tasks: %s", e)
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/api/tasks/stats', methods=['GET'])
+@query_budget.limit(2)
+@token_required
+def get_task_stats(current_user):
+    try:
+        conn = get_read_connection(current_user['id'])
+
+        try:
+            # Counts of live tasks: archived tasks leave the counters, so
+            # total can be lower than GET /api/tasks?include_archived=1
+            # lists. The first request for a user builds the counters once;
+            # toggles not yet written by write-behind are added on top
+            if coalescer is not None:
+                stats = coalescer.read_stats(current_user['id'], lambda: storage.get_stats(conn, current_user['id']))
+            else:
+                stats = storage.get_stats(conn, current_user['id'])
+            return jsonify(stats), 200
+
+        except storage.Error as err:
+            logger.error("Database error while fetching task stats: %s", err)
+            return jsonify({"error": "Database error occurred"}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        logger.exception("Error fetching task stats: %s", e)
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/tasks', methods=['POST'])
+@bp.route('/api/tasks/changes', methods=['GET'])
+@token_required
+def get_task_changes(current_user):
+    try:
+        since = request.args.get('since', type=int)
+        if since is None or since < 0:
+            return jsonify({"error": "since must be a non-negative version"}), 400
+
+        conn = get_read_connection(current_user['id'])
+
+        try:
+            flush_pending_toggles(current_user['id'])
+            try:
+                version, changed, deleted = storage.get_changes(conn, current_user['id'], since, SYNC_MAX_CHANGES)
+            except ResyncRequired:
+                if not conn.readonly:
+                    raise
+                # The client may have seen a version the replica has not
+                # caught up to yet; only the primary can tell
+                conn = get_db_connection()
+                version, changed, deleted = storage.get_changes(conn, current_user['id'], since, SYNC_MAX_CHANGES)
+            logger.info("Sync since %s for user %s: %s changed, %s deleted", since, current_user['id'], len(changed), len(deleted))
+            return jsonify({
+                "version": version,
+                "changed": changed,
+                "deleted": deleted
+            }), 200
+
+        except ResyncRequired as e:
+            # The client must reload GET /api/tasks and continue from its X-Data-Version
+            return jsonify({"error": str(e), "resync": True}), 410
+        except storage.Error as err:
+            logger.error("Database error while fetching task changes: %s", err)
+            return jsonify({"error": "Database error occurred"}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        logger.exception("Error fetching task changes: %s", e)
+        return jsonify({"error": "Internal server error"}), 500
+
+def parse_last_event_id():
+    # EventSource sends Last-Event-ID when it reconnects; the query
+    # parameter lets a client resume from a version it stored itself
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if not value:
+        return None
+    since = int(value)
+    if since < 0:
+        raise ValueError(f"Invalid event id: {value}")
+    return since
+
+@bp.route('/api/tasks/events', methods=['GET'])
+@token_required
+def task_events(current_user):
+    try:
+        user_id = current_user['id']
+        try:
+            since = parse_last_event_id()
+        except ValueError:
+            return jsonify({"error": "Last-Event-ID must be a non-negative version"}), 400
+
+        # Subscribed before the version is read, so no write falls between
+        # the first message and the live events
+        subscription = event_broker.subscribe(user_id)
+        feed = ChangeFeed(json_encoder(), since or 0)
+        try:
+            flush_pending_toggles(user_id)
+            if since is None:
+                conn = get_db_connection()
+                first = feed.ready(storage.get_data_version(conn, user_id))
+            else:
+                first = read_feed_changes(feed, user_id)
+        except BaseException:
+            event_broker.unsubscribe(subscription)
+            raise
+
+        # Not bound to the request context: the request's connection and
+        # admission slot are released as soon as the stream starts
+        def generate():
+            try:
+                yield b'retry: 3000\n\n' + first
+                while True:
+                    events = subscription.get(SSE_HEARTBEAT_SECONDS)
+                    if not events:
+                        # Picks up writes served by other workers
+                        yield read_feed_changes(feed, user_id, only_if_newer=True) or HEARTBEAT
+                        continue
+                    data, catch_up = feed.messages(events)
+                    if catch_up:
+                        data += read_feed_changes(feed, user_id)
+                    if data:
+                        yield data
+            except (storage.Error, StorageBusyError) as err:
+                # The client reconnects with Last-Event-ID
+                logger.warning("Ending change feed for user %s: %s", user_id, err)
+            finally:
+                event_broker.unsubscribe(subscription)
+
+        response = current_app.response_class(generate(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    except storage.Error as err:
+        logger.error("Database error while opening change feed: %s", err)
+        return jsonify({"error": "Database error occurred"}), 500
+    except Exception as e:
+        logger.exception("Error opening change feed: %s", e)
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/api/tasks/search', methods=['GET'])
+@token_required
+def search_tasks(current_user):
+    try:
+        q = request.args.get('q', '').strip()
+        if not q or len(q) > 200:
+            return jsonify({"error": "q must be between 1 and 200 characters"}), 400
+        terms = search_terms(q)
+        if not terms:
+            return jsonify({"error": "q must contain at least one word"}), 400
+
+        limit = request.args.get('limit', 20, type=int)
+        limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+        offset = request.args.get('offset', 0, type=int)
+        if offset < 0 or offset > SEARCH_MAX_OFFSET:
+            return jsonify({"error": f"offset must be between 0 and {SEARCH_MAX_OFFSET}"}), 400
+
+        conn = get_read_connection(current_user['id'])
+
+        try:
+            flush_pending_toggles(current_user['id'])
+
+            # Served by the full-text index on (title, description), ranked by relevance
+            tasks = storage.search_tasks(conn, current_user['id'], terms, limit + 1, offset)
+
+            next_offset = None
+            if len(tasks) > limit:
+                tasks = tasks[:limit]
+                next_offset = offset + limit
+
+            logger.info("Search for user %s returned %s tasks", current_user['id'], len(tasks))
+            return jsonify({
+                "tasks": tasks,
+                "next_offset": next_offset,
+                "limit": limit
+            }), 200
+
+        except storage.Error as err:
+            logger.error("Database error while searching tasks: %s", err)
+            return jsonify({"error": "Database error occurred"}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        logger.exception("Error searching tasks: %s", e)
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/api/tasks', methods=['POST'])
+@query_budget.limit(3)
 @token_required
 def create_task(current_user):
     try:
         data = request.get_json()
-        logger.info(f"Creating task for user {current_user['id']}: {data}")
         
         if not data:
             logger.error("No data provided in request")
@@ -321,75 +913,178 @@ def create_task(current_user):
             logger.error("Title is missing in request data")
             return jsonify({"error": "Title is required"}), 400
             
-        # Log the current user data
-        logger.info(f"Current user data: {current_user}")
-        
         conn = get_db_connection()
-        cursor = conn.cursor()
         
         try:
-            # Log the SQL query and parameters
-            query = "INSERT INTO tasks (title, description, completed, user_id) VALUES (%s, %s, %s, %s)"
-            params = (
-                data['title'],
-                data.get('description', ''),
-                data.get('completed', False),
-                current_user['id']
+            # Inserts the task and returns it as written
+            task, version = storage.create_task(
+                conn, current_user['id'], data['title'], data.get('description', ''), data.get('completed', False)
             )
-            logger.info(f"Executing query: {query} with params: {params}")
-            
-            cursor.execute(query, params)
-            
-            conn.commit()
-            task_id = cursor.lastrowid
-            logger.info(f"Task created with ID: {task_id}")
-            
-            # Fetch the created task
-            cursor.execute("SELECT * FROM tasks WHERE id = %s", (task_id,))
-            task = cursor.fetchone()
-            
-            if not task:
-                logger.error(f"Failed to fetch created task with ID {task_id}")
-                return jsonify({"error": "Failed to create task"}), 500
-                
-            # Convert task to dictionary
-            task_dict = {
-                'id': task[0],
-                'title': task[1],
-                'description': task[2],
-                'completed': bool(task[3]),
-                'user_id': task[4]
-            }
             
-            logger.info(f"Successfully created task: {task_dict}")
-            return jsonify(task_dict), 201
+            pin_to_primary(current_user['id'])
+            publish_changes(current_user['id'], version, changed=[task])
+            return jsonify(task), 201
             
-        except mysql.connector.Error as err:
-            logger.error(f"MySQL error while creating task: {err}")
-            logger.error(f"Error code: {err.errno}")
-            logger.error(f"SQL state: {err.sqlstate}")
-            logger.error(f"Error message: {err.msg}")
-            logger.error(f"Full error details: {traceback.format_exc()}")
+        except storage.Error as err:
+            logger.error("Database error while creating task: %s", err)
             return jsonify({"error": "Database error occurred"}), 500
             
         finally:
-            cursor.close()
             conn.close()
             
     except Exception as e:
-        logger.error(f"Error creating task: {str(e)}")
-        logger.error(f"Full error details: {traceback.format_exc()}")
+        logger.exception("Error creating task: %s", e)
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/api/tasks/batch', methods=['POST'])
+@query_budget.limit(8)
+@token_required
+def batch_tasks(current_user):
+    try:
+        data = request.get_json(silent=True) or {}
+        operations = data.get('operations')
+
+        if not isinstance(operations, list) or not operations:
+            return jsonify({"error": "operations must be a non-empty list"}), 400
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            return jsonify({"error": f"At most {BATCH_MAX_OPERATIONS} operations per batch"}), 400
+
+        logger.info("Applying batch of %s operations for user %s", len(operations), current_user['id'])
+
+        conn = get_db_connection()
+
+        try:
+            flush_pending_toggles(current_user['id'])
+
+            # All operations succeed or fail together with a single commit
+            results, version = storage.apply_batch(conn, current_user['id'], operations)
+            pin_to_primary(current_user['id'])
+            publish_changes(
+                current_user['id'],
+                version,
+                changed=[result['task'] for result in results if 'task' in result],
+                deleted=[result['id'] for result in results if 'id' in result]
+            )
+            return jsonify({"results": results}), 200
+
+        except storage.Error as err:
+            logger.error("Database error while applying batch: %s", err)
+            return jsonify({"error": "Database error occurred"}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        logger.exception("Error applying batch: %s", e)
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/tasks/<int:task_id>', methods=['PUT'])
-def update_task(task_id):
+@bp.route('/api/tasks/export', methods=['GET'])
+@query_budget.limit(3)
+@token_required
+def export_tasks(current_user):
     try:
-        user_id = get_user_from_token()
-        if not user_id:
-            return jsonify({'error': 'Unauthorized'}), 401
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            return jsonify({"error": "format must be ndjson or csv"}), 400
+        try:
+            # A backup includes archived tasks unless asked not to
+            include_archived = parse_bool_arg(request.args.get('include_archived')) is not False
+        except ValueError:
+            return jsonify({"error": "Invalid include_archived parameter"}), 400
+
+        conn = get_read_connection(current_user['id'])
+
+        try:
+            flush_pending_toggles(current_user['id'])
+            version = storage.get_data_version(conn, current_user['id'])
+            # Every task in one consistent read, streamed from the
+            # server-side cursor (which the stream closes). Oldest first, so
+            # an import recreates the tasks in the same order.
+            cursor = storage.query_tasks(conn, current_user['id'], include_archived=include_archived,
+                                         oldest_first=True)
+            response = stream_rows(cursor, fmt, STREAM_BATCH_SIZE, export_row, EXPORT_COLUMNS)
+            logger.info("Exporting tasks of user %s as %s", current_user['id'], fmt)
+
+            response.headers['Content-Disposition'] = f'attachment; filename="tasks.{fmt}"'
+            response.headers['Cache-Control'] = 'private, no-store'
+            # Starting point for GET /api/tasks/changes
+            response.headers['X-Data-Version'] = str(version)
+            return response, 200
+
+        except storage.Error as err:
+            logger.error("Database error while exporting tasks: %s", err)
+            return jsonify({"error": "Database error occurred"}), 500
+        finally:
+            conn.close()
+
+    except Exception as e:
+        logger.exception("Error exporting tasks: %s", e)
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/api/tasks/import', methods=['POST'])
+@token_required
+def import_tasks(current_user):
+    try:
+        user_id = current_user['id']
+        fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            return jsonify({"error": "format must be ndjson or csv"}), 400
+
+        # The upload is parsed as it is read, never held in memory
+        upload = io.BufferedReader(request.stream)
+        tasks = parse_csv(upload) if fmt == 'csv' else parse_ndjson(upload, current_app.json.loads)
+
+        conn = get_db_connection()
+        flush_pending_toggles(user_id)
+        encode = json_encoder()
+
+        # Each batch is committed on its own and reported as a progress
+        # line; the last line says whether the whole upload was imported.
+        # An error ends the import: the tasks before it stay imported.
+        def generate():
+            imported = 0
+            version = None
+            try:
+                for batch in import_batches(tasks, IMPORT_BATCH_SIZE):
+                    # Stops before writing to a shard the user is moving off
+                    storage.check_routable(user_id)
+                    version = storage.import_tasks(conn, user_id, batch)
+                    imported += len(batch)
+                    pin_to_primary(user_id)
+                    # Live feeds catch up from the database
+                    event_broker.publish(user_id, None)
+                    yield encode({'imported': imported, 'version': version}) + b'\n'
+                yield encode({'imported': imported, 'version': version, 'done': True}) + b'\n'
+            except InvalidImportRow as e:
+                yield encode({'imported': imported, 'version': version, 'error': str(e), 'line': e.line}) + b'\n'
+            except StorageBusyError as e:
+                logger.warning("Import for user %s interrupted: %s", user_id, e)
+                yield encode({'imported': imported, 'version': version, 'error': 'Server busy, please retry'}) + b'\n'
+            except storage.Error as err:
+                logger.error("Database error while importing tasks: %s", err)
+                yield encode({'imported': imported, 'version': version, 'error': 'Database error occurred'}) + b'\n'
+            finally:
+                logger.info("Imported %s tasks for user %s", imported, user_id)
+
+        response = current_app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    except storage.Error as err:
+        logger.error("Database error while importing tasks: %s", err)
+        return jsonify({"error": "Database error occurred"}), 500
+    except Exception as e:
+        logger.exception("Error importing tasks: %s", e)
+        return jsonify({"error": "Internal server error"}), 500
+
+@bp.route('/api/tasks/<int:task_id>', methods=['PUT'])
+@query_budget.limit(5)
+@token_required
+def update_task(current_user, task_id):
+    try:
+        user_id = current_user['id']
 
         data = request.json
-        logger.debug(f"Update task request data: {data}")
 
         title = data.get('title')
         description = data.get('description')
@@ -399,86 +1094,72 @@ def update_task(task_id):
             return jsonify({'error': 'No valid fields to update'}), 400
 
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
 
         try:
-            # First check if task exists and belongs to user
-            cursor.execute("SELECT * FROM tasks WHERE id = %s AND user_id = %s", (task_id, user_id))
-            task = cursor.fetchone()
+            if coalescer is not None and completed is not None:
+                # A PUT that changes nothing but `completed` is acknowledged
+                # by write-behind; a task with a pending toggle needs no read
+                task = coalescer.get(user_id, task_id)
+                if task is None:
+                    task = storage.get_task(conn, task_id)
+                    if not task or task['user_id'] != user_id:
+                        return jsonify({'error': 'Task not found'}), 404
+                if title in (None, task['title']) and description in (None, task['description']):
+                    task = coalescer.toggle(task, bool(completed))
+                    if task is not None:
+                        pin_to_primary(user_id)
+                        return jsonify(task)
+            flush_pending_toggles(user_id)
+
+            # Updates only a task that exists and belongs to the user
+            task, version = storage.update_task(conn, user_id, task_id, title, description, completed)
             if not task:
                 return jsonify({'error': 'Task not found'}), 404
-
-            # Build update query dynamically based on provided fields
-            update_fields = []
-            params = []
-            if title is not None:
-                update_fields.append("title = %s")
-                params.append(title)
-            if description is not None:
-                update_fields.append("description = %s")
-                params.append(description)
-            if completed is not None:
-                update_fields.append("completed = %s")
-                params.append(1 if completed else 0)
-
-            if update_fields:
-                query = f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = %s AND user_id = %s"
-                params.extend([task_id, user_id])
-                cursor.execute(query, params)
-                conn.commit()
-
-                # Get updated task
-                cursor.execute("SELECT * FROM tasks WHERE id = %s", (task_id,))
-                updated_task = cursor.fetchone()
-                return jsonify(updated_task)
-
+            pin_to_primary(user_id)
+            publish_changes(user_id, version, changed=[task])
             return jsonify(task)
 
-        except mysql.connector.Error as err:
-            logger.error(f"MySQL error while updating task: {err}")
+        except storage.Error as err:
+            logger.error("Database error while updating task: %s", err)
             return jsonify({'error': 'Database error occurred'}), 500
         finally:
-            cursor.close()
             conn.close()
 
     except Exception as e:
-        logger.error(f"Error updating task: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error updating task: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/tasks/<int:task_id>', methods=['DELETE'])
-def delete_task(task_id):
+@bp.route('/api/tasks/<int:task_id>', methods=['DELETE'])
+@query_budget.limit(5)
+@token_required
+def delete_task(current_user, task_id):
     try:
-        user_id = get_user_from_token()
-        if not user_id:
-            return jsonify({'error': 'Unauthorized'}), 401
+        user_id = current_user['id']
 
         conn = get_db_connection()
-        cursor = conn.cursor()
 
         try:
-            # Check if task exists and belongs to user
-            cursor.execute("SELECT id FROM tasks WHERE id = %s AND user_id = %s", (task_id, user_id))
-            if not cursor.fetchone():
-                return jsonify({'error': 'Task not found'}), 404
+            flush_pending_toggles(user_id)
 
-            cursor.execute("DELETE FROM tasks WHERE id = %s AND user_id = %s", (task_id, user_id))
-            conn.commit()
+            # Deletes only a task that exists and belongs to the user
+            version = storage.delete_task(conn, user_id, task_id)
+            if version is None:
+                return jsonify({'error': 'Task not found'}), 404
+            pin_to_primary(user_id)
+            publish_changes(user_id, version, deleted=[task_id])
             return jsonify({'message': 'Task deleted successfully'})
 
-        except mysql.connector.Error as err:
-            logger.error(f"MySQL error while deleting task: {err}")
+        except storage.Error as err:
+            logger.error("Database error while deleting task: %s", err)
             return jsonify({'error': 'Database error occurred'}), 500
         finally:
-            cursor.close()
             conn.close()
 
     except Exception as e:
-        logger.error(f"Error deleting task: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error deleting task: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/')
+@bp.route('/')
 def home():
     return """
     <h1>Welcome to QuickTask API</h1>
@@ -491,64 +1172,170 @@ def home():
     </ul>
     """
 
-@app.route('/tasks', methods=['GET'])
+@bp.route('/tasks', methods=['GET'])
 def get_tasks_old():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM tasks")
+    conn = get_read_connection()
+    cursor = storage.query_all_tasks(conn)
+    fmt = stream_format(STREAM_TASK_LISTS)
+    if fmt:
+        return stream_rows(cursor, fmt, STREAM_BATCH_SIZE)
     tasks = cursor.fetchall()
     cursor.close()
     conn.close()
     return jsonify(tasks)
 
-@app.route('/tasks', methods=['POST'])
+@bp.route('/tasks', methods=['POST'])
 def create_task_old():
     data = request.json
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO tasks (title, description) VALUES (%s, %s)", (data['title'], data['description']))
-    conn.commit()
-    cursor.close()
+    storage.create_unowned_task(conn, data['title'], data['description'])
     conn.close()
     return jsonify({'message': 'Task created'}), 201
 
-@app.route('/tasks/<int:task_id>', methods=['PUT'])
+@bp.route('/tasks/<int:task_id>', methods=['PUT'])
 def update_task_old(task_id):
     data = request.json
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE tasks SET title=%s, description=%s, completed=%s WHERE id=%s",
-        (data['title'], data['description'], data['completed'], task_id)
-    )
-    conn.commit()
-    cursor.close()
+    storage.update_task_by_id(conn, task_id, data['title'], data['description'], data['completed'])
     conn.close()
     return jsonify({'message': 'Task updated'})
 
-@app.route('/tasks/<int:task_id>', methods=['DELETE'])
+@bp.route('/tasks/<int:task_id>', methods=['DELETE'])
 def delete_task_old(task_id):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM tasks WHERE id=%s", (task_id,))
-    conn.commit()
-    cursor.close()
+    storage.delete_task_by_id(conn, task_id)
     conn.close()
     return jsonify({'message': 'Task deleted'})
 
+@bp.cli.command('migrate')
+@click.option('--target', type=int, default=None, help='Stop at this version (default: latest).')
+@click.option('--dry-run', is_flag=True, help='Only list the pending migrations.')
+def migrate_command(target, dry_run):
+    """Apply pending schema migrations (on every shard)."""
+    for index, shard in enumerate(storage.shards):
+        if len(storage.shards) > 1:
+            click.echo(f"Shard {index}:")
+        conn = shard.acquire()
+        try:
+            version = current_version(shard, conn)
+        finally:
+            conn.close()
+        pending = pending_migrations(version, target)
+        click.echo(f"Schema version {version}, {len(pending)} pending")
+        for migration in pending:
+            click.echo(f"  {migration['version']}: {migration['name']}")
+        if dry_run or not pending:
+            continue
+        applied = migrate(shard, target)
+        click.echo(f"Applied {len(applied)} migrations")
+
+@bp.cli.command('recompute-stats')
+@click.option('--user-id', type=int, default=None, help='Only recompute this user.')
+def recompute_stats_command(user_id):
+    """Rebuild user_task_stats from the tasks table."""
+    # For counters suspected to have drifted, e.g. after writes made
+    # directly in the database.
+    conn = get_db_connection()
+    try:
+        storage.recompute_stats(conn, user_id)
+        click.echo("Task stats recomputed")
+    finally:
+        conn.close()
+
+@bp.cli.command('compact-tombstones')
+@click.option('--days', type=int, default=TOMBSTONE_RETENTION_DAYS, help='Keep tombstones newer than this.')
+@click.option('--batch-size', type=int, default=1000, help='Rows deleted per transaction.')
+def compact_tombstones_command(days, batch_size):
+    """Prune old deletion tombstones used by /api/tasks/changes."""
+    conn = get_db_connection()
+    try:
+        deleted = storage.compact_tombstones(conn, days, batch_size)
+        click.echo(f"Removed {deleted} tombstones older than {days} days")
+    finally:
+        conn.close()
+
+@bp.cli.command('archive-tasks')
+@click.option('--days', type=int, default=ARCHIVE_AFTER_DAYS, help='Archive tasks completed longer ago than this.')
+@click.option('--batch-size', type=int, default=1000, help='Tasks moved per transaction.')
+def archive_tasks_command(days, batch_size):
+    """Move old completed tasks from tasks to archived_tasks."""
+    conn = get_db_connection()
+    try:
+        archived = storage.archive_tasks(conn, days, batch_size)
+        click.echo(f"Archived {archived} tasks completed more than {days} days ago")
+    finally:
+        conn.close()
+
+def sharded_storage():
+    if not isinstance(storage, ShardedStorage):
+        raise click.ClickException("Sharding is not enabled (set MYSQL_SHARDS)")
+    return storage
+
+@bp.cli.command('shard-status')
+def shard_status_command():
+    """Show the buckets and users held by each shard."""
+    sharded = sharded_storage()
+    assignments = sharded.shard_map.assignments()
+    for index, shard in enumerate(sharded.shards):
+        buckets = [bucket for bucket, (owner, _, _) in assignments.items() if owner == index]
+        conn = shard.acquire()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT COUNT(*) FROM users")
+                users = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+        click.echo(f"Shard {index}: {len(buckets)} buckets, {users} users")
+    moving = {bucket: moving_to for bucket, (_, moving_to, _) in assignments.items() if moving_to is not None}
+    if moving:
+        click.echo(f"Moving: {moving}")
+
+@bp.cli.command('sync-user-directory')
+def sync_user_directory_command():
+    """Add every shard's users to the catalog's user directory."""
+    # Run once when an existing database becomes shard 0, so its users can log in
+    click.echo(f"Added {sharded_storage().sync_directory()} users to the directory")
+
+@bp.cli.command('rebalance-shards')
+@click.option('--dry-run', is_flag=True, help='Only show the buckets that would move.')
+@click.option('--batch-size', type=int, default=32, help='Buckets moved (and their users blocked) at a time.')
+@click.option('--wait', type=float, default=None,
+              help='Seconds for workers to see a move before copying (default: twice SHARD_MAP_TTL).')
+def rebalance_shards_command(dry_run, batch_size, wait):
+    """Spread the buckets evenly over the shards, moving their users."""
+    # Users of the buckets being moved get 503 until their batch is copied.
+    # --wait 0 is only safe while no worker is serving requests.
+    sharded = sharded_storage()
+    wait = sharded.shard_map.ttl * 2 if wait is None else wait
+    # A move interrupted by an earlier run is finished first
+    moved = 0 if dry_run else sharded.resume_moves()
+    moves = sharded.plan_rebalance()
+    click.echo(f"{len(moves)} buckets to move")
+    if dry_run:
+        for bucket, target in sorted(moves.items()):
+            click.echo(f"  bucket {bucket} -> shard {target}")
+        return
+    buckets = sorted(moves)
+    for start in range(0, len(buckets), batch_size):
+        batch = {bucket: moves[bucket] for bucket in buckets[start:start + batch_size]}
+        moved += sharded.move_buckets(batch, wait)
+        click.echo(f"Moved {min(start + batch_size, len(buckets))}/{len(buckets)} buckets")
+    click.echo(f"Moved {moved} users")
+
 if __name__ == '__main__':
+    # Development server only; see wsgi.py and asgi.py for production
     try:
+        app = create_app()
         # Test database connection before starting the server
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        result = cursor.fetchone()  # Fetch the result
-        cursor.close()
+        storage.ping(conn)
         conn.close()
         logger.info("Database connection test successful")
         
         # Start the Flask app
         app.run(host='127.0.0.1', port=5000, debug=True)
     except Exception as e:
-        logger.error(f"Failed to start server: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Failed to start server: %s", e)
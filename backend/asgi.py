@@ -0,0 +1,589 @@
+import asyncio
+import contextlib
+import json
+import logging
+import re
+import time
+
+import jwt
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+from werkzeug.wrappers import Request as WerkzeugRequest
+
+import app as flask_module
+import metrics
+import query_budget
+from app import CORS_CONFIG, create_app, decode_cursor, encode_cursor, make_tasks_etag, parse_bool_arg
+from async_storage import AsyncMySQLStorage
+from config import (STORAGE_BACKEND, MYSQL_CONFIG, MYSQL_REPLICA_CONFIGS, REPLICA_RETRY_AFTER, MYSQL_SHARD_CONFIGS,
+                    ASYNC_DB_POOL_CONFIG, ASGI_WSGI_THREADS,
+                    TASKS_PAGE_DEFAULT_LIMIT, TASKS_PAGE_MAX_LIMIT, STREAM_TASK_LISTS, STREAM_BATCH_SIZE,
+                    SSE_HEARTBEAT_SECONDS)
+from events import HEARTBEAT, ChangeFeed
+from rate_limit import OverloadedError, RateLimitedError, retry_after_header
+from storage import StorageBusyError
+from streaming import NDJSON_MIMETYPE
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('access')
+
+# Asyncio serving mode: `uvicorn asgi:app --workers N`.
+#
+# The task routes below (list, stats, change feed, create, update, delete)
+# run as coroutines on an aiomysql pool, so a worker holds thousands of slow
+# clients and open feeds without a thread each. Every other route, and CORS
+# preflight, is passed to the Flask app on a small thread pool. Both halves
+# share the auth cache, the rate limiter and admission control, the metrics
+# and the access log of the worker. With STORAGE_BACKEND=sqlite or with
+# sharding (MYSQL_SHARDS) there is no async driver, so everything is served
+# by the Flask app.
+
+
+class HTTPError(Exception):
+    def __init__(self, status, error, headers=None):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+        self.headers = headers or {}
+
+
+class Request:
+    """The parts of an ASGI request the task routes read."""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'')
+        # Parsed by werkzeug, like Flask's request.args: blank values are
+        # kept and get() returns the first of repeated parameters
+        self.args = WerkzeugRequest({'QUERY_STRING': self.query_string.decode('latin-1')}).args
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        self.body = body
+        self.user_id = None
+        self.admitted = False
+
+    def json(self):
+        try:
+            data = json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+
+class AsyncTaskApp:
+    def __init__(self, flask_app, storage=None):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+        self.storage = storage
+        self.json = flask_app.json
+        self.compression = flask_module.compression
+        # bytes-producing dumps of the app's JSON provider
+        self.encode = getattr(self.json, 'dumps_bytes', None) or (lambda obj: self.json.dumps(obj).encode('utf-8'))
+        self.routes = [
+            ('GET', re.compile(r'/api/tasks'), '/api/tasks', self.get_tasks),
+            ('POST', re.compile(r'/api/tasks'), '/api/tasks', self.create_task),
+            ('GET', re.compile(r'/api/tasks/stats'), '/api/tasks/stats', self.get_task_stats),
+            ('GET', re.compile(r'/api/tasks/events'), '/api/tasks/events', self.task_events),
+            ('PUT', re.compile(r'/api/tasks/(\d+)'), '/api/tasks/<int:task_id>', self.update_task),
+            ('DELETE', re.compile(r'/api/tasks/(\d+)'), '/api/tasks/<int:task_id>', self.delete_task)
+        ]
+        cors = CORS_CONFIG[r"/*"]
+        self.cors_origins = set(cors['origins'])
+        self.cors_expose = ', '.join(cors['expose_headers'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] == 'http' and self.storage is not None:
+            for method, pattern, rule, handler in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match and scope['method'] == method:
+                    await self.dispatch(scope, receive, send, rule, handler, match.groups())
+                    return
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.storage is not None:
+                        await self.storage.open()
+                        metrics.register_gauges('async_db_pool', 'Async connection pool state.', self.storage.stats)
+                    else:
+                        logger.warning("Storage backend %s has no async driver; all routes are served by Flask",
+                                       'sharded mysql' if MYSQL_SHARD_CONFIGS else STORAGE_BACKEND)
+                except Exception as e:
+                    logger.exception("Error opening the async connection pool: %s", e)
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.storage is not None:
+                    await self.storage.close()
+                # Acknowledged toggles are written before the pool goes away
+                if flask_module.coalescer is not None:
+                    await asyncio.to_thread(flask_module.coalescer.close)
+                flask_module.storage.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, scope, receive, send, rule, handler, params):
+        start = time.perf_counter()
+        # Counted per request task, against the budget declared on the handler
+        query_budget.begin(rule, getattr(handler, 'query_budget', None))
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        request = Request(scope, body)
+
+        try:
+            current_user = await self.authenticate(request)
+            status, headers, content = await handler(request, current_user, *params)
+        except HTTPError as e:
+            status, headers, content = e.status, e.headers, self.dumps({'error': e.error})
+        except RateLimitedError as e:
+            logger.info("Rate limited user %s", request.user_id)
+            status, headers, content = (429, {'Retry-After': retry_after_header(e.retry_after)},
+                                        self.dumps({'error': 'Too many requests'}))
+        except OverloadedError as e:
+            logger.warning("Request shed by admission control: %s", e)
+            status, headers, content = (503, {'Retry-After': retry_after_header(e.retry_after)},
+                                        self.dumps({'error': 'Server busy, please retry'}))
+        except StorageBusyError as e:
+            logger.warning("Database connection pool exhausted: %s", e)
+            status, headers, content = 503, {'Retry-After': '1'}, self.dumps({'error': 'Server busy, please retry'})
+        except (self.storage.Error, flask_module.storage.Error) as err:
+            logger.error("Database error in %s %s: %s", request.method, rule, err)
+            status, headers, content = 500, {}, self.dumps({'error': 'Database error occurred'})
+        except Exception as e:
+            logger.exception("Error in %s %s: %s", request.method, rule, e)
+            status, headers, content = 500, {}, self.dumps({'error': 'Internal server error'})
+
+        budget = query_budget.end()
+        if budget is not None and query_budget.mode == 'strict':
+            headers['X-Query-Count'] = str(budget.count)
+        if content:
+            headers.setdefault('Content-Type', 'application/json')
+        content = self.compress(request, status, headers, content)
+        for name, value in self.cors_headers(request).items():
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+        raw_headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+        try:
+            size = await self.send_response(send, status, raw_headers, content)
+        finally:
+            # A streamed list keeps its admission slot until the last row
+            if request.admitted:
+                flask_module.admission.leave()
+
+        elapsed = time.perf_counter() - start
+        if metrics.enabled:
+            metrics.REQUEST_LATENCY.observe(elapsed, request.method, rule, status)
+            if budget is not None and budget.exceeded:
+                metrics.QUERY_BUDGET_EXCEEDED.inc(rule)
+        if access_logger.isEnabledFor(logging.INFO):
+            access_logger.info(
+                "method=%s path=%s route=%s status=%s duration_ms=%.2f user=%s bytes=%s queries=%s",
+                request.method, request.path, rule, status, elapsed * 1000,
+                request.user_id or '-', size, budget.count if budget is not None else '-'
+            )
+
+    async def send_response(self, send, status, raw_headers, content):
+        # Returns the body size for the access log ('-' when streamed)
+        if isinstance(content, bytes):
+            raw_headers.append((b'content-length', str(len(content)).encode('latin-1')))
+            await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+            await send({'type': 'http.response.body', 'body': content})
+            return len(content)
+
+        # Streamed body: an async iterator of chunks
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        try:
+            async for chunk in content:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        except Exception as e:
+            # The status is already sent, so the body is simply cut short
+            logger.error("Error while streaming rows: %s", e)
+        finally:
+            # Releases the cursor and connection even if the client went away
+            await content.aclose()
+        await send({'type': 'http.response.body', 'body': b''})
+        return '-'
+
+    def dumps(self, obj):
+        # Same bytes as jsonify outside debug mode
+        return self.encode(obj) + b'\n'
+
+    def compress(self, request, status, headers, content):
+        # Same negotiation as ResponseCompression.apply in the Flask app
+        headers['Vary'] = f"{headers['Vary']}, Accept-Encoding" if 'Vary' in headers else 'Accept-Encoding'
+        length = len(content) if isinstance(content, bytes) else None
+        mimetype = headers.get('Content-Type', '').split(';')[0].strip()
+        if not content or not self.compression.should_compress(status, mimetype, headers.get('Content-Encoding'), length):
+            return content
+        encoding = self.compression.choose_encoding(parse_accept_header(request.headers.get('accept-encoding')))
+        if encoding is None:
+            return content
+
+        headers['Content-Encoding'] = encoding
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+        if isinstance(content, bytes):
+            return self.compression.compress(content, encoding)
+
+        compressor = self.compression.compressor(encoding)
+
+        async def body():
+            try:
+                async for chunk in content:
+                    data = compressor.compress(chunk)
+                    if data:
+                        yield data
+                yield compressor.finish()
+            finally:
+                await content.aclose()
+
+        return body()
+
+    def cors_headers(self, request):
+        origin = request.headers.get('origin')
+        if origin not in self.cors_origins:
+            return {}
+        return {
+            'Access-Control-Allow-Origin': origin,
+            'Access-Control-Allow-Credentials': 'true',
+            'Access-Control-Expose-Headers': self.cors_expose,
+            'Vary': 'Origin'
+        }
+
+    async def authenticate(self, request):
+        # Async counterpart of token_required / authenticate_token
+        auth_header = request.headers.get('authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            logger.warning("No token provided in request")
+            raise HTTPError(401, 'Token is missing')
+        token = auth_header.split(' ')[1]
+
+        # Shared with the Flask routes of this worker
+        flask_module.admission.enter()
+        request.admitted = True
+
+        auth_cache = flask_module.auth_cache
+        user_id = auth_cache.get_token_user_id(token)
+        if user_id is None:
+            try:
+                data = jwt.decode(token, self.flask_app.config['SECRET_KEY'], algorithms=['HS256'])
+            except jwt.ExpiredSignatureError:
+                logger.warning("Token has expired")
+                raise HTTPError(401, 'Token has expired')
+            except jwt.InvalidTokenError as e:
+                logger.warning("Invalid token: %s", e)
+                raise HTTPError(401, 'Invalid token')
+            user_id = data['user_id']
+            auth_cache.put_token(token, user_id, data['exp'])
+
+        current_user = auth_cache.get_user(user_id)
+        if current_user is None:
+            readonly = self.read_from_replica(user_id)
+            async with self.storage.acquire(readonly) as conn:
+                current_user = await self.storage.get_user(conn, user_id)
+            if current_user is None and readonly:
+                # A user who signed up moments ago may not be on the replica yet
+                async with self.storage.acquire() as conn:
+                    current_user = await self.storage.get_user(conn, user_id)
+            if not current_user:
+                logger.warning("User not found for token")
+                raise HTTPError(401, 'User not found')
+            auth_cache.put_user(current_user)
+
+        request.user_id = current_user['id']
+        flask_module.rate_limiter.check(current_user['id'])
+        return current_user
+
+    def read_from_replica(self, user_id):
+        # Same read-your-writes rule as get_read_connection; the pins are
+        # shared with the Flask routes of this worker
+        return self.storage.has_replicas and not flask_module.replica_pins.get(user_id)
+
+    def pin_to_primary(self, user_id):
+        if self.storage.has_replicas:
+            flask_module.replica_pins.set(user_id, True)
+
+    def stream_format(self, request):
+        # Same choice as streaming.stream_format
+        accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+        if request.args.get('format') == 'ndjson' or accept.best == NDJSON_MIMETYPE:
+            return 'ndjson'
+        stream = request.args.get('stream')
+        if stream is None:
+            return 'json' if STREAM_TASK_LISTS else None
+        return 'json' if stream in ('1', 'true') else None
+
+    @query_budget.limit(3)
+    async def get_tasks(self, request, current_user):
+        paginate = 'limit' in request.args or 'cursor' in request.args
+        try:
+            limit = request.args.get('limit', TASKS_PAGE_DEFAULT_LIMIT, type=int)
+            limit = max(1, min(limit, TASKS_PAGE_MAX_LIMIT))
+            cursor_arg = request.args.get('cursor')
+            after_id = decode_cursor(cursor_arg) if cursor_arg else None
+            completed = parse_bool_arg(request.args.get('completed'))
+            include_archived = bool(parse_bool_arg(request.args.get('include_archived')))
+        except ValueError:
+            raise HTTPError(400, 'Invalid pagination parameters')
+
+        fmt = None if paginate else self.stream_format(request)
+        user_id = current_user['id']
+        await self.flush_pending_toggles(user_id)
+
+        if fmt:
+            # The stream holds its connection until the last row is sent
+            return await self.stream_tasks(request, user_id, completed, include_archived, fmt)
+
+        async with self.storage.acquire(self.read_from_replica(user_id)) as conn:
+            version = await self.storage.get_data_version(conn, user_id)
+            etag = make_tasks_etag(user_id, version, request.query_string, fmt)
+            if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+                return 304, {'ETag': f'"{etag}"'}, b''
+
+            cursor = await self.storage.query_tasks(
+                conn, user_id, completed, after_id, limit + 1 if paginate else None, include_archived
+            )
+            try:
+                tasks = await cursor.fetchall()
+            finally:
+                await cursor.close()
+
+        if paginate:
+            next_cursor = None
+            if len(tasks) > limit:
+                tasks = tasks[:limit]
+                next_cursor = encode_cursor(tasks[-1]['id'])
+            content = self.dumps({"tasks": tasks, "next_cursor": next_cursor, "limit": limit})
+        else:
+            content = self.dumps(tasks)
+        return 200, self.list_headers(etag, version), content
+
+    async def stream_tasks(self, request, user_id, completed, include_archived, fmt):
+        connection = contextlib.AsyncExitStack()
+        conn = await connection.enter_async_context(self.storage.acquire(self.read_from_replica(user_id)))
+        try:
+            version = await self.storage.get_data_version(conn, user_id)
+            etag = make_tasks_etag(user_id, version, request.query_string, fmt)
+            if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+                await connection.aclose()
+                return 304, {'ETag': f'"{etag}"'}, b''
+            cursor = await self.storage.query_tasks(conn, user_id, completed, include_archived=include_archived)
+        except BaseException:
+            await connection.aclose()
+            raise
+
+        encode = self.encode
+
+        async def body():
+            try:
+                if fmt == 'json':
+                    yield b'['
+                first = True
+                while True:
+                    rows = await cursor.fetchmany(STREAM_BATCH_SIZE)
+                    if not rows:
+                        break
+                    if fmt == 'ndjson':
+                        chunk = b''.join(encode(row) + b'\n' for row in rows)
+                    else:
+                        # One encoder call per batch, as in streaming._json_array
+                        chunk = encode(rows)[1:-1]
+                        chunk = chunk if first else b',' + chunk
+                    first = False
+                    yield chunk
+                if fmt == 'json':
+                    yield b']\n'
+            finally:
+                await cursor.close()
+                await connection.aclose()
+
+        headers = self.list_headers(etag, version)
+        headers['Content-Type'] = NDJSON_MIMETYPE if fmt == 'ndjson' else 'application/json'
+        return 200, headers, body()
+
+    def list_headers(self, etag, version):
+        return {
+            'ETag': f'"{etag}"',
+            'Cache-Control': 'private, no-cache',
+            'Vary': 'Accept',
+            'X-Data-Version': str(version)
+        }
+
+    @query_budget.limit(2)
+    async def get_task_stats(self, request, current_user):
+        # Counts of live tasks, as in the Flask route
+        coalescer = flask_module.coalescer
+        if coalescer is not None and coalescer.has_pending(current_user['id']):
+            # Pending toggles are added under the coalescer's flush lock,
+            # so this read goes through the sync storage on a thread
+            stats = await asyncio.to_thread(self.read_pending_stats, current_user['id'])
+            return 200, {}, self.dumps(stats)
+        async with self.storage.acquire(self.read_from_replica(current_user['id'])) as conn:
+            stats = await self.storage.get_stats(conn, current_user['id'])
+        return 200, {}, self.dumps(stats)
+
+    def read_pending_stats(self, user_id):
+        storage = flask_module.storage
+        conn = storage.acquire(user_id=user_id)
+        try:
+            return flask_module.coalescer.read_stats(user_id, lambda: storage.get_stats(conn, user_id))
+        finally:
+            conn.close()
+
+    def publish_changes(self, user_id, version, changed=(), deleted=()):
+        # Same as app.publish_changes: no read, the write returned its version
+        flask_module.publish_changes(user_id, version, changed, deleted)
+
+    async def task_events(self, request, current_user):
+        # Same stream as the Flask route, one coroutine per client instead of
+        # one thread. Catch-ups from the change log run through the sync
+        # storage on a thread; the heartbeat version check stays async.
+        value = request.headers.get('last-event-id') or request.args.get('last_event_id')
+        try:
+            since = int(value) if value else None
+        except ValueError:
+            since = -1
+        if since is not None and since < 0:
+            raise HTTPError(400, 'Last-Event-ID must be a non-negative version')
+
+        user_id = current_user['id']
+        broker = flask_module.event_broker
+        subscription = broker.subscribe(user_id, asyncio.get_running_loop())
+        feed = ChangeFeed(self.encode, since or 0)
+        try:
+            await self.flush_pending_toggles(user_id)
+            if since is None:
+                async with self.storage.acquire() as conn:
+                    first = feed.ready(await self.storage.get_data_version(conn, user_id))
+            else:
+                first = await asyncio.to_thread(flask_module.read_feed_changes, feed, user_id)
+        except BaseException:
+            broker.unsubscribe(subscription)
+            raise
+
+        # An open feed does not count against admission control
+        flask_module.admission.leave()
+        request.admitted = False
+
+        async def body():
+            try:
+                yield b'retry: 3000\n\n' + first
+                while True:
+                    events = await subscription.get_async(SSE_HEARTBEAT_SECONDS)
+                    if not events:
+                        # Picks up writes served by other workers
+                        async with self.storage.acquire() as conn:
+                            version = await self.storage.get_data_version(conn, user_id)
+                        data = b''
+                        if version > feed.last_id:
+                            data = await asyncio.to_thread(flask_module.read_feed_changes, feed, user_id)
+                        yield data or HEARTBEAT
+                        continue
+                    data, catch_up = feed.messages(events)
+                    if catch_up:
+                        data += await asyncio.to_thread(flask_module.read_feed_changes, feed, user_id)
+                    if data:
+                        yield data
+            except (self.storage.Error, flask_module.storage.Error) as err:
+                # The client reconnects with Last-Event-ID
+                logger.warning("Ending change feed for user %s: %s", user_id, err)
+            finally:
+                broker.unsubscribe(subscription)
+
+        headers = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return 200, headers, body()
+
+    async def flush_pending_toggles(self, user_id):
+        # Same as app.flush_pending_toggles; the flush runs on a thread
+        coalescer = flask_module.coalescer
+        if coalescer is not None and coalescer.has_pending(user_id):
+            with query_budget.paused():
+                await asyncio.to_thread(coalescer.flush, user_id)
+
+    @query_budget.limit(3)
+    async def create_task(self, request, current_user):
+        data = request.json()
+        if not data:
+            logger.error("No data provided in request")
+            raise HTTPError(400, 'No data provided')
+        if 'title' not in data:
+            logger.error("Title is missing in request data")
+            raise HTTPError(400, 'Title is required')
+
+        async with self.storage.acquire() as conn:
+            task, version = await self.storage.create_task(
+                conn, current_user['id'], data['title'], data.get('description', ''), data.get('completed', False)
+            )
+        self.pin_to_primary(current_user['id'])
+        self.publish_changes(current_user['id'], version, changed=[task])
+        return 201, {}, self.dumps(task)
+
+    @query_budget.limit(5)
+    async def update_task(self, request, current_user, task_id):
+        data = request.json() or {}
+        title = data.get('title')
+        description = data.get('description')
+        completed = data.get('completed')
+        if not any([title, description, completed is not None]):
+            raise HTTPError(400, 'No valid fields to update')
+
+        user_id, task_id = current_user['id'], int(task_id)
+        coalescer = flask_module.coalescer
+        if coalescer is not None and completed is not None:
+            # Write-behind toggle, as in the Flask route
+            task = coalescer.get(user_id, task_id)
+            if task is None:
+                async with self.storage.acquire() as conn:
+                    task = await self.storage.get_task(conn, task_id)
+                if not task or task['user_id'] != user_id:
+                    raise HTTPError(404, 'Task not found')
+            if title in (None, task['title']) and description in (None, task['description']):
+                task = coalescer.toggle(task, bool(completed))
+                if task is not None:
+                    self.pin_to_primary(user_id)
+                    return 200, {}, self.dumps(task)
+        await self.flush_pending_toggles(user_id)
+
+        async with self.storage.acquire() as conn:
+            task, version = await self.storage.update_task(conn, user_id, task_id, title, description, completed)
+        if not task:
+            raise HTTPError(404, 'Task not found')
+        self.pin_to_primary(current_user['id'])
+        self.publish_changes(current_user['id'], version, changed=[task])
+        return 200, {}, self.dumps(task)
+
+    @query_budget.limit(5)
+    async def delete_task(self, request, current_user, task_id):
+        await self.flush_pending_toggles(current_user['id'])
+        async with self.storage.acquire() as conn:
+            version = await self.storage.delete_task(conn, current_user['id'], int(task_id))
+        if version is None:
+            raise HTTPError(404, 'Task not found')
+        self.pin_to_primary(current_user['id'])
+        self.publish_changes(current_user['id'], version, deleted=[int(task_id)])
+        return 200, {}, self.dumps({'message': 'Task deleted successfully'})
+
+
+def create_asgi_app():
+    flask_app = create_app()
+    storage = None
+    # Sharded storage has no async driver either
+    if STORAGE_BACKEND == 'mysql' and not MYSQL_SHARD_CONFIGS:
+        storage = AsyncMySQLStorage(MYSQL_CONFIG, MYSQL_REPLICA_CONFIGS, REPLICA_RETRY_AFTER, **ASYNC_DB_POOL_CONFIG)
+    return AsyncTaskApp(flask_app, storage)
+
+
+app = create_asgi_app()
@@ -0,0 +1,372 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+
+import aiomysql
+
+import metrics
+import query_budget
+from storage import TASK_COLUMNS, StorageBusyError, task_list_query, task_rows
+from task_archive import STAMP_COMPLETED_AT
+
+logger = logging.getLogger(__name__)
+
+
+# Task queries for the asyncio serving mode (asgi.py). The statements are the
+# MySQL ones MySQLStorage runs through task_stats and task_sync, issued on an
+# aiomysql pool so a slow query parks a coroutine instead of a thread. Only
+# the hot task routes live here; everything else is served by the Flask app.
+# Replicas work as in MySQLStorage: acquire(readonly=True) may return a
+# replica connection, and the read paths that write use the primary.
+
+
+class AsyncTaskCursor:
+    """aiomysql counterpart of storage.TaskCursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def fetchone(self):
+        row = await self._cursor.fetchone()
+        return task_rows((row,))[0] if row is not None else None
+
+    async def fetchmany(self, size=1):
+        return task_rows(await self._cursor.fetchmany(size))
+
+    async def fetchall(self):
+        return task_rows(await self._cursor.fetchall())
+
+    async def close(self):
+        await self._cursor.close()
+
+
+class AsyncMySQLStorage:
+    """MySQL storage for the async task routes, on an aiomysql pool."""
+
+    dialect = 'mysql'
+    Error = aiomysql.Error
+
+    def __init__(self, config, replica_configs=(), replica_retry_after=5.0,
+                 minsize=1, maxsize=20, timeout=5.0, recycle=3600):
+        self.config = config
+        self.replica_configs = list(replica_configs)
+        self.replica_retry_after = replica_retry_after
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pool = None
+        self.replica_pools = []
+        self._next_replica = itertools.count()
+        self._replica_down_until = []
+        self._replica_fallbacks = 0
+        self._timeouts = 0
+
+    @property
+    def has_replicas(self):
+        return bool(self.replica_configs)
+
+    async def _create_pool(self, config, minsize):
+        return await aiomysql.create_pool(
+            host=config.get('host', 'localhost'),
+            port=config.get('port', 3306),
+            user=config['user'],
+            password=config.get('password', ''),
+            db=config['database'],
+            minsize=minsize,
+            maxsize=self.maxsize,
+            pool_recycle=self.recycle,
+            autocommit=True
+        )
+
+    async def open(self):
+        self.pool = await self._create_pool(self.config, self.minsize)
+        # Replica pools start empty so a replica that is down does not stop
+        # the worker from starting; it is retried on checkout
+        for replica in self.replica_configs:
+            self.replica_pools.append(await self._create_pool(replica, 0))
+        self._replica_down_until = [0.0] * len(self.replica_pools)
+        logger.info("Async MySQL pool opened (max %s connections, %s replicas)",
+                    self.maxsize, len(self.replica_pools))
+
+    async def close(self):
+        for pool in [self.pool] + self.replica_pools:
+            if pool is not None:
+                pool.close()
+                await pool.wait_closed()
+        self.pool = None
+        self.replica_pools = []
+
+    def _pool_stats(self, pool):
+        return {
+            'size': pool.size,
+            'max_size': pool.maxsize,
+            'in_use': pool.size - pool.freesize,
+            'idle': pool.freesize
+        }
+
+    def stats(self):
+        if self.pool is None:
+            return {}
+        stats = dict(self._pool_stats(self.pool), timeouts=self._timeouts)
+        if self.replica_pools:
+            stats['replica_fallbacks'] = self._replica_fallbacks
+        return stats
+
+    async def _checkout(self, pool):
+        # Waits at most `timeout` seconds for a connection, like db_pool
+        try:
+            return await asyncio.wait_for(pool.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise StorageBusyError(f"No connection available within {self.timeout}s") from None
+
+    async def _checkout_replica(self):
+        # Same policy as MySQLStorage._acquire_replica
+        count = len(self.replica_pools)
+        first = next(self._next_replica)
+        for offset in range(count):
+            index = (first + offset) % count
+            if self._replica_down_until[index] > time.monotonic():
+                continue
+            pool = self.replica_pools[index]
+            try:
+                conn = await self._checkout(pool)
+            except StorageBusyError as e:
+                logger.warning("Replica %s busy: %s", index, e)
+                continue
+            except (self.Error, OSError) as err:
+                logger.warning("Replica %s unavailable for %ss: %s", index, self.replica_retry_after, err)
+                self._replica_down_until[index] = time.monotonic() + self.replica_retry_after
+                continue
+            conn.readonly = True
+            return pool, conn
+        self._replica_fallbacks += 1
+        return None, None
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, readonly=False):
+        start = time.perf_counter()
+        pool = conn = None
+        try:
+            if readonly and self.replica_pools:
+                pool, conn = await self._checkout_replica()
+            if conn is None:
+                pool = self.pool
+                conn = await self._checkout(pool)
+        finally:
+            if metrics.enabled:
+                metrics.POOL_ACQUIRE.observe(time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+    @contextlib.asynccontextmanager
+    async def _primary(self, conn):
+        # The connection itself, or a primary connection if it is a replica
+        if not getattr(conn, 'readonly', False):
+            yield conn
+            return
+        async with self.acquire() as primary:
+            yield primary
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, conn, dictionary=False):
+        await conn.begin()
+        cursor = await conn.cursor(aiomysql.DictCursor if dictionary else aiomysql.Cursor)
+        try:
+            yield cursor
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+        finally:
+            await cursor.close()
+
+    @contextlib.asynccontextmanager
+    async def _cursor(self, conn, dictionary=True):
+        cursor = await conn.cursor(aiomysql.DictCursor if dictionary else aiomysql.Cursor)
+        try:
+            yield cursor
+        finally:
+            await cursor.close()
+
+    async def _execute(self, cursor, query, params=()):
+        query_budget.record()
+        if not metrics.enabled:
+            await cursor.execute(query, params)
+            return
+        label = metrics.query_label(query)
+        start = time.perf_counter()
+        try:
+            await cursor.execute(query, params)
+        finally:
+            metrics.QUERY_LATENCY.observe(time.perf_counter() - start, label)
+            if cursor.rowcount and cursor.rowcount > 0:
+                metrics.QUERY_ROWS.inc(label, amount=cursor.rowcount)
+
+    # Users
+
+    async def get_user(self, conn, user_id):
+        async with self._cursor(conn) as cursor:
+            await self._execute(cursor, "SELECT id, username FROM users WHERE id = %s", (user_id,))
+            return await cursor.fetchone()
+
+    # Counters and data version (see task_stats)
+
+    async def _recompute_stats(self, cursor, user_id):
+        await self._execute(
+            cursor,
+            "INSERT INTO user_task_stats (user_id, total, completed) "
+            "SELECT %s, COUNT(*), COALESCE(SUM(completed), 0) FROM tasks WHERE user_id = %s "
+            "ON DUPLICATE KEY UPDATE total = VALUES(total), completed = VALUES(completed), "
+            "version = version + 1",
+            (user_id, user_id)
+        )
+
+    async def _apply_stats_delta(self, cursor, user_id, total_delta, completed_delta):
+        # Returns the new data version; LAST_INSERT_ID(expr) hands it back
+        # from the UPDATE itself
+        query = (
+            "UPDATE user_task_stats SET total = total + %s, completed = completed + %s, "
+            "version = LAST_INSERT_ID(version + 1) WHERE user_id = %s"
+        )
+        params = (total_delta, completed_delta, user_id)
+        await self._execute(cursor, query, params)
+        if not cursor.rowcount:
+            logger.info("Initializing task stats for user %s", user_id)
+            with query_budget.paused():
+                await self._recompute_stats(cursor, user_id)
+                await self._execute(cursor, query, params)
+        return cursor.lastrowid
+
+    async def get_data_version(self, conn, user_id):
+        async with self._cursor(conn, dictionary=False) as cursor:
+            await self._execute(cursor, "SELECT version FROM user_task_stats WHERE user_id = %s", (user_id,))
+            row = await cursor.fetchone()
+        if row is None:
+            with query_budget.paused():
+                async with self._primary(conn) as primary, self.transaction(primary) as cursor:
+                    await self._recompute_stats(cursor, user_id)
+                    await self._execute(cursor, "SELECT version FROM user_task_stats WHERE user_id = %s", (user_id,))
+                    row = await cursor.fetchone()
+        return int(row[0])
+
+    async def get_stats(self, conn, user_id):
+        query = "SELECT total, completed FROM user_task_stats WHERE user_id = %s"
+        async with self._cursor(conn, dictionary=False) as cursor:
+            await self._execute(cursor, query, (user_id,))
+            row = await cursor.fetchone()
+        if row is None:
+            with query_budget.paused():
+                async with self._primary(conn) as primary, self.transaction(primary) as cursor:
+                    await self._recompute_stats(cursor, user_id)
+                    await self._execute(cursor, query, (user_id,))
+                    row = await cursor.fetchone()
+        total, completed = int(row[0]), int(row[1])
+        return {'total': total, 'completed': completed, 'pending': total - completed}
+
+    # Tasks
+
+    async def query_tasks(self, conn, user_id, completed=None, after_id=None, limit=None, include_archived=False):
+        # Same keyset query as Storage.query_tasks. Returns the executed
+        # cursor, yielding task dicts; without a limit it is unbuffered so the caller can stream
+        # it with fetchmany(). The caller closes it.
+        query, params = task_list_query(user_id, completed, after_id, limit, include_archived)
+        cursor = await conn.cursor(aiomysql.SSCursor if limit is None else aiomysql.Cursor)
+        try:
+            await self._execute(cursor, query, params)
+        except BaseException:
+            await cursor.close()
+            raise
+        return AsyncTaskCursor(cursor)
+
+    async def get_task(self, conn, task_id):
+        async with self._cursor(conn, dictionary=False) as cursor:
+            await self._execute(cursor, f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = %s", (task_id,))
+            return await AsyncTaskCursor(cursor).fetchone()
+
+    async def create_task(self, conn, user_id, title, description='', completed=False):
+        # Returns the task as inserted and the data version of the write
+        async with self.transaction(conn) as cursor:
+            version = await self._apply_stats_delta(cursor, user_id, 1, 1 if completed else 0)
+            await self._execute(
+                cursor,
+                "INSERT INTO tasks (title, description, completed, user_id, row_version) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                (title, description, 1 if completed else 0, user_id, version)
+            )
+            task_id = cursor.lastrowid
+        task = {'id': task_id, 'title': title, 'description': description, 'completed': bool(completed),
+                'user_id': user_id}
+        return task, version
+
+    async def update_task(self, conn, user_id, task_id, title=None, description=None, completed=None):
+        # Returns the updated task and the data version of the write, or
+        # (None, None) if the user has no such task; built from the locked
+        # ownership read, as in Storage.update_task
+        async with self.transaction(conn) as cursor:
+            await self._execute(
+                cursor,
+                f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = %s AND user_id = %s FOR UPDATE",
+                (task_id, user_id)
+            )
+            task = await AsyncTaskCursor(cursor).fetchone()
+            if not task:
+                return None, None
+
+            update_fields = []
+            params = []
+            if title is not None:
+                update_fields.append("title = %s")
+                params.append(title)
+            if description is not None:
+                update_fields.append("description = %s")
+                params.append(description)
+            completed_delta = 0
+            if completed is not None:
+                update_fields.append(STAMP_COMPLETED_AT)
+                update_fields.append("completed = %s")
+                params.append(1 if completed else 0)
+                completed_delta = (1 if completed else 0) - (1 if task['completed'] else 0)
+
+            version = await self._apply_stats_delta(cursor, user_id, 0, completed_delta)
+            update_fields.append("row_version = %s")
+            params.append(version)
+            params.extend([task_id, user_id])
+            await self._execute(
+                cursor, f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = %s AND user_id = %s", params
+            )
+
+        if title is not None:
+            task['title'] = title
+        if description is not None:
+            task['description'] = description
+        if completed is not None:
+            task['completed'] = bool(completed)
+        return task, version
+
+    async def delete_task(self, conn, user_id, task_id):
+        # Returns the data version of the delete, or None if the user has no
+        # such task
+        async with self.transaction(conn) as cursor:
+            await self._execute(
+                cursor,
+                "SELECT id, completed FROM tasks WHERE id = %s AND user_id = %s FOR UPDATE",
+                (task_id, user_id)
+            )
+            task = await cursor.fetchone()
+            if not task:
+                return None
+
+            version = await self._apply_stats_delta(cursor, user_id, -1, -1 if task[1] else 0)
+            await self._execute(
+                cursor,
+                "INSERT INTO task_tombstones (task_id, user_id, version) VALUES (%s, %s, %s)",
+                (task_id, user_id, version)
+            )
+            await self._execute(cursor, "DELETE FROM tasks WHERE id = %s AND user_id = %s", (task_id, user_id))
+        return version
@@ -0,0 +1,115 @@
+import collections
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class AuthCache:
+    """Caches verified JWTs (by signature) and the user rows they resolve to.
+
+    A cached token only maps to a user id; the user record is cached
+    separately, so invalidate_user() is enough to force every token of a
+    deleted user back through the database lookup.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, enabled=True):
+        self.enabled = enabled
+        self.tokens = TTLCache(maxsize, ttl)
+        self.users = TTLCache(maxsize, ttl)
+
+    @staticmethod
+    def _token_key(token):
+        # The HMAC signature is unique per token and much shorter than it
+        return token.rpartition('.')[2]
+
+    def get_token_user_id(self, token):
+        if not self.enabled:
+            return None
+        return self.tokens.get(self._token_key(token))
+
+    def put_token(self, token, user_id, expires_at):
+        # Never serve a token from cache past its own exp claim
+        if self.enabled:
+            self.tokens.set(self._token_key(token), user_id, ttl=expires_at - time.time())
+
+    def get_user(self, user_id):
+        if not self.enabled:
+            return None
+        user = self.users.get(user_id)
+        return dict(user) if user is not None else None
+
+    def put_user(self, user):
+        if self.enabled:
+            self.users.set(user['id'], dict(user))
+
+    def invalidate_user(self, user_id):
+        self.users.pop(user_id)
+
+    def clear(self):
+        self.tokens.clear()
+        self.users.clear()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'tokens': self.tokens.stats(),
+            'users': self.users.stats()
+        }
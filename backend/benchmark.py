@@ -0,0 +1,348 @@
+import argparse
+import http.client
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+# Load-test and benchmark for the task API.
+#
+# Starts the Flask app in-process against the database in config.py (or
+# targets --base-url), seeds users and tasks through the API, then drives a
+# weighted mix of login/list/create/toggle/delete requests from concurrent
+# threads. Results are printed and written as JSON so runs can be compared:
+#
+#   python benchmark.py --users 20 --tasks-per-user 1000 --duration 30 --output base.json
+#   python benchmark.py --users 20 --tasks-per-user 1000 --duration 30 --compare base.json
+
+DEFAULT_MIX = 'list=40,list_all=5,stats=10,create=20,toggle=15,delete=5,login=5'
+PASSWORD = 'bench-password'
+
+
+class Client:
+    """One keep-alive HTTP connection per worker thread."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.conn = None
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.conn.request(method, path, body=payload, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+class User:
+    def __init__(self, email, token):
+        self.email = email
+        self.token = token
+        self.task_ids = []
+        self.lock = threading.Lock()
+
+    def pick_task(self, remove=False):
+        with self.lock:
+            if not self.task_ids:
+                return None
+            index = random.randrange(len(self.task_ids))
+            if remove:
+                self.task_ids[index], self.task_ids[-1] = self.task_ids[-1], self.task_ids[index]
+                return self.task_ids.pop()
+            return self.task_ids[index]
+
+    def add_tasks(self, ids):
+        with self.lock:
+            self.task_ids.extend(ids)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def seed(base_url, users, tasks_per_user, batch_size):
+    client = Client(base_url)
+    run_id = uuid.uuid4().hex[:8]
+    seeded = []
+    for i in range(users):
+        email = f'bench-{run_id}-{i}@example.com'
+        status, data = client.request('POST', '/api/auth/signup', {'name': f'bench {i}', 'email': email, 'password': PASSWORD})
+        if status != 201:
+            raise SystemExit(f"Signup failed ({status}): {data[:200]!r}")
+        user = User(email, json.loads(data)['token'])
+
+        remaining = tasks_per_user
+        while remaining > 0:
+            count = min(batch_size, remaining)
+            operations = [
+                {'op': 'create', 'title': f'Seed task {n}', 'description': 'benchmark seed', 'completed': n % 3 == 0}
+                for n in range(count)
+            ]
+            status, data = client.request('POST', '/api/tasks/batch', {'operations': operations}, user.token)
+            if status != 200:
+                raise SystemExit(f"Seeding failed ({status}): {data[:200]!r}")
+            user.add_tasks([r['task']['id'] for r in json.loads(data)['results'] if r['status'] == 201])
+            remaining -= count
+        seeded.append(user)
+    return seeded
+
+
+def op_list(client, user):
+    return client.request('GET', '/api/tasks?limit=50', token=user.token)
+
+
+def op_list_all(client, user):
+    return client.request('GET', '/api/tasks', token=user.token)
+
+
+def op_stats(client, user):
+    return client.request('GET', '/api/tasks/stats', token=user.token)
+
+
+def op_create(client, user):
+    status, data = client.request('POST', '/api/tasks', {'title': 'Benchmark task', 'description': 'created'}, user.token)
+    if status == 201:
+        user.add_tasks([json.loads(data)['id']])
+    return status, data
+
+
+def op_toggle(client, user):
+    task_id = user.pick_task()
+    if task_id is None:
+        return op_create(client, user)
+    return client.request('PUT', f'/api/tasks/{task_id}', {'completed': random.random() < 0.5}, user.token)
+
+
+def op_delete(client, user):
+    task_id = user.pick_task(remove=True)
+    if task_id is None:
+        return op_create(client, user)
+    return client.request('DELETE', f'/api/tasks/{task_id}', token=user.token)
+
+
+def op_login(client, user):
+    return client.request('POST', '/api/auth/login', {'email': user.email, 'password': PASSWORD})
+
+
+OPERATIONS = {
+    'list': op_list,
+    'list_all': op_list_all,
+    'stats': op_stats,
+    'create': op_create,
+    'toggle': op_toggle,
+    'delete': op_delete,
+    'login': op_login
+}
+
+
+def run_load(base_url, users, weights, threads, duration, warmup):
+    names = list(weights)
+    cumulative = []
+    total = 0.0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def worker():
+        client = Client(base_url)
+        local_latencies = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            point = random.random() * total
+            name = next(n for n, c in zip(names, cumulative) if point < c)
+            user = random.choice(users)
+            began = time.perf_counter()
+            try:
+                status, _ = OPERATIONS[name](client, user)
+                failed = status >= 400
+            except (http.client.HTTPException, OSError):
+                failed = True
+            elapsed = time.perf_counter() - began
+            if now >= measure_from:
+                local_latencies[name].append(elapsed)
+                if failed:
+                    local_errors[name] += 1
+        with lock:
+            for name in names:
+                latencies[name].extend(local_latencies[name])
+                errors[name] += local_errors[name]
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latencies, errors
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, duration):
+    endpoints = {}
+    all_values = []
+    for name, values in latencies.items():
+        values.sort()
+        all_values.extend(values)
+        endpoints[name] = {
+            'count': len(values),
+            'errors': errors[name],
+            'throughput_rps': round(len(values) / duration, 2),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else None,
+            'p50_ms': round(percentile(values, 50) * 1000, 3) if values else None,
+            'p95_ms': round(percentile(values, 95) * 1000, 3) if values else None,
+            'p99_ms': round(percentile(values, 99) * 1000, 3) if values else None
+        }
+    all_values.sort()
+    overall = {
+        'count': len(all_values),
+        'errors': sum(errors.values()),
+        'throughput_rps': round(len(all_values) / duration, 2),
+        'p50_ms': round(percentile(all_values, 50) * 1000, 3) if all_values else None,
+        'p95_ms': round(percentile(all_values, 95) * 1000, 3) if all_values else None,
+        'p99_ms': round(percentile(all_values, 99) * 1000, 3) if all_values else None
+    }
+    return endpoints, overall
+
+
+def print_report(endpoints, overall, baseline=None):
+    header = f"{'endpoint':<10} {'count':>8} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    rows = list(endpoints.items()) + [('TOTAL', overall)]
+    for name, stats in rows:
+        line = (f"{name:<10} {stats['count']:>8} {stats['errors']:>7} {stats['throughput_rps']:>9} "
+                f"{stats['p50_ms'] or '-':>9} {stats['p95_ms'] or '-':>9} {stats['p99_ms'] or '-':>9}")
+        if baseline:
+            base = baseline['overall'] if name == 'TOTAL' else baseline['endpoints'].get(name)
+            if base and base.get('p95_ms') and stats['p95_ms']:
+                change = (stats['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100
+                line += f"   p95 {change:+.1f}% vs baseline"
+        print(line)
+
+
+def start_server(port):
+    # Imported here so --base-url runs do not need database access locally
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app as app_module
+    app = app_module.create_app()
+    # A handful of users issue every request, so per-user rate limits would
+    # only measure 429s
+    app_module.rate_limiter.enabled = False
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the QuickTask API.')
+    parser.add_argument('--base-url', help='Benchmark a running server instead of starting one in-process.')
+    parser.add_argument('--port', type=int, default=0, help='Port for the in-process server (0 = any free port).')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--tasks-per-user', type=int, default=500)
+    parser.add_argument('--seed-batch-size', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0, help='Measured seconds.')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Unmeasured seconds before measuring.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Operation weights (default: {DEFAULT_MIX}).')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for a repeatable operation sequence.')
+    parser.add_argument('--output', help='Write machine-readable results to this JSON file.')
+    parser.add_argument('--compare', help='Baseline results JSON to compare p95 latencies against.')
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    weights = parse_mix(args.mix)
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server, base_url = start_server(args.port)
+        logging.getLogger('access').setLevel(logging.WARNING)
+
+    try:
+        print(f"Seeding {args.users} users x {args.tasks_per_user} tasks on {base_url} ...", file=sys.stderr)
+        users = seed(base_url, args.users, args.tasks_per_user, args.seed_batch_size)
+
+        print(f"Running {args.threads} threads for {args.duration}s (+{args.warmup}s warmup) ...", file=sys.stderr)
+        latencies, errors = run_load(base_url, users, weights, args.threads, args.duration, args.warmup)
+    finally:
+        if server:
+            server.shutdown()
+
+    endpoints, overall = summarize(latencies, errors, args.duration)
+    results = {
+        'config': {
+            'users': args.users,
+            'tasks_per_user': args.tasks_per_user,
+            'threads': args.threads,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'mix': weights,
+            'base_url': args.base_url or 'in-process'
+        },
+        'endpoints': endpoints,
+        'overall': overall
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(endpoints, overall, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import logging
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Response compression negotiated from Accept-Encoding. Buffered bodies are
+# compressed when they reach min_size bytes; streamed bodies (full task
+# lists) are compressed chunk by chunk, flushing after each chunk so rows
+# still reach the client as they are read.
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/csv'}
+
+
+class Compressor:
+    """Incremental gzip or brotli encoder with a common interface."""
+
+    def __init__(self, encoding, gzip_level=6, brotli_quality=4):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 16 + MAX_WBITS: gzip header and trailer
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        # Returns everything needed to decode `data` so far
+        if self.encoding == 'br':
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+class ResponseCompression:
+    def __init__(self, enabled=True, min_size=1024, gzip_level=6, brotli_quality=4):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def choose_encoding(self, accept_encoding):
+        # Brotli when the client takes it and the module is installed, then
+        # gzip; None for identity. accept_encoding is werkzeug's Accept.
+        if brotli is not None and accept_encoding['br']:
+            return 'br'
+        if accept_encoding['gzip']:
+            return 'gzip'
+        return None
+
+    def compressor(self, encoding):
+        return Compressor(encoding, self.gzip_level, self.brotli_quality)
+
+    def compress(self, data, encoding):
+        compressor = self.compressor(encoding)
+        return compressor.compress(data) + compressor.finish()
+
+    def compress_stream(self, chunks, encoding):
+        compressor = self.compressor(encoding)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            # Ends the wrapped stream (and releases its cursor) if the
+            # client goes away mid-response
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    def should_compress(self, status, mimetype, content_encoding, length):
+        if not self.enabled or content_encoding or status < 200 or status in (204, 206, 304):
+            return False
+        if mimetype not in COMPRESSIBLE_MIMETYPES:
+            return False
+        # Streamed bodies have no length and are large by nature
+        return length is None or length >= self.min_size
+
+    def apply(self, response):
+        # after_request hook for the Flask app
+        response.vary.add('Accept-Encoding')
+        length = None if response.is_streamed else response.content_length
+        if not self.should_compress(response.status_code, response.mimetype,
+                                    response.headers.get('Content-Encoding'), length):
+            return response
+        encoding = self.choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(self.compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+
+        # The encoded body is a different representation: a strong ETag
+        # must not be shared with the identity one
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
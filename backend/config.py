@@ -1,6 +1,199 @@
+import os
+
 MYSQL_CONFIG = {
-    'host': 'localhost',
+    'host': os.environ.get('MYSQL_HOST', 'localhost'),
+    'port': int(os.environ.get('MYSQL_PORT', 3306)),
     'user': 'root',
     'password': 'root',  # <-- PUT your MySQL password here
     'database': 'quicktask'
 }
+
+# Read replicas as a comma separated list of host[:port], e.g.
+# MYSQL_REPLICAS=10.0.0.2,10.0.0.3:3307. They share MYSQL_CONFIG's
+# credentials and database, and each gets a pool sized like DB_POOL_CONFIG.
+MYSQL_REPLICA_CONFIGS = [
+    dict(MYSQL_CONFIG, host=host, port=int(port or 3306))
+    for host, _, port in (replica.strip().partition(':')
+                          for replica in os.environ.get('MYSQL_REPLICAS', '').split(',') if replica.strip())
+]
+# After a task write, that user's reads go to the primary for this many
+# seconds (read-your-writes); keep it above the usual replica lag
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+# Seconds a replica that failed to connect is skipped before it is tried again
+REPLICA_RETRY_AFTER = float(os.environ.get('REPLICA_RETRY_AFTER', 5))
+
+# User-keyed sharding (MySQL only), off unless MYSQL_SHARDS lists the shards
+# as host[:port][/database], e.g. MYSQL_SHARDS=10.0.0.5,10.0.0.6:3307/qt2.
+# The first is the catalog, which also holds the user directory and the
+# bucket map. They share MYSQL_CONFIG's credentials and DB_POOL_CONFIG. See
+# sharding.py; `buckets` and SHARD_ID_STRIDE must never change once data exists.
+MYSQL_SHARD_CONFIGS = [
+    dict(MYSQL_CONFIG, host=host, port=int(port or 3306), database=database or MYSQL_CONFIG['database'])
+    for address, _, database in (shard.strip().partition('/')
+                                 for shard in os.environ.get('MYSQL_SHARDS', '').split(',') if shard.strip())
+    for host, _, port in (address.partition(':'),)
+]
+SHARDING_CONFIG = {
+    'buckets': int(os.environ.get('SHARD_BUCKETS', 1024)),
+    'id_stride': int(os.environ.get('SHARD_ID_STRIDE', 64)),  # most shards ever; task ids step by this
+    'map_ttl': float(os.environ.get('SHARD_MAP_TTL', 5))  # seconds a worker keeps the bucket map
+}
+
+# Storage backend: 'mysql' (MYSQL_CONFIG and DB_POOL_CONFIG below) or
+# 'sqlite' for an embedded database file on single-node deployments
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mysql')
+
+SQLITE_CONFIG = {
+    'path': os.environ.get('SQLITE_PATH', 'quicktask.db'),
+    'busy_timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5)),  # seconds to wait for the write lock
+    'cached_statements': int(os.environ.get('SQLITE_CACHED_STATEMENTS', 256)),  # prepared statements per connection
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size_kb': int(os.environ.get('SQLITE_CACHE_SIZE_KB', 65536)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))
+}
+
+# Apply pending schema migrations when the app starts instead of only
+# checking the version. Leave off for multi-worker deployments and run
+# `flask --app app migrate` once per release instead.
+MIGRATE_ON_START = os.environ.get('MIGRATE_ON_START', '0') == '1'
+
+# Connection pool used by get_db_connection() with the MySQL backend
+DB_POOL_CONFIG = {
+    'size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 5)),
+    'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 5)),  # seconds to wait for a free connection
+    'recycle': int(os.environ.get('DB_POOL_RECYCLE', 3600)),  # seconds before a connection is reopened
+    'pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+    # Prepared statements kept per connection for the fixed single-task queries
+    'statement_cache_size': int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 16))
+}
+
+# Async pool used by the task routes when served by asgi.py (uvicorn)
+ASYNC_DB_POOL_CONFIG = {
+    'minsize': int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', 1)),
+    'maxsize': int(os.environ.get('ASYNC_DB_POOL_SIZE', 20)),
+    'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 5)),  # seconds to wait for a free connection
+    'recycle': int(os.environ.get('DB_POOL_RECYCLE', 3600))  # seconds before a connection is reopened
+}
+
+# Threads that run the Flask (WSGI) routes under asgi.py; the async task
+# routes do not use them
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 10))
+
+# Keyset pagination for GET /api/tasks
+TASKS_PAGE_DEFAULT_LIMIT = int(os.environ.get('TASKS_PAGE_DEFAULT_LIMIT', 50))
+TASKS_PAGE_MAX_LIMIT = int(os.environ.get('TASKS_PAGE_MAX_LIMIT', 200))
+
+# Cache of verified tokens and user rows used by token_required
+AUTH_CACHE_CONFIG = {
+    'enabled': os.environ.get('AUTH_CACHE_ENABLED', '1') == '1',
+    'maxsize': int(os.environ.get('AUTH_CACHE_SIZE', 10000)),
+    'ttl': int(os.environ.get('AUTH_CACHE_TTL', 60))  # seconds
+}
+
+# Maximum operations accepted by POST /api/tasks/batch
+BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', 500))
+
+# Tasks written per transaction by POST /api/tasks/import
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+
+# Delta sync: largest delta served by /api/tasks/changes before asking for a
+# full reload, and how long deletion tombstones are kept
+SYNC_MAX_CHANGES = int(os.environ.get('SYNC_MAX_CHANGES', 1000))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+
+# Completed tasks older than this are moved out of the live tasks table by
+# `flask --app app archive-tasks` (see task_archive.py)
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+
+# Stream full task lists from a server-side cursor instead of building them
+# in memory (clients can still pass ?stream=0), and rows fetched per batch
+STREAM_TASK_LISTS = os.environ.get('STREAM_TASK_LISTS', '1') == '1'
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+
+# JSON encoder for responses: 'orjson' (falls back to 'json' if missing)
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'orjson')
+
+# gzip/brotli response compression, negotiated from Accept-Encoding. Bodies
+# under min_size bytes go out as they are; brotli needs the brotli package.
+COMPRESSION_CONFIG = {
+    'enabled': os.environ.get('COMPRESSION_ENABLED', '1') == '1',
+    'min_size': int(os.environ.get('COMPRESS_MIN_SIZE', 1024)),
+    'gzip_level': int(os.environ.get('GZIP_LEVEL', 6)),
+    'brotli_quality': int(os.environ.get('BROTLI_QUALITY', 4))
+}
+
+# Live change feed (GET /api/tasks/events): seconds between keep-alives,
+# which also check for writes served by other workers, and events buffered
+# per stream before a slow client is caught up from the database instead
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+SSE_MAX_QUEUE = int(os.environ.get('SSE_MAX_QUEUE', 100))
+
+# Full-text search: page size cap and deepest offset served
+SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', 100))
+SEARCH_MAX_OFFSET = int(os.environ.get('SEARCH_MAX_OFFSET', 1000))
+
+# bcrypt work factor and the worker pool that runs it. Changing the rounds
+# upgrades existing hashes the next time each user logs in.
+PASSWORD_HASH_CONFIG = {
+    'rounds': int(os.environ.get('BCRYPT_ROUNDS', 12)),
+    'workers': int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+    'max_pending': int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16)),  # queued beyond this -> 503
+    'timeout': float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+}
+
+# Per-user token bucket on the authenticated API: `rate` requests per second
+# with bursts of `burst`, over the limit -> 429. Set RATE_LIMIT_REDIS_URL to
+# share the buckets between workers and hosts (needs the redis package).
+RATE_LIMIT_CONFIG = {
+    'enabled': os.environ.get('RATE_LIMIT_ENABLED', '1') == '1',
+    'rate': float(os.environ.get('RATE_LIMIT_RATE', 10)),
+    'burst': int(os.environ.get('RATE_LIMIT_BURST', 20)),
+    'redis_url': os.environ.get('RATE_LIMIT_REDIS_URL') or None
+}
+
+# Admission control per worker: requests using the database at once, and
+# requests already waiting for a pool connection, beyond which new ones get
+# 503 with Retry-After instead of queueing
+ADMISSION_CONFIG = {
+    'enabled': os.environ.get('ADMISSION_ENABLED', '1') == '1',
+    'max_in_flight': int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 64)),
+    'max_queue': int(os.environ.get('ADMISSION_MAX_QUEUE', 16)),
+    'retry_after': float(os.environ.get('ADMISSION_RETRY_AFTER', 1))
+}
+
+# Write-behind for completion toggles (off by default): a PUT that only
+# changes `completed` is acknowledged from memory and written with the other
+# toggles of its `window`. Acknowledged toggles are lost if the worker is
+# killed before the flush; see write_behind.py.
+WRITE_BEHIND_TOGGLES = os.environ.get('WRITE_BEHIND_TOGGLES', '0') == '1'
+WRITE_BEHIND_CONFIG = {
+    'window': int(os.environ.get('WRITE_BEHIND_WINDOW_MS', 200)) / 1000,
+    'max_pending': int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 10000))
+}
+
+# Request, query, pool and bcrypt instrumentation served on /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# Per-request query-count budgets declared on the task routes: 'log' logs
+# and counts requests over budget, 'strict' fails them (for tests, which can
+# also read X-Query-Count), 'off' stops counting.
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'log')
+
+# Logging: records go through a queue to a background writer thread.
+# Hot-path info lines are sampled; warnings and errors are always kept.
+HOT_PATH_LOG_SAMPLE_RATE = float(os.environ.get('HOT_PATH_LOG_SAMPLE_RATE', 0.1))
+LOGGING_CONFIG = {
+    'level': os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    'access_level': os.environ.get('ACCESS_LOG_LEVEL', 'INFO').upper(),
+    'sample_rate': float(os.environ.get('LOG_SAMPLE_RATE', 1.0)),
+    'access_sample_rate': float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1.0)),
+    'sample_rates': {
+        'Streaming tasks as %s': HOT_PATH_LOG_SAMPLE_RATE,
+        'Successfully fetched %s tasks': HOT_PATH_LOG_SAMPLE_RATE,
+        'Successfully fetched page of %s tasks': HOT_PATH_LOG_SAMPLE_RATE,
+        'Sync since %s for user %s: %s changed, %s deleted': HOT_PATH_LOG_SAMPLE_RATE,
+        'Search for user %s returned %s tasks': HOT_PATH_LOG_SAMPLE_RATE,
+        'Rate limited user %s': HOT_PATH_LOG_SAMPLE_RATE
+    }
+}
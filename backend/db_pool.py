@@ -0,0 +1,295 @@
+import collections
+import logging
+import threading
+import time
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+import metrics
+from storage import StorageBusyError
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(PoolError, StorageBusyError):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+class StatementCache:
+    """Server-side prepared statements of one connection, by query text.
+
+    The driver keeps one prepared statement per cursor and only reuses it
+    when execute() gets the very same string object, so each query gets its
+    own cursor and execute() must be given the cached string. When more than
+    `size` queries are cached, the least recently used one is deallocated.
+    """
+
+    def __init__(self, raw, size):
+        self._raw = raw
+        self.size = size
+        self._cursors = collections.OrderedDict()  # (query, dictionary) -> (query, cursor)
+
+    def get(self, query, dictionary):
+        key = (query, dictionary)
+        entry = self._cursors.get(key)
+        if entry is not None:
+            self._cursors.move_to_end(key)
+            return entry
+        entry = self._cursors[key] = (query, self._raw.cursor(prepared=True, dictionary=dictionary))
+        if len(self._cursors) > self.size:
+            _, (_, evicted) = self._cursors.popitem(last=False)
+            evicted.close()
+        return entry
+
+
+class PreparedCursor:
+    """Cursor that runs each query as a cached prepared statement.
+
+    The result is read in full by execute(), so statements cached on the
+    same connection can be used in turn. Only for queries with small
+    results: the fixed statements of the single-task routes.
+    """
+
+    def __init__(self, statements, dictionary=False):
+        self._statements = statements
+        self._dictionary = dictionary
+        self._rows = None
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    @property
+    def with_rows(self):
+        return self._rows is not None
+
+    def execute(self, query, params=()):
+        query, cursor = self._statements.get(query, self._dictionary)
+        cursor.execute(query, tuple(params))
+        self.description = cursor.description
+        self._rows = collections.deque(cursor.fetchall()) if cursor.with_rows else None
+        self.rowcount = len(self._rows) if self._rows is not None else cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+
+    def fetchone(self):
+        return self._rows.popleft() if self._rows else None
+
+    def fetchmany(self, size=1):
+        return [self._rows.popleft() for _ in range(min(size, len(self._rows or ())))]
+
+    def fetchall(self):
+        rows = list(self._rows or ())
+        if self._rows:
+            self._rows.clear()
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        # The statements stay prepared on the connection
+        self._rows = None
+
+
+class PooledConnection:
+    """A MySQL connection checked out from a ConnectionPool.
+
+    Everything except close() is delegated to the underlying connection, so
+    existing route code can keep calling cursor()/commit()/close() unchanged.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        # Connection to a read replica (see Storage.acquire)
+        self.readonly = pool.readonly
+        self.created_at = time.monotonic()
+        self.checked_out = False
+        # Request-scoped connections are shared by the auth decorator and the
+        # handler; they go back to the pool on request teardown, not on close().
+        self.request_scoped = False
+        self.statements = StatementCache(raw, pool.statement_cache_size) if pool.statement_cache_size else None
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, prepared=False, **kwargs):
+        # prepared=True: the query is prepared once per connection and reused
+        # (see StatementCache); a plain cursor if the cache is off
+        if prepared and self.statements is not None:
+            cursor = PreparedCursor(self.statements, kwargs.get('dictionary', False))
+        else:
+            cursor = self._raw.cursor(*args, **kwargs)
+        return metrics.wrap_cursor(cursor)
+
+    def close(self):
+        if self.request_scoped:
+            return
+        self.release()
+
+    def release(self):
+        if self.checked_out:
+            self._pool._return(self)
+
+
+class ConnectionPool:
+    def __init__(self, config, size=10, max_overflow=5, timeout=5.0, recycle=3600, pre_ping=True,
+                 statement_cache_size=16, readonly=False):
+        self._config = dict(config)
+        self.readonly = readonly
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        # Prepared statements cached per connection; 0 disables
+        self.statement_cache_size = statement_cache_size
+
+        self._idle = collections.deque()
+        self._cond = threading.Condition()
+        self._opened = 0  # idle + checked out
+        self._in_use = 0
+        self._waiters = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._connects = 0
+        self._recycled = 0
+        self._invalidated = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self._config)
+        with self._cond:
+            self._connects += 1
+        logger.debug("Opened new pooled MySQL connection")
+        return PooledConnection(self, raw)
+
+    def _discard(self, conn):
+        try:
+            conn._raw.close()
+        except Exception:
+            pass
+
+    def _validate(self, conn):
+        if self.recycle and time.monotonic() - conn.created_at > self.recycle:
+            self._discard(conn)
+            with self._cond:
+                self._recycled += 1
+            return self._connect()
+        if self.pre_ping:
+            try:
+                conn._raw.ping(reconnect=False)
+            except mysql.connector.Error:
+                logger.warning("Discarding stale pooled MySQL connection")
+                self._discard(conn)
+                with self._cond:
+                    self._invalidated += 1
+                return self._connect()
+        return conn
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._opened < self.size + self.max_overflow:
+                    # Reserve a slot; the connection is opened outside the lock
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a database connection"
+                    )
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+
+            waited = time.monotonic() - start
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        try:
+            conn = self._connect() if conn is None else self._validate(conn)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+        conn.checked_out = True
+        return conn
+
+    def _return(self, conn):
+        conn.checked_out = False
+        conn.request_scoped = False
+
+        # Never hand the next borrower an open transaction (or a stale
+        # REPEATABLE READ snapshot left behind by a plain SELECT).
+        broken = False
+        try:
+            if conn._raw.in_transaction:
+                conn._raw.rollback()
+        except Exception:
+            broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            keep = not broken and not self._closed and len(self._idle) < self.size
+            if keep:
+                self._idle.append(conn)
+            else:
+                self._opened -= 1
+            self._cond.notify()
+
+        if not keep:
+            self._discard(conn)
+
+    def dispose(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    @property
+    def waiters(self):
+        return self._waiters
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'statement_cache_size': self.statement_cache_size,
+                'opened': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiters': self._waiters,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'connects': self._connects,
+                'recycled': self._recycled,
+                'invalidated': self._invalidated,
+                'wait_time_total': round(self._wait_total, 6),
+                'wait_time_max': round(self._wait_max, 6),
+                'wait_time_avg': round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+            }
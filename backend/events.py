@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Live task changes for GET /api/tasks/events (Server-Sent Events). Write
+# routes publish {"version", "changed", "deleted"} (the shape of
+# /api/tasks/changes, with the version the write stamped) to the user's
+# subscribers after commit. The event id
+# is the user's data version, so a client resuming with Last-Event-ID is
+# caught up through task_sync like any other sync client.
+#
+# The broker is per worker. A subscriber also compares the stored data
+# version at every heartbeat, so writes served by other workers (or other
+# hosts) reach it within one heartbeat interval.
+
+HEARTBEAT = b': keep-alive\n\n'
+
+
+def sse_message(data, event=None, event_id=None):
+    # data is encoded JSON (bytes) without newlines
+    lines = []
+    if event_id is not None:
+        lines.append(b'id: %d' % event_id)
+    if event is not None:
+        lines.append(b'event: ' + event.encode('ascii'))
+    lines.append(b'data: ' + data)
+    return b'\n'.join(lines) + b'\n\n'
+
+
+class Subscription:
+    """Queue of one stream's pending events, waited on by a thread or a coroutine.
+
+    A None event asks the stream to catch up from the database. When more
+    than `maxsize` events are waiting the queue is replaced by a single
+    None, so a slow client costs a catch-up instead of unbounded memory.
+    """
+
+    def __init__(self, user_id, maxsize=100, loop=None):
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event() if loop is not None else threading.Event()
+        self.overflows = 0
+
+    def put(self, event):
+        with self._lock:
+            if len(self._events) >= self.maxsize:
+                self._events.clear()
+                self._events.append(None)
+                self.overflows += 1
+            else:
+                self._events.append(event)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        else:
+            self._ready.set()
+
+    def _drain(self):
+        self._ready.clear()
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def get(self, timeout):
+        # Events queued so far; [] if none arrived within `timeout`
+        deadline = time.monotonic() + timeout
+        while self._ready.wait(max(0.0, deadline - time.monotonic())):
+            # A wake-up can find the queue already drained; keep waiting
+            events = self._drain()
+            if events:
+                return events
+        return []
+
+    async def get_async(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await asyncio.wait_for(self._ready.wait(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                return []
+            events = self._drain()
+            if events:
+                return events
+
+
+class EventBroker:
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = {}  # user_id -> {Subscription}
+        self._lock = threading.Lock()
+        self._published = 0
+        self._delivered = 0
+
+    def subscribe(self, user_id, loop=None):
+        # loop: the running event loop, for subscribers waiting with get_async()
+        subscription = Subscription(user_id, self.max_queue, loop)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def publish(self, user_id, changes):
+        # changes: {"version", "changed", "deleted"}, or None when only the
+        # database knows what changed
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            self._published += 1
+            self._delivered += len(subscribers)
+        for subscription in subscribers:
+            subscription.put(changes)
+
+    def stats(self):
+        with self._lock:
+            subscriptions = [s for subscribers in self._subscribers.values() for s in subscribers]
+            return {
+                'users': len(self._subscribers),
+                'subscribers': len(subscriptions),
+                'published': self._published,
+                'delivered': self._delivered,
+                'overflows': sum(s.overflows for s in subscriptions)
+            }
+
+
+class ChangeFeed:
+    """Turns a subscription's events into SSE messages, tracking the last id sent.
+
+    Concurrent writers can publish out of version order. An event older
+    than the last id is not sent as is (it may undo a newer change the
+    client already has): the feed rewinds to just before its version and
+    catches up from the database, which returns the current state of
+    whatever it changed. An event with the same id may repeat a change,
+    which clients apply idempotently.
+    """
+
+    def __init__(self, encode, last_id):
+        self.encode = encode
+        self.last_id = last_id
+
+    def ready(self, version):
+        # First message of a stream that does not resume
+        self.last_id = version
+        return sse_message(self.encode({'version': version}), 'ready', version)
+
+    def changes(self, version, changed, deleted):
+        self.last_id = max(self.last_id, version)
+        return sse_message(self.encode({'version': version, 'changed': changed, 'deleted': deleted}),
+                           'changes', version)
+
+    def resync(self, version):
+        # The client must reload GET /api/tasks; ids continue from `version`
+        self.last_id = version
+        return sse_message(self.encode({'version': version, 'resync': True}), 'resync', version)
+
+    def messages(self, events):
+        # Returns (SSE bytes for the published events, whether a catch-up
+        # from the database is needed)
+        chunks = []
+        catch_up = False
+        rewind_to = self.last_id
+        for event in events:
+            if event is None:
+                catch_up = True
+            elif event['version'] >= self.last_id:
+                chunks.append(self.changes(event['version'], event['changed'], event['deleted']))
+            else:
+                # Its version is the one the write stamped on its rows and
+                # tombstones, so a catch-up from just before it includes them
+                rewind_to = min(rewind_to, event['version'] - 1)
+                catch_up = True
+        self.last_id = min(self.last_id, rewind_to)
+        return b''.join(chunks), catch_up
@@ -0,0 +1,33 @@
+import multiprocessing
+import os
+
+# gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:app`. Every value
+# can be overridden from the environment.
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# Each worker is a separate process with its own connection pool: size
+# workers * (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW) below MySQL's
+# max_connections. With STORAGE_BACKEND=sqlite use a single host.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Threads per worker serve requests that wait on MySQL; keep them at or below
+# DB_POOL_SIZE so requests do not queue on the pool
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# The app must be built after the fork: pools, threads and sockets opened in
+# the master would be shared by every worker
+preload_app = False
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then, staggered so they do not restart together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# The app writes its own access log (see logging_setup.py)
+accesslog = None
+errorlog = '-'
@@ -0,0 +1,70 @@
+import dataclasses
+import datetime
+import decimal
+import logging
+import uuid
+
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib provider is used without it
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _default(o):
+    # Same conversions as Flask's default provider, so switching providers
+    # does not change any decoded value
+    if isinstance(o, datetime.date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider on orjson: encodes in C, straight to bytes.
+
+    Output is JSON equivalent to DefaultJSONProvider's outside debug mode:
+    sorted keys, compact separators, dates as HTTP dates. It is not byte
+    for byte the same: non-ASCII text is written as raw UTF-8 where Flask
+    writes \\u escapes (ensure_ascii). Task list ETags are built from the
+    data version, not the body, so they do not depend on the provider.
+    """
+
+    if orjson is not None:
+        option = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+                  | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def dumps(self, obj, **kwargs):
+        # Formatting arguments (indent, separators) are ignored: always compact
+        return orjson.dumps(obj, default=_default, option=self.option).decode('utf-8')
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=_default, option=self.option)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_default, option=self.option | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype='application/json')
+
+
+def create_json_provider(app, name):
+    # 'orjson' (when installed) or 'json' for Flask's stdlib provider
+    if name == 'orjson':
+        if orjson is not None:
+            return OrjsonProvider(app)
+        logger.warning("orjson is not installed; using the stdlib JSON provider")
+    elif name != 'json':
+        raise ValueError(f"Unknown JSON provider: {name!r}")
+    return DefaultJSONProvider(app)
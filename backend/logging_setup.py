@@ -0,0 +1,92 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+
+
+_listener = None
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of low-severity records.
+
+    Records are grouped by their unformatted message template, so each
+    message type can get its own rate; WARNING and above always pass.
+    """
+
+    def __init__(self, default_rate=1.0, rates=None, exempt=()):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.exempt = exempt
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or record.name in self.exempt:
+            return True
+        rate = self.rates.get(record.msg, self.default_rate)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records without formatting them and never blocks the caller."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Message formatting is left to the listener thread. Only the
+        # traceback is rendered here, while the frames are still current.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def configure_logging(level='INFO', access_level='INFO', sample_rate=1.0, access_sample_rate=1.0,
+                      sample_rates=None, queue_size=10000):
+    # Request threads only put records on a bounded queue; a background
+    # listener thread formats and writes them. When the queue is full the
+    # record is dropped instead of blocking the request. Calling it again
+    # (another app instance in the same process) replaces the pipeline.
+    global _listener
+    _stop_listener()
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    # Access lines are sampled by their own logger, not a second time here
+    queue_handler.addFilter(SamplingFilter(sample_rate, sample_rates, exempt=('access',)))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    access = logging.getLogger('access')
+    access.setLevel(access_level)
+    for existing in list(access.filters):
+        access.removeFilter(existing)
+    access.addFilter(SamplingFilter(access_sample_rate))
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    _listener = listener
+    return listener
+
+
+@atexit.register
+def _stop_listener():
+    # Flushes what is left on the queue; also runs at shutdown
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
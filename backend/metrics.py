@@ -0,0 +1,203 @@
+import functools
+import re
+import threading
+import time
+
+import query_budget
+
+# Minimal in-process metrics with Prometheus text exposition. Everything is
+# per worker process. When `enabled` is False, callers skip timing entirely
+# and cursors are not wrapped, so disabled metrics cost one attribute check.
+
+enabled = True
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._data = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            data = self._data.get(labels)
+            if data is None:
+                data = self._data[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, data in sorted(self._data.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, data):
+                    cumulative += count
+                    le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _format_labels(self.labelnames, labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {data[-1]}")
+                plain = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{plain} {data[-2]}")
+                lines.append(f"{self.name}_count{plain} {data[-1]}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency until the response is returned.',
+    ('method', 'route', 'status')
+)
+QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds', 'Time spent in cursor execute() per query shape.', ('query',)
+)
+QUERY_ROWS = Counter(
+    'db_query_rows_total', 'Rows fetched or affected per query shape.', ('query',)
+)
+POOL_ACQUIRE = Histogram(
+    'db_pool_acquire_seconds', 'Time to check a connection out of the pool.'
+)
+BCRYPT_LATENCY = Histogram(
+    'bcrypt_duration_seconds', 'Time spent hashing or verifying passwords.', ('operation',)
+)
+QUERY_BUDGET_EXCEEDED = Counter(
+    'db_query_budget_exceeded_total', 'Requests that ran more queries than their route allows.', ('route',)
+)
+
+_metrics = [REQUEST_LATENCY, QUERY_LATENCY, QUERY_ROWS, POOL_ACQUIRE, BCRYPT_LATENCY, QUERY_BUDGET_EXCEEDED]
+_gauge_collectors = {}
+
+
+def register_gauges(prefix, help, collect):
+    # collect() returns {name: number}; rendered as <prefix>_<name> gauges at
+    # scrape time. Registering a prefix again (a new app instance) replaces it.
+    _gauge_collectors[prefix] = (help, collect)
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, (help, collect) in list(_gauge_collectors.items()):
+        for name, value in sorted(collect().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+@functools.lru_cache(maxsize=512)
+def query_label(query):
+    # Low-cardinality label such as "SELECT tasks" or "UPDATE user_task_stats"
+    words = query.split(None, 2)
+    if not words:
+        return 'EMPTY'
+    verb = words[0].upper()
+    if verb == 'UPDATE' and len(words) > 1:
+        return f"UPDATE {words[1].strip('`')}"
+    match = re.search(r'\b(?:FROM|INTO)\s+`?(\w+)', query, re.I)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+def wrap_cursor(cursor):
+    # Every connection's cursors go through here: timed when metrics are
+    # on, otherwise only counted against the query budget
+    if enabled:
+        return InstrumentedCursor(cursor)
+    if query_budget.mode != 'off':
+        return query_budget.CountingCursor(cursor)
+    return cursor
+
+
+class InstrumentedCursor:
+    """Times execute() and counts rows on a wrapped DB-API cursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._label = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._count(1)
+            yield row
+
+    def _count(self, rows):
+        if self._label and rows:
+            QUERY_ROWS.inc(self._label, amount=rows)
+
+    def _timed(self, method, query, args):
+        query_budget.record()
+        self._label = query_label(query if isinstance(query, str) else query.decode('utf-8', 'replace'))
+        start = time.perf_counter()
+        try:
+            return method(query, *args)
+        finally:
+            QUERY_LATENCY.observe(time.perf_counter() - start, self._label)
+            if not getattr(self._cursor, 'with_rows', False) and self._cursor.rowcount > 0:
+                self._count(self._cursor.rowcount)
+
+    def execute(self, query, *args, **kwargs):
+        return self._timed(functools.partial(self._cursor.execute, **kwargs), query, args)
+
+    def executemany(self, query, *args, **kwargs):
+        return self._timed(functools.partial(self._cursor.executemany, **kwargs), query, args)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count(len(rows))
+        return rows
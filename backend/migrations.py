@@ -0,0 +1,316 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Versioned schema migrations. Each migration has a version, a name and the
+# statements to run for each storage dialect (a list of single SQL
+# statements, or a function taking the cursor). Applied versions are
+# recorded in schema_migrations. Every statement is written to be safe to
+# re-run, so a migration interrupted halfway (MySQL commits each DDL
+# statement on its own) can simply be applied again.
+#
+# Migrations run out of band with `flask --app app migrate`; app startup only
+# reads the current version (see check_schema in app.py).
+
+CREATE_VERSION_TABLE = {
+    'mysql': (
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INT PRIMARY KEY, "
+        "name VARCHAR(255) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    ),
+    'sqlite': (
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name TEXT NOT NULL, "
+        "applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+}
+
+
+def _reconcile_mysql_users(cursor):
+    # Databases created from the old setup scripts have users(name, email,
+    # password) or users(username, password, email) instead of the
+    # users(username, password_hash) the code uses. Add what is missing and
+    # relax the legacy NOT NULL columns the code never writes.
+    cursor.execute(
+        "SELECT column_name, is_nullable FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = 'users'"
+    )
+    columns = {row[0].lower(): row[1] for row in cursor.fetchall()}
+
+    if 'username' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN username VARCHAR(255) NULL")
+        if 'email' in columns:
+            cursor.execute("UPDATE users SET username = email")
+        cursor.execute("ALTER TABLE users MODIFY username VARCHAR(255) NOT NULL")
+        cursor.execute("CREATE UNIQUE INDEX idx_users_username ON users (username)")
+    if 'password_hash' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN password_hash VARCHAR(255) NOT NULL DEFAULT ''")
+    for legacy in ('name', 'email', 'password'):
+        if columns.get(legacy) == 'NO':
+            cursor.execute(f"ALTER TABLE users MODIFY {legacy} VARCHAR(255) NULL")
+
+
+MIGRATIONS = [
+    {
+        'version': 1,
+        'name': 'users and tasks',
+        'mysql': [
+            "CREATE TABLE IF NOT EXISTS users ("
+            "id INT AUTO_INCREMENT PRIMARY KEY, "
+            "username VARCHAR(255) NOT NULL UNIQUE, "
+            "password_hash VARCHAR(255) NOT NULL, "
+            "created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "id INT AUTO_INCREMENT PRIMARY KEY, "
+            "title VARCHAR(255) NOT NULL, "
+            "description TEXT, "
+            "completed TINYINT(1) DEFAULT 0, "
+            "user_id INT, "
+            "FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE)"
+        ],
+        'sqlite': [
+            "CREATE TABLE IF NOT EXISTS users ("
+            "id INTEGER PRIMARY KEY, "
+            "username TEXT NOT NULL UNIQUE, "
+            "password_hash TEXT NOT NULL, "
+            "created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+            # AUTOINCREMENT so ids of deleted tasks are never reused
+            # (tombstones are keyed by task id)
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "title TEXT NOT NULL, "
+            "description TEXT, "
+            "completed INTEGER NOT NULL DEFAULT 0, "
+            "user_id INTEGER REFERENCES users(id) ON DELETE CASCADE)"
+        ]
+    },
+    {
+        'version': 2,
+        'name': 'reconcile users table from older setup scripts',
+        'mysql': _reconcile_mysql_users,
+        'sqlite': []
+    },
+    {
+        'version': 3,
+        'name': 'task list indexes',
+        # Keyset pagination of a user's tasks, optionally filtered by completed
+        'mysql': [
+            "CREATE INDEX idx_tasks_user_id_id ON tasks (user_id, id)",
+            "CREATE INDEX idx_tasks_user_completed_id ON tasks (user_id, completed, id)"
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS idx_tasks_user_id_id ON tasks (user_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_user_completed_id ON tasks (user_id, completed, id)"
+        ]
+    },
+    {
+        'version': 4,
+        'name': 'task stats and data version',
+        # Counters for GET /api/tasks/stats and the version behind the ETag
+        'mysql': [
+            "CREATE TABLE IF NOT EXISTS user_task_stats ("
+            "user_id INT PRIMARY KEY, "
+            "total INT NOT NULL DEFAULT 0, "
+            "completed INT NOT NULL DEFAULT 0, "
+            "version BIGINT NOT NULL DEFAULT 0, "
+            "FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE)"
+        ],
+        'sqlite': [
+            "CREATE TABLE IF NOT EXISTS user_task_stats ("
+            "user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE, "
+            "total INTEGER NOT NULL DEFAULT 0, "
+            "completed INTEGER NOT NULL DEFAULT 0, "
+            "version INTEGER NOT NULL DEFAULT 0)"
+        ]
+    },
+    {
+        'version': 5,
+        'name': 'delta sync',
+        # Per-row versions and deletion tombstones for GET /api/tasks/changes
+        'mysql': [
+            "ALTER TABLE tasks ADD COLUMN row_version BIGINT NOT NULL DEFAULT 0",
+            "CREATE INDEX idx_tasks_user_row_version ON tasks (user_id, row_version)",
+            "ALTER TABLE user_task_stats ADD COLUMN pruned_version BIGINT NOT NULL DEFAULT 0",
+            "CREATE TABLE IF NOT EXISTS task_tombstones ("
+            "task_id INT PRIMARY KEY, "
+            "user_id INT NOT NULL, "
+            "version BIGINT NOT NULL, "
+            "deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+            "INDEX idx_tombstones_user_version (user_id, version), "
+            "INDEX idx_tombstones_deleted_at (deleted_at), "
+            "FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE)"
+        ],
+        'sqlite': [
+            "ALTER TABLE tasks ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_user_row_version ON tasks (user_id, row_version)",
+            "ALTER TABLE user_task_stats ADD COLUMN pruned_version INTEGER NOT NULL DEFAULT 0",
+            "CREATE TABLE IF NOT EXISTS task_tombstones ("
+            "task_id INTEGER PRIMARY KEY, "
+            "user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, "
+            "version INTEGER NOT NULL, "
+            "deleted_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+            "CREATE INDEX IF NOT EXISTS idx_tombstones_user_version ON task_tombstones (user_id, version)",
+            "CREATE INDEX IF NOT EXISTS idx_tombstones_deleted_at ON task_tombstones (deleted_at)"
+        ]
+    },
+    {
+        'version': 6,
+        'name': 'full-text search',
+        'mysql': [
+            "CREATE FULLTEXT INDEX idx_tasks_fulltext ON tasks (title, description)"
+        ],
+        'sqlite': [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+            "title, description, content='tasks', content_rowid='id')",
+            # Index tasks that existed before the table; safe to re-run
+            "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')",
+            "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+            "INSERT INTO tasks_fts (rowid, title, description) VALUES (new.id, new.title, new.description); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+            "INSERT INTO tasks_fts (tasks_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, description ON tasks BEGIN "
+            "INSERT INTO tasks_fts (tasks_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); "
+            "INSERT INTO tasks_fts (rowid, title, description) VALUES (new.id, new.title, new.description); "
+            "END"
+        ]
+    },
+    {
+        'version': 7,
+        'name': 'shard catalog',
+        # User directory and bucket map of sharded deployments; only the
+        # catalog shard uses them (see sharding.py)
+        'mysql': [
+            "CREATE TABLE IF NOT EXISTS user_directory ("
+            "id INT AUTO_INCREMENT PRIMARY KEY, "
+            "username VARCHAR(255) NOT NULL UNIQUE)",
+            "CREATE TABLE IF NOT EXISTS shard_buckets ("
+            "bucket INT PRIMARY KEY, "
+            "shard INT NOT NULL, "
+            "moving_to INT NULL, "
+            "moved_from INT NULL)"
+        ],
+        'sqlite': [
+            "CREATE TABLE IF NOT EXISTS user_directory ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "username TEXT NOT NULL UNIQUE)",
+            "CREATE TABLE IF NOT EXISTS shard_buckets ("
+            "bucket INTEGER PRIMARY KEY, "
+            "shard INTEGER NOT NULL, "
+            "moving_to INTEGER, "
+            "moved_from INTEGER)"
+        ]
+    },
+    {
+        'version': 8,
+        'name': 'task archive',
+        # completed_at picks the tasks to archive (see task_archive.py); rows
+        # that exist now count as completed at migration time
+        'mysql': [
+            "ALTER TABLE tasks ADD COLUMN completed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP",
+            "CREATE INDEX idx_tasks_completed_at ON tasks (completed, completed_at)",
+            "CREATE TABLE IF NOT EXISTS archived_tasks ("
+            "id INT PRIMARY KEY, "
+            "title VARCHAR(255) NOT NULL, "
+            "description TEXT, "
+            "completed TINYINT(1) NOT NULL DEFAULT 1, "
+            "user_id INT NOT NULL, "
+            "completed_at TIMESTAMP NULL, "
+            "archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+            "INDEX idx_archived_tasks_user_id_id (user_id, id), "
+            "FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE)"
+        ],
+        'sqlite': [
+            # ADD COLUMN cannot default to CURRENT_TIMESTAMP in SQLite, so
+            # existing rows are stamped here and new rows by a trigger
+            "ALTER TABLE tasks ADD COLUMN completed_at TEXT",
+            "UPDATE tasks SET completed_at = CURRENT_TIMESTAMP WHERE completed_at IS NULL",
+            "CREATE TRIGGER IF NOT EXISTS tasks_completed_at_insert AFTER INSERT ON tasks "
+            "WHEN new.completed_at IS NULL BEGIN "
+            "UPDATE tasks SET completed_at = CURRENT_TIMESTAMP WHERE id = new.id; "
+            "END",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_completed_at ON tasks (completed, completed_at)",
+            "CREATE TABLE IF NOT EXISTS archived_tasks ("
+            "id INTEGER PRIMARY KEY, "
+            "title TEXT NOT NULL, "
+            "description TEXT, "
+            "completed INTEGER NOT NULL DEFAULT 1, "
+            "user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, "
+            "completed_at TEXT, "
+            "archived_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+            "CREATE INDEX IF NOT EXISTS idx_archived_tasks_user_id_id ON archived_tasks (user_id, id)"
+        ]
+    }
+]
+
+LATEST_VERSION = MIGRATIONS[-1]['version']
+
+
+def current_version(storage, conn):
+    # One primary key read; 0 for a database that was never migrated
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_migrations")
+        row = cursor.fetchone()
+        return row[0] or 0
+    except storage.Error:
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+
+
+def pending_migrations(version, target=None):
+    target = LATEST_VERSION if target is None else target
+    return [m for m in MIGRATIONS if version < m['version'] <= target]
+
+
+def _run(storage, cursor, statements):
+    if callable(statements):
+        statements(cursor)
+        return
+    for statement in statements:
+        try:
+            cursor.execute(statement)
+        except storage.Error as err:
+            # Index or column created by an earlier, interrupted run (or by
+            # the schema.sql this replaced)
+            if not storage.ddl_already_applied(err):
+                raise
+
+
+def migrate(storage, target=None):
+    # Applies pending migrations in order and returns the versions applied.
+    # Concurrent runs are serialized by the storage's migration lock, and
+    # each migration re-checks the recorded version before it runs.
+    conn = storage.acquire()
+    applied = []
+    try:
+        with storage.migration_lock(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute(CREATE_VERSION_TABLE[storage.dialect])
+                conn.commit()
+            finally:
+                cursor.close()
+
+            for migration in pending_migrations(current_version(storage, conn), target):
+                with storage.transaction(conn) as cursor:
+                    cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (migration['version'],))
+                    if cursor.fetchone():
+                        continue
+                    logger.info("Applying migration %s: %s", migration['version'], migration['name'])
+                    _run(storage, cursor, migration[storage.dialect])
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (migration['version'], migration['name'])
+                    )
+                applied.append(migration['version'])
+    finally:
+        conn.close()
+    return applied
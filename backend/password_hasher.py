@@ -0,0 +1,98 @@
+import concurrent.futures
+import logging
+import threading
+import time
+
+import bcrypt
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HasherBusyError(Exception):
+    """Raised when the hashing queue is full; callers should answer 503."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool.
+
+    bcrypt releases the GIL while it works, so request threads waiting on a
+    hash do not stall other routes. At most `workers + max_pending` hashes
+    are admitted at once; beyond that calls fail fast with HasherBusyError
+    instead of queueing behind a login burst.
+    """
+
+    def __init__(self, workers=2, max_pending=16, rounds=12, timeout=10.0):
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='bcrypt'
+        )
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._completed = 0
+        self._busy_time = 0.0
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HasherBusyError("Password hashing queue is full")
+
+        def timed():
+            start = time.monotonic()
+            try:
+                return fn(*args)
+            finally:
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self._busy_time += elapsed
+                    self._completed += 1
+                if metrics.enabled:
+                    metrics.BCRYPT_LATENCY.observe(elapsed, operation)
+
+        def done(_):
+            # The slot is freed when the work finishes, even if the caller
+            # stopped waiting, so the admission limit stays accurate
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+        with self._lock:
+            self._in_flight += 1
+        future = self._executor.submit(timed)
+        future.add_done_callback(done)
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            raise HasherBusyError(f"Password hashing took longer than {self.timeout}s")
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run('hash', bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password, password_hash):
+        return self._run('verify', bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def needs_rehash(self, password_hash):
+        # Hashes look like $2b$12$<salt+hash>; the second field is the cost
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rounds': self.rounds,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'busy_time_total': round(self._busy_time, 6)
+            }
@@ -0,0 +1,105 @@
+import contextlib
+import contextvars
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-request query-count budgets. A route declares how many statements it
+# may issue with @limit(n); every statement a request runs through a
+# connection's cursor (see metrics.wrap_cursor) or AsyncMySQLStorage._execute
+# is counted against it, whether or not metrics are enabled. In 'log' mode a request over budget is logged and
+# counted in db_query_budget_exceeded_total; in 'strict' mode the first
+# statement past the budget raises QueryBudgetExceeded, so a test run fails
+# on an N+1 regression instead of getting slower. 'off' skips counting.
+
+mode = 'log'
+
+_current = contextvars.ContextVar('query_budget', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """A request issued more statements than its route allows (strict mode)."""
+
+
+class CountingCursor:
+    """Counts execute() calls on a wrapped DB-API cursor (metrics off)."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, *args, **kwargs):
+        record()
+        return self._cursor.execute(query, *args, **kwargs)
+
+    def executemany(self, query, *args, **kwargs):
+        record()
+        return self._cursor.executemany(query, *args, **kwargs)
+
+
+class Budget:
+    """Statements issued so far by one request, and its route's limit."""
+
+    __slots__ = ('route', 'limit', 'count')
+
+    def __init__(self, route, limit):
+        self.route = route
+        self.limit = limit
+        self.count = 0
+
+    @property
+    def exceeded(self):
+        return self.limit is not None and self.count > self.limit
+
+
+def limit(n):
+    # Decorator for a view or handler: the most statements one call may run
+    def decorator(f):
+        f.query_budget = n
+        return f
+    return decorator
+
+
+def begin(route, limit=None):
+    # Starts counting for the current request (thread or task); routes
+    # without a declared budget are counted but never over it
+    _current.set(Budget(route, limit) if mode != 'off' else None)
+
+
+def record():
+    budget = _current.get()
+    if budget is None:
+        return
+    budget.count += 1
+    if mode == 'strict' and budget.exceeded:
+        raise QueryBudgetExceeded(f"{budget.route} ran more than {budget.limit} queries")
+
+
+@contextlib.contextmanager
+def paused():
+    # For work that is not the current route's steady-state cost:
+    # write-behind flushes done on behalf of earlier requests, and the
+    # one-time build of a user's counters
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def end():
+    # Stops counting and returns the request's Budget (None when not
+    # counted); logs it when it went over
+    budget = _current.get()
+    if budget is None:
+        return None
+    _current.set(None)
+    if budget.exceeded:
+        logger.warning("Query budget exceeded: route=%s queries=%s limit=%s",
+                       budget.route, budget.count, budget.limit)
+    return budget
@@ -0,0 +1,214 @@
+import collections
+import logging
+import math
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # optional; buckets are kept per worker without it
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Load shedding in front of the database. RateLimiter gives each user a token
+# bucket (`rate` requests per second, bursts of up to `burst`), so one client
+# stuck in a retry loop gets 429s instead of a share of the connection pool.
+# AdmissionController bounds the requests of this worker that may use the
+# database at once and answers 503 when the pool already has a queue, so
+# latency stays bounded under overload instead of every request waiting out
+# the pool timeout.
+
+
+class RateLimitedError(Exception):
+    """Raised for a user over their rate; callers should answer 429."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+class OverloadedError(Exception):
+    """Raised when admission control sheds a request; callers should answer 503."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def retry_after_header(seconds):
+    # Retry-After takes whole seconds
+    return str(max(1, math.ceil(seconds)))
+
+
+class TokenBuckets:
+    """Token buckets in this process, one per key, least recently used evicted."""
+
+    def __init__(self, rate, burst, maxsize=100000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = collections.OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        # Returns 0 if a token was taken, else the seconds until one is free
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.maxsize:
+                # A bucket idle long enough to be evicted is full anyway
+                self._buckets.popitem(last=False)
+            return wait
+
+    def size(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+class RedisTokenBuckets:
+    """Token buckets in Redis, shared by every worker and host.
+
+    The refill and the take run in one Lua script, timed by the Redis
+    server's clock, so concurrent workers never race or disagree.
+    """
+
+    SCRIPT = """
+        local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local t = redis.call('TIME')
+        local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(state[1]) or burst
+        local ts = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+        return tostring(wait)
+    """
+
+    def __init__(self, url, rate, burst, prefix='ratelimit:'):
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key):
+        return float(self._script(keys=[f"{self.prefix}{key}"], args=[self.rate, self.burst]))
+
+    def size(self):
+        return None
+
+
+class RateLimiter:
+    def __init__(self, enabled=True, rate=10.0, burst=20, redis_url=None, maxsize=100000):
+        self.enabled = enabled
+        self.local = TokenBuckets(rate, burst, maxsize)
+        self.shared = None
+        if enabled and redis_url:
+            if redis is not None:
+                self.shared = RedisTokenBuckets(redis_url, rate, burst)
+            else:
+                logger.warning("redis is not installed; rate limits are kept per worker")
+        self._lock = threading.Lock()
+        self._limited = 0
+        self._shared_errors = 0
+
+    def check(self, key):
+        # Raises RateLimitedError when `key` has no token left
+        if not self.enabled:
+            return
+        wait = None
+        if self.shared is not None:
+            try:
+                wait = self.shared.take(key)
+            except redis.RedisError as e:
+                # Fail open to the per-worker buckets rather than failing
+                # requests because the limiter's store is down
+                with self._lock:
+                    self._shared_errors += 1
+                logger.warning("Shared rate limiter unavailable: %s", e)
+        if wait is None:
+            wait = self.local.take(key)
+        if wait > 0:
+            with self._lock:
+                self._limited += 1
+            raise RateLimitedError(wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'shared': self.shared is not None,
+                'buckets': self.local.size(),
+                'limited': self._limited,
+                'shared_errors': self._shared_errors
+            }
+
+
+class AdmissionController:
+    """Bounds the requests of this worker that may use the database at once.
+
+    A request is shed with OverloadedError when `max_in_flight` are already
+    admitted, or when more than `max_queue` requests are waiting for a pool
+    connection (as reported by `queue_depth`). Every enter() that returns
+    must be paired with a leave().
+    """
+
+    def __init__(self, enabled=True, max_in_flight=64, max_queue=16, retry_after=1.0, queue_depth=None):
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._admitted = 0
+        self._shed_in_flight = 0
+        self._shed_queue = 0
+
+    def enter(self):
+        if not self.enabled:
+            return
+        queued = self.queue_depth() if self.queue_depth is not None else 0
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self._shed_in_flight += 1
+                raise OverloadedError(f"{self._in_flight} requests in flight", self.retry_after)
+            if queued > self.max_queue:
+                self._shed_queue += 1
+                raise OverloadedError(f"{queued} requests waiting for a connection", self.retry_after)
+            self._in_flight += 1
+            self._admitted += 1
+
+    def leave(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'admitted': self._admitted,
+                'shed_in_flight': self._shed_in_flight,
+                'shed_queue': self._shed_queue
+            }
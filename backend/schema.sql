@@ -1,9 +0,0 @@
--- Create tasks table if it doesn't exist
-CREATE TABLE IF NOT EXISTS tasks (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    title VARCHAR(255) NOT NULL,
-    description TEXT,
-    completed TINYINT(1) DEFAULT 0,
-    user_id INT,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-); 
\ No newline at end of file
@@ -0,0 +1,474 @@
+import logging
+import threading
+import time
+import zlib
+
+import query_budget
+from storage import Storage, StorageBusyError
+
+logger = logging.getLogger(__name__)
+
+# User-keyed sharding. Every query is scoped by user_id, so a user's row,
+# counters, tasks and tombstones live together on one shard and each request
+# talks to a single database. A user id hashes to one of `buckets` buckets,
+# and the shard_buckets table on the catalog (shard 0) says which shard holds
+# each bucket. A bucket without a row is on the catalog, so an existing
+# database becomes shard 0 as it is and `flask --app app rebalance-shards`
+# spreads the buckets afterwards.
+#
+# The catalog also keeps the user directory (email -> id): it allocates user
+# ids, keeps emails unique across shards and serves the login lookup.
+#
+# Task ids must stay unique across shards so a user's tasks can move with
+# their ids: each shard's connections use auto_increment_increment=id_stride
+# and auto_increment_offset=index + 1, so shard k only generates ids that
+# are k + 1 modulo id_stride. id_stride bounds the number of shards and must
+# never change once tasks exist.
+#
+# Moving a bucket: its row gets moving_to, and every worker answers that
+# bucket's users with 503 once its copy of the map is refreshed (map_ttl).
+# After waiting that long the users are copied, the bucket is pointed at
+# the new shard, and the old copies are deleted (moved_from marks a cleanup
+# still to do). An interrupted move is resumed by the next run.
+
+# Tables moved with a user, parents first, and the column naming the user.
+# archived_tasks is read after tasks: a task archived during the copy then
+# shows up twice on the target rather than not at all.
+MOVED_TABLES = (
+    ('users', 'id', 'id, username, password_hash, created_at'),
+    ('user_task_stats', 'user_id', 'user_id, total, completed, version, pruned_version'),
+    ('tasks', 'user_id', 'id, title, description, completed, user_id, row_version, completed_at'),
+    ('archived_tasks', 'user_id', 'id, title, description, completed, user_id, completed_at, archived_at'),
+    ('task_tombstones', 'user_id', 'task_id, user_id, version, deleted_at')
+)
+
+
+class ShardMovingError(StorageBusyError):
+    """The user's bucket is being moved to another shard; retry shortly."""
+
+
+def user_bucket(user_id, buckets):
+    return zlib.crc32(b'%d' % user_id) % buckets
+
+
+def shard_config(config, index, id_stride):
+    # MySQL connection settings for shard `index`: disjoint auto-increment ids
+    return dict(
+        config,
+        init_command=f"SET SESSION auto_increment_increment = {id_stride}, auto_increment_offset = {index + 1}"
+    )
+
+
+class ShardMap:
+    """Bucket to shard assignments, re-read from the catalog every `ttl` seconds.
+
+    `load` returns {bucket: (shard, moving_to, moved_from)}. If a reload
+    fails the known assignments are kept; before the first successful load
+    every lookup fails with StorageBusyError rather than guessing.
+    """
+
+    def __init__(self, load, buckets=1024, ttl=5.0):
+        self.load = load
+        self.buckets = buckets
+        self.ttl = ttl
+        self._assignments = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._reloads = 0
+        self._load_errors = 0
+
+    def bucket(self, user_id):
+        return user_bucket(user_id, self.buckets)
+
+    def lookup(self, bucket):
+        # (shard, moving_to, moved_from) of the bucket
+        if time.monotonic() - self._loaded_at >= self.ttl:
+            self.reload(force=False)
+        if self._assignments is None:
+            raise StorageBusyError("Shard map not loaded")
+        return self._assignments.get(bucket, (0, None, None))
+
+    def reload(self, force=True):
+        with self._lock:
+            if not force and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            try:
+                # A periodic refresh, not the cost of the request it runs in
+                with query_budget.paused():
+                    self._assignments = self.load()
+                self._reloads += 1
+            except Exception as e:
+                self._load_errors += 1
+                logger.warning("Could not reload the shard map, keeping the previous one: %s", e)
+            self._loaded_at = time.monotonic()
+
+    def assignments(self):
+        # Shard of every bucket, from a fresh read of the catalog
+        self.reload()
+        if self._assignments is None:
+            raise StorageBusyError("Shard map not loaded")
+        return {bucket: self._assignments.get(bucket, (0, None, None)) for bucket in range(self.buckets)}
+
+    def stats(self):
+        assignments = self._assignments or {}
+        return {
+            'buckets': self.buckets,
+            'moving': sum(1 for _, moving_to, _ in assignments.values() if moving_to is not None),
+            'reloads': self._reloads,
+            'load_errors': self._load_errors
+        }
+
+
+class ShardedStorage(Storage):
+    """Users and their tasks spread over several storages by user id.
+
+    Connections come from the shard of `user_id` passed to acquire(), or
+    from the catalog without one. Every other Storage method runs on the
+    connection it is given; the few that involve several shards (signup,
+    login, write-behind flushes, maintenance) are overridden here. The
+    legacy /tasks routes, which have no user, only see the catalog.
+    """
+
+    def __init__(self, shards, buckets=1024, map_ttl=5.0):
+        self._shards = list(shards)
+        self.catalog = self._shards[0]
+        self.dialect = self.catalog.dialect
+        self.Error = self.catalog.Error
+        self.for_update = self.catalog.for_update
+        self.shard_map = ShardMap(self._load_assignments, buckets, map_ttl)
+
+    @property
+    def shards(self):
+        return self._shards
+
+    def shard_index(self, user_id):
+        shard, moving_to, _ = self.shard_map.lookup(self.shard_map.bucket(user_id))
+        if moving_to is not None:
+            raise ShardMovingError(f"User {user_id} is being moved to shard {moving_to}")
+        return shard
+
+    def acquire(self, readonly=False, user_id=None):
+        index = 0 if user_id is None else self.shard_index(user_id)
+        conn = self._shards[index].acquire()
+        # For apply_toggles, to reuse the caller's connection on its shard
+        conn.shard = index
+        return conn
+
+    def check_routable(self, user_id):
+        self.shard_index(user_id)
+
+    def _load_assignments(self):
+        conn = self.catalog.acquire()
+        try:
+            with self._cursor(conn, dictionary=False) as cursor:
+                cursor.execute("SELECT bucket, shard, moving_to, moved_from FROM shard_buckets")
+                return {bucket: (shard, moving_to, moved_from) for bucket, shard, moving_to, moved_from in cursor}
+        finally:
+            conn.close()
+
+    # Same engine on every shard: engine specifics come from the catalog
+
+    def _begin_write(self, cursor):
+        self.catalog._begin_write(cursor)
+
+    def _begin_read(self, cursor):
+        self.catalog._begin_read(cursor)
+
+    def migration_lock(self, conn):
+        return self.catalog.migration_lock(conn)
+
+    def ddl_already_applied(self, err):
+        return self.catalog.ddl_already_applied(err)
+
+    def search_tasks(self, conn, user_id, terms, limit, offset):
+        return self.catalog.search_tasks(conn, user_id, terms, limit, offset)
+
+    def stats(self):
+        return dict(self.shard_map.stats(), shards=self.shard_stats())
+
+    def shard_stats(self):
+        return [shard.stats() for shard in self._shards]
+
+    def queue_depth(self):
+        return sum(shard.queue_depth() for shard in self._shards)
+
+    def dispose(self):
+        for shard in self._shards:
+            shard.dispose()
+
+    # Users
+
+    def get_user_by_email(self, conn, email):
+        # `conn` is a catalog connection: the directory gives the id, then
+        # the row is read from the user's shard
+        with self._cursor(conn) as cursor:
+            cursor.execute("SELECT id FROM user_directory WHERE username = %s", (email,))
+            entry = cursor.fetchone()
+        if entry is None:
+            return None
+        shard_conn = self.acquire(user_id=entry['id'])
+        try:
+            return super().get_user_by_email(shard_conn, email)
+        finally:
+            shard_conn.close()
+
+    def create_user(self, conn, email, password_hash):
+        # The directory entry allocates the id; the user row is then written
+        # on the shard of that id. If that fails the entry is removed again.
+        with self.transaction(conn) as cursor:
+            cursor.execute("SELECT id FROM user_directory WHERE username = %s", (email,))
+            if cursor.fetchone():
+                return None
+            cursor.execute("INSERT INTO user_directory (username) VALUES (%s)", (email,))
+            user_id = cursor.lastrowid
+
+        try:
+            shard_conn = self.acquire(user_id=user_id)
+            try:
+                with self.transaction(shard_conn) as cursor:
+                    cursor.execute(
+                        "INSERT INTO users (id, username, password_hash) VALUES (%s, %s, %s)",
+                        (user_id, email, password_hash)
+                    )
+            finally:
+                shard_conn.close()
+        except BaseException:
+            with self.transaction(conn) as cursor:
+                cursor.execute("DELETE FROM user_directory WHERE id = %s", (user_id,))
+            raise
+        return user_id
+
+    def set_password_hash(self, conn, user_id, password_hash):
+        shard_conn = self.acquire(user_id=user_id)
+        try:
+            super().set_password_hash(shard_conn, user_id, password_hash)
+        finally:
+            shard_conn.close()
+
+    def sync_directory(self):
+        # Adds users missing from the directory (all of them when an existing
+        # database is turned into shard 0); returns the number added
+        ignore = 'INSERT OR IGNORE' if self.dialect == 'sqlite' else 'INSERT IGNORE'
+        added = 0
+        catalog_conn = self.catalog.acquire()
+        try:
+            for shard in self._shards:
+                conn = shard.acquire()
+                try:
+                    with self._cursor(conn, dictionary=False) as cursor:
+                        cursor.execute("SELECT id, username FROM users")
+                        users = cursor.fetchall()
+                finally:
+                    conn.close()
+                with self.transaction(catalog_conn) as cursor:
+                    for user in users:
+                        cursor.execute(f"{ignore} INTO user_directory (id, username) VALUES (%s, %s)", user)
+                        added += cursor.rowcount
+        finally:
+            catalog_conn.close()
+        return added
+
+    # Writes and maintenance over several shards
+
+    def apply_toggles(self, conn, toggles):
+        # One transaction per shard; re-applying a shard's toggles after a
+        # failure elsewhere is harmless, as each sets an absolute value
+        by_shard = {}
+        for task_id, (user_id, completed) in toggles.items():
+            by_shard.setdefault(self.shard_index(user_id), {})[task_id] = (user_id, completed)
+        written = 0
+        for index, shard_toggles in by_shard.items():
+            if getattr(conn, 'shard', None) == index:
+                written += super().apply_toggles(conn, shard_toggles)
+                continue
+            shard_conn = self._shards[index].acquire()
+            try:
+                written += super().apply_toggles(shard_conn, shard_toggles)
+            finally:
+                shard_conn.close()
+        return written
+
+    def recompute_stats(self, conn, user_id=None):
+        for shard_conn in self._connections(user_id):
+            try:
+                super().recompute_stats(shard_conn, user_id)
+            finally:
+                shard_conn.close()
+
+    def compact_tombstones(self, conn, older_than_days, batch_size=1000):
+        deleted = 0
+        for shard_conn in self._connections():
+            try:
+                deleted += super().compact_tombstones(shard_conn, older_than_days, batch_size)
+            finally:
+                shard_conn.close()
+        return deleted
+
+    def archive_tasks(self, conn, older_than_days, batch_size=1000):
+        archived = 0
+        for shard_conn in self._connections():
+            try:
+                archived += super().archive_tasks(shard_conn, older_than_days, batch_size)
+            finally:
+                shard_conn.close()
+        return archived
+
+    def _connections(self, user_id=None):
+        # A connection to the user's shard, or to each shard in turn
+        if user_id is not None:
+            yield self.acquire(user_id=user_id)
+            return
+        for shard in self._shards:
+            yield shard.acquire()
+
+    # Rebalancing
+
+    def _set_bucket(self, cursor, bucket, shard, moving_to=None, moved_from=None):
+        if self.dialect == 'sqlite':
+            upsert = ("ON CONFLICT (bucket) DO UPDATE SET shard = excluded.shard, "
+                      "moving_to = excluded.moving_to, moved_from = excluded.moved_from")
+        else:
+            upsert = ("ON DUPLICATE KEY UPDATE shard = VALUES(shard), "
+                      "moving_to = VALUES(moving_to), moved_from = VALUES(moved_from)")
+        cursor.execute(
+            f"INSERT INTO shard_buckets (bucket, shard, moving_to, moved_from) VALUES (%s, %s, %s, %s) {upsert}",
+            (bucket, shard, moving_to, moved_from)
+        )
+
+    def _update_buckets(self, updates):
+        # updates: [(bucket, shard, moving_to, moved_from)], one transaction
+        conn = self.catalog.acquire()
+        try:
+            with self.transaction(conn) as cursor:
+                for update in updates:
+                    self._set_bucket(cursor, *update)
+        finally:
+            conn.close()
+
+    def bucket_users(self, index, buckets):
+        # {bucket: [user ids]} of the users stored on shard `index` whose
+        # bucket is in `buckets`
+        conn = self._shards[index].acquire()
+        try:
+            with self._cursor(conn, dictionary=False) as cursor:
+                cursor.execute("SELECT id FROM users")
+                found = {}
+                for (user_id,) in cursor:
+                    bucket = self.shard_map.bucket(user_id)
+                    if bucket in buckets:
+                        found.setdefault(bucket, []).append(user_id)
+                return found
+        finally:
+            conn.close()
+
+    def _copy_user(self, source_conn, target_conn, user_id, batch_size=1000):
+        with self.transaction(target_conn) as target:
+            # Leftovers of an interrupted copy
+            for table, key, _ in reversed(MOVED_TABLES):
+                target.execute(f"DELETE FROM {table} WHERE {key} = %s", (user_id,))
+            for table, key, columns in MOVED_TABLES:
+                insert = f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(columns.split(',')))})"
+                with self._cursor(source_conn, dictionary=False) as source:
+                    source.execute(f"SELECT {columns} FROM {table} WHERE {key} = %s", (user_id,))
+                    while True:
+                        rows = source.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        target.executemany(insert, rows)
+
+    def _delete_users(self, index, user_ids):
+        conn = self._shards[index].acquire()
+        try:
+            for user_id in user_ids:
+                with self.transaction(conn) as cursor:
+                    for table, key, _ in reversed(MOVED_TABLES):
+                        cursor.execute(f"DELETE FROM {table} WHERE {key} = %s", (user_id,))
+        finally:
+            conn.close()
+
+    def move_buckets(self, moves, wait):
+        # moves: {bucket: target shard}. Blocks the buckets' users, waits
+        # `wait` seconds for every worker to see it, then copies them (see
+        # resume_moves). Returns the number of users moved.
+        moved_users = self.resume_moves()
+        assignments = self.shard_map.assignments()
+        moves = {bucket: target for bucket, target in moves.items() if assignments[bucket][0] != target}
+        if not moves:
+            return moved_users
+        self._update_buckets([(bucket, assignments[bucket][0], target, None) for bucket, target in moves.items()])
+        time.sleep(wait)
+        return moved_users + self.resume_moves()
+
+    def resume_moves(self):
+        # Finishes the moves recorded in shard_buckets, including those of an
+        # interrupted run: copies each blocked bucket's users, points the
+        # bucket at its target, then deletes the old copies. Returns the
+        # number of users copied.
+        assignments = self.shard_map.assignments()
+        pending = {bucket: (shard, moving_to) for bucket, (shard, moving_to, _) in assignments.items()
+                   if moving_to is not None}
+        by_source = {}
+        for bucket, (source, target) in pending.items():
+            by_source.setdefault(source, {})[bucket] = target
+
+        moved_users = 0
+        try:
+            for source, targets in by_source.items():
+                users = self.bucket_users(source, set(targets))
+                source_conn = self._shards[source].acquire()
+                try:
+                    for bucket, target in targets.items():
+                        target_conn = self._shards[target].acquire()
+                        try:
+                            for user_id in users.get(bucket, ()):
+                                self._copy_user(source_conn, target_conn, user_id)
+                                moved_users += 1
+                        finally:
+                            target_conn.close()
+                        self._update_buckets([(bucket, target, None, source)])
+                        del pending[bucket]
+                finally:
+                    source_conn.close()
+        except BaseException:
+            # Sources still hold everything not switched yet: unblock it
+            self._update_buckets([(bucket, source, None, None) for bucket, (source, _) in pending.items()])
+            raise
+        finally:
+            self._cleanup()
+            self.shard_map.reload()
+        return moved_users
+
+    def _cleanup(self):
+        # Deletes the old copies of moved buckets, then clears moved_from
+        moved = {bucket: (shard, moved_from) for bucket, (shard, _, moved_from) in self.shard_map.assignments().items()
+                 if moved_from is not None}
+        by_source = {}
+        for bucket, (_, moved_from) in moved.items():
+            by_source.setdefault(moved_from, set()).add(bucket)
+        for source, buckets in by_source.items():
+            for user_ids in self.bucket_users(source, buckets).values():
+                self._delete_users(source, user_ids)
+        self._update_buckets([(bucket, shard, None, None) for bucket, (shard, _) in moved.items()])
+
+    def plan_rebalance(self):
+        # {bucket: target} giving every shard an equal share of the buckets,
+        # moving as few buckets as possible
+        assignments = self.shard_map.assignments()
+        owned = {index: [] for index in range(len(self._shards))}
+        for bucket, (shard, _, _) in assignments.items():
+            owned.setdefault(shard, []).append(bucket)
+        count = len(self._shards)
+        share = {index: self.shard_map.buckets // count + (1 if index < self.shard_map.buckets % count else 0)
+                 for index in range(count)}
+
+        spare = []
+        for index, buckets in owned.items():
+            keep = share.get(index, 0)
+            spare.extend(sorted(buckets)[keep:])
+        moves = {}
+        for index in range(count):
+            while len(owned[index]) < share[index] and spare:
+                bucket = spare.pop()
+                moves[bucket] = index
+                owned[index].append(bucket)
+        return moves
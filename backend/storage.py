@@ -0,0 +1,500 @@
+import contextlib
+import logging
+
+import query_budget
+import task_archive
+import task_batch
+import task_import
+import task_stats
+import task_sync
+
+logger = logging.getLogger(__name__)
+
+# Data access for the API. A Storage hands out connections (acquire()) and
+# runs every query the routes need, so routes never see SQL or a driver.
+# Methods take a connection from acquire() so that one request can share it;
+# methods that write commit before returning. MySQLStorage (storage_mysql.py)
+# and SQLiteStorage (storage_sqlite.py) differ only in connection handling,
+# schema and the handful of engine specific statements.
+#
+# acquire(readonly=True) may return a connection to a read replica (its
+# `readonly` attribute is then True). Such a connection may lag the primary
+# and must only be used for reads; the few read paths that can write go to
+# the primary through _primary().
+#
+# acquire(user_id=...) names whose data the connection is for. Only
+# ShardedStorage (sharding.py) routes on it, to the shard holding that user.
+#
+# The single-task paths open their cursors with prepared=True: on MySQL
+# their fixed statements are prepared once per pooled connection and reused
+# (db_pool.StatementCache); SQLite's own statement cache does the same for
+# every query. Writes build the returned task from what they wrote instead
+# of reading it back.
+
+TASK_COLUMNS = "id, title, description, completed, user_id"
+
+
+class StorageBusyError(Exception):
+    """No connection could be obtained in time; the request can be retried."""
+
+
+def convert_task_row(task):
+    task['completed'] = bool(task['completed'])
+    return task
+
+
+def task_rows(rows):
+    # Task dicts built straight from tuple rows in TASK_COLUMNS order, with
+    # completed as a bool: one pass, instead of the driver building a dict
+    # per row and convert_task_row fixing it up in a second
+    return [
+        {'id': id, 'title': title, 'description': description, 'completed': bool(completed), 'user_id': user_id}
+        for id, title, description, completed, user_id in rows
+    ]
+
+
+def _keyset_query(table, user_id, completed, after_id, limit, oldest_first=False):
+    query = f"SELECT {TASK_COLUMNS} FROM {table} WHERE user_id = %s"
+    params = [user_id]
+    if completed is not None:
+        query += " AND completed = %s"
+        params.append(1 if completed else 0)
+    if after_id is not None:
+        query += " AND id > %s" if oldest_first else " AND id < %s"
+        params.append(after_id)
+    query += " ORDER BY id" if oldest_first else " ORDER BY id DESC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+def task_list_query(user_id, completed=None, after_id=None, limit=None, include_archived=False,
+                    oldest_first=False):
+    # Keyset query over (user_id, id) or (user_id, completed, id), newest
+    # first unless oldest_first; returns (query, params). With
+    # include_archived the page is merged from one bounded range scan of
+    # tasks and one of archived_tasks (whose tasks are all completed).
+    query, params = _keyset_query('tasks', user_id, completed, after_id, limit, oldest_first)
+    if not include_archived or completed is False:
+        return query, params
+    archived, archived_params = _keyset_query('archived_tasks', user_id, None, after_id, limit, oldest_first)
+    order = "id" if oldest_first else "id DESC"
+    query = (f"SELECT {TASK_COLUMNS} FROM ({query}) AS hot UNION ALL "
+             f"SELECT {TASK_COLUMNS} FROM ({archived}) AS archived ORDER BY {order}")
+    params += archived_params
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+class TaskCursor:
+    """Executed SELECT of TASK_COLUMNS whose fetch methods return task dicts."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return task_rows((row,))[0] if row is not None else None
+
+    def fetchmany(self, size=1):
+        return task_rows(self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return task_rows(self._cursor.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+
+class Storage:
+    dialect = None
+    # Base class of the driver's exceptions, for callers to catch
+    Error = Exception
+    # Row lock suffix for read-then-write statements
+    for_update = ''
+    # True if acquire(readonly=True) can return a replica connection
+    has_replicas = False
+
+    def acquire(self, readonly=False, user_id=None):
+        # Returns a connection; close() hands it back
+        raise NotImplementedError
+
+    @property
+    def shards(self):
+        # The storages holding data, each with its own schema to migrate
+        return [self]
+
+    def check_routable(self, user_id):
+        # Raises StorageBusyError while the user's data cannot be reached
+        # (ShardedStorage, during a move between shards)
+        pass
+
+    @contextlib.contextmanager
+    def _primary(self, conn):
+        # The connection itself, or a primary connection if it is a replica
+        if not conn.readonly:
+            yield conn
+            return
+        primary = self.acquire()
+        try:
+            yield primary
+        finally:
+            primary.close()
+
+    @contextlib.contextmanager
+    def migration_lock(self, conn):
+        # Held while migrations run so concurrent `migrate` runs take turns
+        yield
+
+    def ddl_already_applied(self, err):
+        # True if a migration statement failed only because its index or
+        # column already exists
+        return False
+
+    def search_tasks(self, conn, user_id, terms, limit, offset):
+        # Full-text search that requires every term (as a prefix), best match first
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    def replica_stats(self):
+        return []
+
+    def shard_stats(self):
+        return []
+
+    def queue_depth(self):
+        # Requests waiting for a primary connection, for admission control
+        return 0
+
+    def dispose(self):
+        pass
+
+    def _begin_write(self, cursor):
+        pass
+
+    def _begin_read(self, cursor):
+        pass
+
+    @contextlib.contextmanager
+    def transaction(self, conn, dictionary=False, prepared=False):
+        # Cursor for a write transaction: committed when the block exits,
+        # rolled back on any error
+        cursor = conn.cursor(dictionary=dictionary, prepared=prepared)
+        try:
+            self._begin_write(cursor)
+            yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    @contextlib.contextmanager
+    def read_transaction(self, conn, dictionary=True):
+        # Cursor whose reads all see one snapshot of the database; the
+        # transaction is rolled back (there is nothing to keep) on exit
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            self._begin_read(cursor)
+            yield cursor
+        finally:
+            try:
+                conn.rollback()
+            finally:
+                cursor.close()
+
+    @contextlib.contextmanager
+    def _cursor(self, conn, dictionary=True, prepared=False):
+        cursor = conn.cursor(dictionary=dictionary, prepared=prepared)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def ping(self, conn):
+        with self._cursor(conn, dictionary=False) as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+
+    # Users
+
+    def get_user(self, conn, user_id):
+        with self._cursor(conn, prepared=True) as cursor:
+            cursor.execute("SELECT id, username FROM users WHERE id = %s", (user_id,))
+            return cursor.fetchone()
+
+    def get_user_by_email(self, conn, email):
+        with self._cursor(conn) as cursor:
+            cursor.execute("SELECT id, username, password_hash FROM users WHERE username = %s", (email,))
+            return cursor.fetchone()
+
+    def create_user(self, conn, email, password_hash):
+        # Returns the new user's id, or None if the email is already registered
+        with self.transaction(conn) as cursor:
+            cursor.execute("SELECT id FROM users WHERE username = %s", (email,))
+            if cursor.fetchone():
+                return None
+            cursor.execute(
+                "INSERT INTO users (username, password_hash) VALUES (%s, %s)",
+                (email, password_hash)
+            )
+            return cursor.lastrowid
+
+    def set_password_hash(self, conn, user_id, password_hash):
+        with self.transaction(conn) as cursor:
+            cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (password_hash, user_id))
+
+    # Task reads
+
+    def get_data_version(self, conn, user_id):
+        # Builds the user's counters on first use (not counted against the
+        # query budget, being a one-time cost)
+        with self._cursor(conn, prepared=True) as cursor:
+            version = task_stats.get_data_version(cursor, user_id)
+        if version is None:
+            with query_budget.paused(), self._primary(conn) as primary, self.transaction(primary) as cursor:
+                task_stats.recompute_stats(cursor, user_id, self.dialect)
+                version = task_stats.get_data_version(cursor, user_id)
+        return version
+
+    def get_stats(self, conn, user_id):
+        with self._cursor(conn, prepared=True) as cursor:
+            stats = task_stats.get_stats(cursor, user_id)
+        if stats is None:
+            with query_budget.paused(), self._primary(conn) as primary, self.transaction(primary) as cursor:
+                task_stats.recompute_stats(cursor, user_id, self.dialect)
+                stats = task_stats.get_stats(cursor, user_id)
+        return stats
+
+    def query_tasks(self, conn, user_id, completed=None, after_id=None, limit=None, include_archived=False,
+                    oldest_first=False):
+        # Returns an executed TaskCursor (see task_list_query); the caller
+        # fetches or streams the tasks and closes it.
+        query, params = task_list_query(user_id, completed, after_id, limit, include_archived, oldest_first)
+        return TaskCursor(self._execute(conn, query, params, dictionary=False))
+
+    def query_archived_tasks(self, conn, user_id, after_id=None, limit=None):
+        # Keyset query over archived_tasks (user_id, id), newest first
+        query, params = _keyset_query('archived_tasks', user_id, None, after_id, limit)
+        return TaskCursor(self._execute(conn, query, params, dictionary=False))
+
+    def query_all_tasks(self, conn):
+        # Every live task of every user, for the legacy /tasks route: only the
+        # columns it has always returned, not the bookkeeping added since
+        return self._execute(conn, f"SELECT {TASK_COLUMNS} FROM tasks")
+
+    def _execute(self, conn, query, params=(), dictionary=True):
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            cursor.execute(query, params)
+        except BaseException:
+            cursor.close()
+            raise
+        return cursor
+
+    def get_changes(self, conn, user_id, since, max_items):
+        # Raises task_sync.ResyncRequired when a delta cannot be served
+        with self.read_transaction(conn) as cursor:
+            return task_sync.get_changes(cursor, user_id, since, max_items)
+
+    # Task writes: each one bumps the user's data version and counters in the
+    # same transaction
+
+    def create_task(self, conn, user_id, title, description='', completed=False):
+        # Returns the task as inserted (its id is the only value the server
+        # adds) and the data version of the write
+        with self.transaction(conn, prepared=True) as cursor:
+            version = task_stats.apply_stats_delta(cursor, user_id, 1, 1 if completed else 0, self.dialect)
+            cursor.execute(
+                "INSERT INTO tasks (title, description, completed, user_id, row_version) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                (title, description, 1 if completed else 0, user_id, version)
+            )
+            task_id = cursor.lastrowid
+        task = {'id': task_id, 'title': title, 'description': description, 'completed': bool(completed),
+                'user_id': user_id}
+        return task, version
+
+    def get_task(self, conn, task_id):
+        with self._cursor(conn, dictionary=False, prepared=True) as cursor:
+            cursor.execute(f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = %s", (task_id,))
+            return TaskCursor(cursor).fetchone()
+
+    def update_task(self, conn, user_id, task_id, title=None, description=None, completed=None):
+        # Returns the updated task and the data version of the write, or
+        # (None, None) if the user has no such task. The locked ownership
+        # read also yields the old completed (for the counters) and the
+        # fields the update leaves alone (for the result).
+        # MySQL has no UPDATE ... RETURNING to fold it into the write, and
+        # deriving the delta inside the counter UPDATE would lock the stats
+        # row before the task row: the reverse of batches, toggles and
+        # archiving, which lock tasks first, so the two could deadlock.
+        with self.transaction(conn, prepared=True) as cursor:
+            cursor.execute(
+                f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = %s AND user_id = %s{self.for_update}",
+                (task_id, user_id)
+            )
+            task = TaskCursor(cursor).fetchone()
+            if not task:
+                return None, None
+
+            update_fields = []
+            params = []
+            if title is not None:
+                update_fields.append("title = %s")
+                params.append(title)
+            if description is not None:
+                update_fields.append("description = %s")
+                params.append(description)
+            completed_delta = 0
+            if completed is not None:
+                update_fields.append(task_archive.STAMP_COMPLETED_AT)
+                update_fields.append("completed = %s")
+                params.append(1 if completed else 0)
+                completed_delta = (1 if completed else 0) - (1 if task['completed'] else 0)
+
+            version = task_stats.apply_stats_delta(cursor, user_id, 0, completed_delta, self.dialect)
+            update_fields.append("row_version = %s")
+            params.append(version)
+            params.extend([task_id, user_id])
+            cursor.execute(f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = %s AND user_id = %s", params)
+
+        if title is not None:
+            task['title'] = title
+        if description is not None:
+            task['description'] = description
+        if completed is not None:
+            task['completed'] = bool(completed)
+        return task, version
+
+    def delete_task(self, conn, user_id, task_id):
+        # Returns the data version of the delete, or None if the user has no
+        # such task
+        with self.transaction(conn, prepared=True) as cursor:
+            cursor.execute(
+                f"SELECT id, completed FROM tasks WHERE id = %s AND user_id = %s{self.for_update}",
+                (task_id, user_id)
+            )
+            task = cursor.fetchone()
+            if not task:
+                return None
+
+            version = task_stats.apply_stats_delta(cursor, user_id, -1, -1 if task[1] else 0, self.dialect)
+            task_sync.record_tombstones(cursor, user_id, [task_id], version)
+            cursor.execute("DELETE FROM tasks WHERE id = %s AND user_id = %s", (task_id, user_id))
+        return version
+
+    def apply_batch(self, conn, user_id, operations):
+        # All operations succeed or fail together with a single commit;
+        # returns (results, data version), as task_batch.apply_batch
+        with self.transaction(conn, dictionary=True) as cursor:
+            return task_batch.apply_batch(cursor, user_id, operations, self.dialect)
+
+    def apply_toggles(self, conn, toggles):
+        # Coalesced completion toggles of any number of users, one commit
+        with self.transaction(conn, dictionary=True) as cursor:
+            return task_batch.apply_toggles(cursor, toggles, self.dialect)
+
+    def import_tasks(self, conn, user_id, tasks):
+        # One batch of an import, committed on its own; returns its version
+        with self.transaction(conn) as cursor:
+            return task_import.insert_tasks(cursor, user_id, tasks, self.dialect)
+
+    # Legacy /tasks writes, addressed by task id only
+
+    def create_unowned_task(self, conn, title, description):
+        with self.transaction(conn) as cursor:
+            cursor.execute("INSERT INTO tasks (title, description) VALUES (%s, %s)", (title, description))
+
+    # Like the user-scoped writes, they lock the task and keep its owner's
+    # counters, version and tombstones up to date; tasks without an owner
+    # have none.
+
+    def _lock_task_owner(self, cursor, task_id):
+        # (user_id, completed) of the task, or None if it does not exist
+        cursor.execute(f"SELECT user_id, completed FROM tasks WHERE id = %s{self.for_update}", (task_id,))
+        return cursor.fetchone()
+
+    def update_task_by_id(self, conn, task_id, title, description, completed):
+        with self.transaction(conn) as cursor:
+            task = self._lock_task_owner(cursor, task_id)
+            if task is None:
+                return
+            user_id, was_completed = task
+            version = None
+            if user_id is not None:
+                completed_delta = (1 if completed else 0) - (1 if was_completed else 0)
+                version = task_stats.apply_stats_delta(cursor, user_id, 0, completed_delta, self.dialect)
+            cursor.execute(
+                f"UPDATE tasks SET title=%s, description=%s, {task_archive.STAMP_COMPLETED_AT}, completed=%s, "
+                "row_version=COALESCE(%s, row_version) WHERE id=%s",
+                (title, description, 1 if completed else 0, version, task_id)
+            )
+
+    def delete_task_by_id(self, conn, task_id):
+        with self.transaction(conn) as cursor:
+            task = self._lock_task_owner(cursor, task_id)
+            if task is None:
+                return
+            user_id, was_completed = task
+            if user_id is not None:
+                version = task_stats.apply_stats_delta(cursor, user_id, -1, -1 if was_completed else 0, self.dialect)
+                task_sync.record_tombstones(cursor, user_id, [task_id], version)
+            cursor.execute("DELETE FROM tasks WHERE id=%s", (task_id,))
+
+    # Maintenance
+
+    def recompute_stats(self, conn, user_id=None):
+        with self.transaction(conn) as cursor:
+            task_stats.recompute_stats(cursor, user_id, self.dialect)
+
+    def compact_tombstones(self, conn, older_than_days, batch_size=1000):
+        return task_sync.compact_tombstones(conn, older_than_days, batch_size, self.dialect)
+
+    def archive_tasks(self, conn, older_than_days, batch_size=1000):
+        # Moves tasks completed more than older_than_days ago to
+        # archived_tasks, one short transaction per batch so user writes
+        # are never blocked for long. Returns the number archived.
+        with self._cursor(conn, dictionary=False) as cursor:
+            cutoff = task_archive.archive_cutoff(cursor, older_than_days, self.dialect)
+        conn.rollback()
+        total = 0
+        while True:
+            with self.transaction(conn) as cursor:
+                archived = task_archive.archive_batch(cursor, cutoff, batch_size, self.dialect)
+            if not archived:
+                return total
+            total += archived
+
+
+def create_storage(backend, mysql_config=None, pool_config=None, sqlite_config=None,
+                   replica_configs=(), replica_retry_after=5.0, shard_configs=(), sharding_config=None):
+    # Drivers are imported here so a deployment only needs the one it uses
+    if shard_configs:
+        # Shards need disjoint auto-increment ids, which SQLite cannot give
+        if backend != 'mysql':
+            raise ValueError("Sharding needs the mysql storage backend")
+        if replica_configs:
+            raise ValueError("Read replicas are not supported with sharding")
+        from sharding import ShardedStorage, shard_config
+        from storage_mysql import MySQLStorage
+        sharding_config = dict(sharding_config or {})
+        id_stride = sharding_config.pop('id_stride', 64)
+        if len(shard_configs) > id_stride:
+            raise ValueError(f"At most {id_stride} shards (SHARD_ID_STRIDE) are supported")
+        shards = [MySQLStorage(shard_config(config, index, id_stride), **(pool_config or {}))
+                  for index, config in enumerate(shard_configs)]
+        return ShardedStorage(shards, **sharding_config)
+    if backend == 'mysql':
+        from storage_mysql import MySQLStorage
+        return MySQLStorage(mysql_config, replica_configs, replica_retry_after, **(pool_config or {}))
+    if backend == 'sqlite':
+        from storage_sqlite import SQLiteStorage
+        return SQLiteStorage(**(sqlite_config or {}))
+    raise ValueError(f"Unknown storage backend: {backend!r}")
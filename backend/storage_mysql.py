@@ -0,0 +1,132 @@
+import contextlib
+import itertools
+import logging
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from db_pool import ConnectionPool
+from storage import TASK_COLUMNS, Storage, StorageBusyError, convert_task_row
+
+logger = logging.getLogger(__name__)
+
+
+class MySQLStorage(Storage):
+    """Storage on a MySQL server through the pooled connections of db_pool.
+
+    Reads that tolerate replication lag can be served by replicas, each with
+    its own pool; everything else goes to the primary.
+    """
+
+    dialect = 'mysql'
+    Error = mysql.connector.Error
+    for_update = ' FOR UPDATE'
+
+    def __init__(self, config, replica_configs=(), replica_retry_after=5.0, **pool_config):
+        self.pool = ConnectionPool(config, **pool_config)
+        self.replica_pools = [ConnectionPool(replica, readonly=True, **pool_config) for replica in replica_configs]
+        self.replica_retry_after = replica_retry_after
+        self._next_replica = itertools.count()
+        self._lock = threading.Lock()
+        self._replica_down_until = [0.0] * len(self.replica_pools)
+        self._replica_fallbacks = 0
+
+    @property
+    def has_replicas(self):
+        return bool(self.replica_pools)
+
+    def acquire(self, readonly=False, user_id=None):
+        if readonly and self.replica_pools:
+            conn = self._acquire_replica()
+            if conn is not None:
+                return conn
+        return self.pool.acquire()
+
+    def _acquire_replica(self):
+        # Round robin over the replicas. A replica that cannot be reached is
+        # skipped for replica_retry_after seconds; a busy one is skipped for
+        # this checkout only. Returns None when no replica can serve, and the
+        # read then goes to the primary.
+        count = len(self.replica_pools)
+        first = next(self._next_replica)
+        for offset in range(count):
+            index = (first + offset) % count
+            if self._replica_down_until[index] > time.monotonic():
+                continue
+            try:
+                return self.replica_pools[index].acquire()
+            except StorageBusyError as e:
+                logger.warning("Replica %s busy: %s", index, e)
+            except mysql.connector.Error as err:
+                logger.warning("Replica %s unavailable for %ss: %s", index, self.replica_retry_after, err)
+                self._replica_down_until[index] = time.monotonic() + self.replica_retry_after
+        with self._lock:
+            self._replica_fallbacks += 1
+        return None
+
+    def stats(self):
+        stats = self.pool.stats()
+        if self.replica_pools:
+            with self._lock:
+                stats['replica_fallbacks'] = self._replica_fallbacks
+            stats['replicas'] = self.replica_stats()
+        return stats
+
+    def queue_depth(self):
+        return self.pool.waiters
+
+    def replica_stats(self):
+        now = time.monotonic()
+        return [
+            dict(pool.stats(), up=int(self._replica_down_until[index] <= now))
+            for index, pool in enumerate(self.replica_pools)
+        ]
+
+    def dispose(self):
+        self.pool.dispose()
+        for pool in self.replica_pools:
+            pool.dispose()
+
+    @contextlib.contextmanager
+    def migration_lock(self, conn, timeout=60):
+        # Named server lock, so workers on several hosts migrate one at a time
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK('quicktask_migrate', %s)", (timeout,))
+            if cursor.fetchone()[0] != 1:
+                raise RuntimeError("Timed out waiting for the migration lock")
+            try:
+                yield
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('quicktask_migrate')")
+                cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def _begin_read(self, cursor):
+        # A fresh snapshot, even if the connection already read in an
+        # implicit transaction earlier in the request
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+
+    def ddl_already_applied(self, err):
+        # CREATE INDEX / ADD COLUMN have no IF NOT EXISTS in MySQL
+        return err.errno in (errorcode.ER_DUP_KEYNAME, errorcode.ER_DUP_FIELDNAME)
+
+    def search_tasks(self, conn, user_id, terms, limit, offset):
+        # Served by the FULLTEXT index on (title, description), ranked by
+        # relevance. Every term must match, as a prefix.
+        against = ' '.join(f"+{term}*" for term in terms)
+        with self._cursor(conn) as cursor:
+            cursor.execute(
+                f"SELECT {TASK_COLUMNS}, "
+                "MATCH(title, description) AGAINST (%s IN BOOLEAN MODE) AS score "
+                "FROM tasks WHERE user_id = %s AND MATCH(title, description) AGAINST (%s IN BOOLEAN MODE) "
+                "ORDER BY score DESC, id DESC LIMIT %s OFFSET %s",
+                (against, user_id, against, limit, offset)
+            )
+            tasks = [convert_task_row(task) for task in cursor.fetchall()]
+        for task in tasks:
+            task['score'] = float(task['score'])
+        return tasks
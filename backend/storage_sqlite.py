@@ -0,0 +1,229 @@
+import functools
+import logging
+import sqlite3
+import threading
+import weakref
+
+import metrics
+import query_budget
+import task_stats
+import task_sync
+from storage import TASK_COLUMNS, Storage, convert_task_row
+
+logger = logging.getLogger(__name__)
+
+# Embedded storage for single-node deployments. Each thread keeps one open
+# connection for its lifetime, so queries skip connection setup and the
+# statement cache of that connection stays warm. WAL mode lets readers run
+# while one writer commits; writes take the write lock up front with
+# BEGIN IMMEDIATE instead of row locks.
+
+
+@functools.lru_cache(maxsize=1024)
+def _translate(query):
+    # The shared SQL is written with the MySQL driver's %s placeholders
+    return query.replace('%s', '?')
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SQLiteCursor:
+    """sqlite3 cursor that accepts %s placeholders and can return dict rows."""
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        if dictionary:
+            cursor.row_factory = _dict_row
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query, params=()):
+        self._cursor.execute(_translate(query), params)
+
+    def executemany(self, query, seq_params):
+        self._cursor.executemany(_translate(query), seq_params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """A thread's connection, with the same interface as PooledConnection."""
+
+    readonly = False
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.request_scoped = False
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def cursor(self, dictionary=False, **kwargs):
+        cursor = SQLiteCursor(self._raw.cursor(), dictionary)
+        return metrics.wrap_cursor(cursor)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self.request_scoped:
+            return
+        self.release()
+
+    def release(self):
+        # The connection stays open for its thread; only the transaction ends
+        self.request_scoped = False
+        if self._raw.in_transaction:
+            self._raw.rollback()
+
+
+class SQLiteStorage(Storage):
+    """Storage in a local SQLite file with one connection per thread."""
+
+    dialect = 'sqlite'
+    Error = sqlite3.Error
+
+    def __init__(self, path='quicktask.db', busy_timeout=5.0, cached_statements=256,
+                 synchronous='NORMAL', cache_size_kb=65536, mmap_size=268435456):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Connections close when their thread goes away
+        self._connections = weakref.WeakSet()
+        self._connects = 0
+        self._checkouts = 0
+
+    def _connect(self):
+        # isolation_level=None: transactions are opened explicitly, never
+        # implicitly by the driver
+        raw = sqlite3.connect(
+            self.path, timeout=self.busy_timeout, isolation_level=None,
+            check_same_thread=False, cached_statements=self.cached_statements
+        )
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute(f"PRAGMA synchronous={self.synchronous}")
+        raw.execute("PRAGMA foreign_keys=ON")
+        raw.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        raw.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        raw.execute("PRAGMA temp_store=MEMORY")
+        conn = SQLiteConnection(raw)
+        with self._lock:
+            self._connects += 1
+            self._connections.add(conn)
+        logger.debug("Opened SQLite connection to %s", self.path)
+        return conn
+
+    def acquire(self, readonly=False, user_id=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        with self._lock:
+            self._checkouts += 1
+        return conn
+
+    def _begin_write(self, cursor):
+        # Take the write lock now rather than on the first write, so two
+        # writers never deadlock upgrading from a read lock. Not counted
+        # against the query budget: MySQL starts its transactions implicitly,
+        # and budgets are shared between the two.
+        with query_budget.paused():
+            cursor.execute("BEGIN IMMEDIATE")
+
+    def _begin_read(self, cursor):
+        # Connections are in autocommit mode, so without it every SELECT
+        # would see its own snapshot. In WAL mode a deferred transaction
+        # keeps the snapshot of its first read until it ends.
+        cursor.execute("BEGIN")
+
+    def dispose(self):
+        with self._lock:
+            connections = list(self._connections)
+            self._connections = weakref.WeakSet()
+        for conn in connections:
+            try:
+                conn._raw.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def ddl_already_applied(self, err):
+        # ALTER TABLE ADD COLUMN has no IF NOT EXISTS in SQLite; every other
+        # migration statement uses IF NOT EXISTS
+        return 'duplicate column name' in str(err)
+
+    def delete_task(self, conn, user_id, task_id):
+        # The ownership-scoped DELETE reports the old completed itself, so no
+        # locking read is needed: BEGIN IMMEDIATE already serializes writers.
+        # RETURNING needs SQLite 3.35.
+        if sqlite3.sqlite_version_info < (3, 35):
+            return super().delete_task(conn, user_id, task_id)
+        with self.transaction(conn, prepared=True) as cursor:
+            cursor.execute("DELETE FROM tasks WHERE id = %s AND user_id = %s RETURNING completed", (task_id, user_id))
+            task = cursor.fetchone()
+            if not task:
+                return None
+
+            version = task_stats.apply_stats_delta(
+                cursor, user_id, -1, -1 if task[0] else 0, self.dialect, written=True
+            )
+            task_sync.record_tombstones(cursor, user_id, [task_id], version)
+        return version
+
+    def search_tasks(self, conn, user_id, terms, limit, offset):
+        # FTS5 index kept in sync with tasks by triggers; bm25() is lower for
+        # better matches, so it is negated to rank like MySQL's MATCH score
+        match = ' '.join(f'"{term}"*' for term in terms)
+        columns = ', '.join(f"t.{column.strip()}" for column in TASK_COLUMNS.split(','))
+        with self._cursor(conn) as cursor:
+            cursor.execute(
+                f"SELECT {columns}, -bm25(tasks_fts) AS score "
+                "FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid "
+                "WHERE tasks_fts MATCH %s AND t.user_id = %s "
+                "ORDER BY score DESC, t.id DESC LIMIT %s OFFSET %s",
+                (match, user_id, limit, offset)
+            )
+            return [convert_task_row(task) for task in cursor.fetchall()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'connections': len(self._connections),
+                'connects': self._connects,
+                'checkouts': self._checkouts
+            }
@@ -0,0 +1,103 @@
+import csv
+import functools
+import io
+import logging
+
+from flask import Response, current_app, request, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+# Streams query results straight from an unbuffered cursor: rows are pulled
+# with fetchmany() and encoded one batch at a time, so memory per request is
+# bounded by the batch size instead of the result size.
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+CSV_MIMETYPE = 'text/csv'
+
+
+def stream_format(default_stream):
+    # Picks 'ndjson', 'json' (streamed array) or None (buffered jsonify).
+    # ?format=ndjson or an NDJSON Accept header selects NDJSON; ?stream=0/1
+    # overrides the route's default for the JSON array.
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    stream = request.args.get('stream')
+    if stream is None:
+        return 'json' if default_stream else None
+    return 'json' if stream in ('1', 'true') else None
+
+
+def _iter_batches(cursor, batch_size, transform):
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if transform:
+                rows = [transform(row) for row in rows]
+            yield rows
+    finally:
+        cursor.close()
+
+
+def json_encoder():
+    # bytes-producing dumps of the app's JSON provider
+    json = current_app.json
+    dumps_bytes = getattr(json, 'dumps_bytes', None)
+    if dumps_bytes is not None:
+        return dumps_bytes
+    return lambda obj: json.dumps(obj).encode('utf-8')
+
+
+def _json_array(cursor, batch_size, transform):
+    encode = json_encoder()
+    yield b'['
+    first = True
+    for rows in _iter_batches(cursor, batch_size, transform):
+        # One encoder call per batch: the batch as an array, brackets dropped
+        chunk = encode(rows)[1:-1]
+        yield chunk if first else b',' + chunk
+        first = False
+    yield b']\n'
+
+
+def _ndjson(cursor, batch_size, transform):
+    encode = json_encoder()
+    for rows in _iter_batches(cursor, batch_size, transform):
+        yield b''.join(encode(row) + b'\n' for row in rows)
+
+
+def _csv(cursor, batch_size, transform, columns):
+    # Header first, so an empty result is still a valid file
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for rows in _iter_batches(cursor, batch_size, transform):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def stream_rows(cursor, fmt, batch_size, transform=None, columns=None):
+    # Takes ownership of an executed cursor and closes it when the last row
+    # has been sent. The request context (and with it the pooled connection)
+    # stays alive until then. A database error mid-stream can no longer
+    # change the status code, so the body is simply cut short. fmt 'csv'
+    # writes the dict keys in `columns`.
+    if fmt == 'csv':
+        generate = functools.partial(_csv, columns=columns)
+    else:
+        generate = _ndjson if fmt == 'ndjson' else _json_array
+
+    def body():
+        try:
+            yield from generate(cursor, batch_size, transform)
+        except Exception as e:
+            logger.error("Error while streaming rows: %s", e)
+            raise
+
+    mimetype = {'ndjson': NDJSON_MIMETYPE, 'csv': CSV_MIMETYPE}.get(fmt, 'application/json')
+    return Response(stream_with_context(body()), mimetype=mimetype)
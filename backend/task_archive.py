@@ -0,0 +1,63 @@
+from task_stats import apply_stats_delta
+from task_sync import record_tombstones
+
+# Hot/cold split of the tasks table. Completed tasks whose completed_at is
+# older than the retention are moved to archived_tasks in bounded batches,
+# so tasks and its indexes only hold what users still work on. To every
+# reader of tasks an archived task is gone, exactly as if it had been
+# deleted: it leaves a tombstone (sync clients drop it) and leaves the
+# user's counters. GET /api/tasks?include_archived=1 and GET
+# /api/tasks/archive read it back; archived tasks are read-only.
+
+ARCHIVED_COLUMNS = "id, title, description, completed, user_id, completed_at"
+
+# completed_at is when the task was last marked completed. Statements that
+# set `completed` put this assignment before it: MySQL evaluates SET clauses
+# left to right, so `completed` still holds the old value here (SQLite
+# always reads old values). Tasks that are not completed carry a stale
+# value, which nothing reads.
+STAMP_COMPLETED_AT = "completed_at = CASE WHEN completed = 1 THEN completed_at ELSE CURRENT_TIMESTAMP END"
+
+
+def archive_cutoff(cursor, older_than_days, dialect='mysql'):
+    # Fixed once per run, like the tombstone compaction cutoff
+    if dialect == 'sqlite':
+        cursor.execute("SELECT datetime('now', %s)", (f"-{int(older_than_days)} days",))
+    else:
+        cursor.execute("SELECT NOW() - INTERVAL %s DAY", (older_than_days,))
+    return cursor.fetchone()[0]
+
+
+def archive_batch(cursor, cutoff, batch_size, dialect='mysql'):
+    # Moves up to batch_size tasks completed before the cutoff, oldest first,
+    # with one locking SELECT, one counter/version UPDATE and one tombstone
+    # INSERT per user, one INSERT ... SELECT and one DELETE. Returns the
+    # number of tasks archived. The caller owns the transaction.
+    lock = '' if dialect == 'sqlite' else ' FOR UPDATE'
+    cursor.execute(
+        "SELECT id, user_id FROM tasks WHERE completed = 1 AND completed_at < %s AND user_id IS NOT NULL "
+        f"ORDER BY completed_at LIMIT %s{lock}",
+        (cutoff, batch_size)
+    )
+    by_user = {}
+    for task_id, user_id in cursor.fetchall():
+        by_user.setdefault(user_id, []).append(task_id)
+    if not by_user:
+        return 0
+
+    # Users in a fixed order, like apply_toggles, so concurrent writers lock
+    # counter rows in the same order
+    for user_id in sorted(by_user):
+        task_ids = by_user[user_id]
+        version = apply_stats_delta(cursor, user_id, -len(task_ids), -len(task_ids), dialect)
+        record_tombstones(cursor, user_id, task_ids, version)
+
+    ids = [task_id for task_ids in by_user.values() for task_id in task_ids]
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(
+        f"INSERT INTO archived_tasks ({ARCHIVED_COLUMNS}) "
+        f"SELECT {ARCHIVED_COLUMNS} FROM tasks WHERE id IN ({placeholders})",
+        ids
+    )
+    cursor.execute(f"DELETE FROM tasks WHERE id IN ({placeholders})", ids)
+    return len(ids)
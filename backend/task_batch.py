@@ -0,0 +1,208 @@
+from task_archive import STAMP_COMPLETED_AT
+from task_stats import apply_stats_delta
+from task_sync import record_tombstones
+
+# Executes a list of create/update/delete operations for one user with a
+# fixed number of statements: one ownership SELECT, one counter/version
+# UPDATE, one multi-row INSERT, one CASE-based UPDATE and one DELETE (plus
+# its tombstones). The caller owns the transaction.
+
+UPDATABLE_FIELDS = ('title', 'description', 'completed')
+
+
+def _error(index, status, message):
+    return {'index': index, 'status': status, 'error': message}
+
+
+def _validate(index, op, seen_ids):
+    # Returns an error result, or None if the operation is well formed
+    if not isinstance(op, dict):
+        return _error(index, 400, 'Operation must be an object')
+
+    kind = op.get('op')
+    if kind == 'create':
+        title = op.get('title')
+        if not isinstance(title, str) or not title:
+            return _error(index, 400, 'Title is required')
+        return None
+
+    if kind not in ('update', 'delete'):
+        return _error(index, 400, "op must be one of 'create', 'update', 'delete'")
+
+    task_id = op.get('id')
+    if not isinstance(task_id, int) or isinstance(task_id, bool):
+        return _error(index, 400, 'Task id is required')
+    if task_id in seen_ids:
+        return _error(index, 409, 'Task appears more than once in batch')
+    if kind == 'update' and not any([op.get('title'), op.get('description'), op.get('completed') is not None]):
+        return _error(index, 400, 'No valid fields to update')
+
+    seen_ids.add(task_id)
+    return None
+
+
+def apply_batch(cursor, user_id, operations, dialect='mysql'):
+    # Returns (one result per operation, the batch's data version); the
+    # version is None when no operation wrote anything
+    results = [None] * len(operations)
+    creates, updates, deletes = [], [], []
+    seen_ids = set()
+
+    for index, op in enumerate(operations):
+        error = _validate(index, op, seen_ids)
+        if error:
+            results[index] = error
+        elif op['op'] == 'create':
+            creates.append((index, op))
+        elif op['op'] == 'update':
+            updates.append((index, op))
+        else:
+            deletes.append((index, op))
+
+    # Set-based ownership check for every update and delete; the rows stay
+    # locked so the counter deltas computed from them remain exact (SQLite
+    # callers already hold the database write lock)
+    existing = {}
+    target_ids = [op['id'] for _, op in updates + deletes]
+    if target_ids:
+        placeholders = ', '.join(['%s'] * len(target_ids))
+        lock = '' if dialect == 'sqlite' else ' FOR UPDATE'
+        cursor.execute(
+            f"SELECT id, title, description, completed, user_id FROM tasks "
+            f"WHERE user_id = %s AND id IN ({placeholders}){lock}",
+            [user_id] + target_ids
+        )
+        for row in cursor.fetchall():
+            existing[row['id']] = row
+
+    for index, op in updates + deletes:
+        if op['id'] not in existing:
+            results[index] = _error(index, 404, 'Task not found')
+    updates = [(i, op) for i, op in updates if op['id'] in existing]
+    deletes = [(i, op) for i, op in deletes if op['id'] in existing]
+
+    if not (creates or updates or deletes):
+        return results, None
+
+    # Counters and the data version are updated first; the version is
+    # stamped on every row this batch writes
+    total_delta = len(creates) - len(deletes)
+    completed_delta = sum(1 for _, op in creates if op.get('completed'))
+    for _, op in updates:
+        if op.get('completed') is not None:
+            completed_delta += (1 if op['completed'] else 0) - (1 if existing[op['id']]['completed'] else 0)
+    completed_delta -= sum(1 for _, op in deletes if existing[op['id']]['completed'])
+    version = apply_stats_delta(cursor, user_id, total_delta, completed_delta, dialect)
+
+    if creates:
+        rows = []
+        for _, op in creates:
+            rows.append((op['title'], op.get('description', ''), 1 if op.get('completed') else 0, user_id, version))
+        placeholders = ', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))
+        cursor.execute(
+            f"INSERT INTO tasks (title, description, completed, user_id, row_version) VALUES {placeholders}",
+            [value for row in rows for value in row]
+        )
+        # The ids are read back rather than derived from lastrowid: they are
+        # not consecutive on a shard (auto_increment_increment is the shard
+        # id stride). Only this batch's new rows carry its version yet (the
+        # updates below stamp it later), and one INSERT assigns ids in row
+        # order.
+        cursor.execute(
+            "SELECT id FROM tasks WHERE user_id = %s AND row_version = %s ORDER BY id",
+            (user_id, version)
+        )
+        task_ids = [row['id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+        for task_id, (index, _), row in zip(task_ids, creates, rows):
+            task = {
+                'id': task_id,
+                'title': row[0],
+                'description': row[1],
+                'completed': bool(row[2]),
+                'user_id': user_id
+            }
+            results[index] = {'index': index, 'status': 201, 'task': task}
+
+    if updates:
+        assignments = ["row_version = %s"]
+        params = [version]
+        for field in UPDATABLE_FIELDS:
+            cases = [(op['id'], op[field]) for _, op in updates if op.get(field) is not None]
+            if not cases:
+                continue
+            if field == 'completed':
+                assignments.append(STAMP_COMPLETED_AT)
+            clause = ' '.join(['WHEN %s THEN %s'] * len(cases))
+            assignments.append(f"{field} = CASE id {clause} ELSE {field} END")
+            for task_id, value in cases:
+                params.extend([task_id, (1 if value else 0) if field == 'completed' else value])
+
+        ids = [op['id'] for _, op in updates]
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(
+            f"UPDATE tasks SET {', '.join(assignments)} WHERE user_id = %s AND id IN ({placeholders})",
+            params + [user_id] + ids
+        )
+
+        for index, op in updates:
+            task = dict(existing[op['id']])
+            for field in UPDATABLE_FIELDS:
+                if op.get(field) is not None:
+                    task[field] = op[field]
+            task['completed'] = bool(task['completed'])
+            results[index] = {'index': index, 'status': 200, 'task': task}
+
+    if deletes:
+        ids = [op['id'] for _, op in deletes]
+        record_tombstones(cursor, user_id, ids, version)
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(
+            f"DELETE FROM tasks WHERE user_id = %s AND id IN ({placeholders})",
+            [user_id] + ids
+        )
+        for index, op in deletes:
+            results[index] = {'index': index, 'status': 200, 'id': op['id']}
+
+    return results, version
+
+
+def apply_toggles(cursor, toggles, dialect='mysql'):
+    # Writes coalesced completion toggles ({task_id: (user_id, completed)},
+    # possibly for many users) with one locking SELECT, one counter/version
+    # UPDATE per user whose counts change and one CASE-based UPDATE. Tasks
+    # deleted or already in the requested state are skipped. Returns the
+    # number of tasks written. The caller owns the transaction.
+    ids = sorted(toggles)
+    placeholders = ', '.join(['%s'] * len(ids))
+    lock = '' if dialect == 'sqlite' else ' FOR UPDATE'
+    cursor.execute(f"SELECT id, user_id, completed FROM tasks WHERE id IN ({placeholders}){lock}", ids)
+    current = {row['id']: row for row in cursor.fetchall()}
+
+    changes = {}  # user_id -> [(task_id, completed)]
+    for task_id in ids:
+        user_id, completed = toggles[task_id]
+        row = current.get(task_id)
+        if row is None or row['user_id'] != user_id or bool(row['completed']) == completed:
+            continue
+        changes.setdefault(user_id, []).append((task_id, completed))
+
+    versions = {}
+    for user_id in sorted(changes):
+        completed_delta = sum(1 if completed else -1 for _, completed in changes[user_id])
+        versions[user_id] = apply_stats_delta(cursor, user_id, 0, completed_delta, dialect)
+
+    changed = [(task_id, completed, versions[user_id])
+               for user_id, rows in changes.items() for task_id, completed in rows]
+    if changed:
+        clause = ' '.join(['WHEN %s THEN %s'] * len(changed))
+        params = [value for task_id, completed, _ in changed for value in (task_id, 1 if completed else 0)]
+        params += [value for task_id, _, version in changed for value in (task_id, version)]
+        params += [task_id for task_id, _, _ in changed]
+        cursor.execute(
+            f"UPDATE tasks SET {STAMP_COMPLETED_AT}, completed = CASE id {clause} ELSE completed END, "
+            f"row_version = CASE id {clause} ELSE row_version END "
+            f"WHERE id IN ({', '.join(['%s'] * len(changed))})",
+            params
+        )
+
+    return len(changed)
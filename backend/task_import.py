@@ -0,0 +1,119 @@
+import csv
+import io
+
+from task_stats import apply_stats_delta
+
+# Bulk export and import of one user's tasks. GET /api/tasks/export streams
+# EXPORT_COLUMNS as NDJSON or CSV; POST /api/tasks/import reads either
+# format back. The upload is parsed line by line and written in batches,
+# each its own transaction with one counter/version UPDATE and one
+# multi-row INSERT, so memory is bounded by the batch size however large
+# the upload is. Ids in the upload are ignored: imported tasks get new ones.
+
+EXPORT_COLUMNS = ('id', 'title', 'description', 'completed')
+
+# tasks.title is VARCHAR(255) on MySQL
+TITLE_MAX_LENGTH = 255
+
+
+class InvalidImportRow(ValueError):
+    """A line of the upload is not a valid task; earlier lines are imported."""
+
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def export_row(task):
+    return {column: task[column] for column in EXPORT_COLUMNS}
+
+
+def _completed(line, value):
+    # JSON booleans, 0/1, or their CSV spellings; missing means not completed
+    if isinstance(value, bool):
+        return value
+    if value in (None, 0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ('', 'true', 'false', '0', '1'):
+        return value.strip().lower() in ('true', '1')
+    raise InvalidImportRow(line, 'completed must be true or false')
+
+
+def _task(line, row):
+    # (title, description, completed) of one uploaded task
+    if not isinstance(row, dict):
+        raise InvalidImportRow(line, 'Task must be an object')
+    title = row.get('title')
+    if not isinstance(title, str) or not title:
+        raise InvalidImportRow(line, 'Title is required')
+    if len(title) > TITLE_MAX_LENGTH:
+        raise InvalidImportRow(line, f'Title is longer than {TITLE_MAX_LENGTH} characters')
+    description = row.get('description')
+    if description is None:
+        description = ''
+    if not isinstance(description, str):
+        raise InvalidImportRow(line, 'Description must be a string')
+    return title, description, _completed(line, row.get('completed'))
+
+
+def parse_ndjson(stream, loads):
+    # One JSON object per line; blank lines are skipped
+    for line, raw in enumerate(stream, 1):
+        if not raw.strip():
+            continue
+        try:
+            row = loads(raw)
+        except ValueError:
+            raise InvalidImportRow(line, 'Invalid JSON') from None
+        yield _task(line, row)
+
+
+def parse_csv(stream):
+    # A header row naming the columns, as in the export; only title is
+    # required. line_num counts physical lines, so quoted newlines in a
+    # description do not throw the reported line off.
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    try:
+        if reader.fieldnames is None:
+            return
+        if 'title' not in reader.fieldnames:
+            raise InvalidImportRow(1, 'Header must name a title column')
+        for row in reader:
+            yield _task(reader.line_num, row)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise InvalidImportRow(reader.line_num, f'Invalid CSV: {e}') from None
+
+
+def import_batches(tasks, size):
+    # Lists of up to `size` parsed tasks. An invalid line ends the import
+    # after the tasks before it have been handed out.
+    batch = []
+    try:
+        for task in tasks:
+            batch.append(task)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    except InvalidImportRow:
+        if batch:
+            yield batch
+        raise
+    if batch:
+        yield batch
+
+
+def insert_tasks(cursor, user_id, tasks, dialect='mysql'):
+    # Writes one batch of (title, description, completed) and returns the
+    # data version stamped on it. The caller owns the transaction.
+    version = apply_stats_delta(
+        cursor, user_id, len(tasks), sum(1 for _, _, completed in tasks if completed), dialect
+    )
+    placeholders = ', '.join(['(%s, %s, %s, %s, %s)'] * len(tasks))
+    params = []
+    for title, description, completed in tasks:
+        params.extend([title, description, 1 if completed else 0, user_id, version])
+    cursor.execute(
+        f"INSERT INTO tasks (title, description, completed, user_id, row_version) VALUES {placeholders}",
+        params
+    )
+    return version
@@ -0,0 +1,109 @@
+import logging
+
+import query_budget
+
+logger = logging.getLogger(__name__)
+
+# Per-user task counters and data version kept in user_task_stats. Every
+# helper takes a cursor on the caller's connection and never commits, so
+# counter changes land in the same transaction as the task write they
+# describe. The version only ever increases; it backs the ETag of the task
+# list, so any write to a user's tasks must go through apply_stats_delta.
+# `dialect` is the storage engine ('mysql' or
+# 'sqlite') for the few statements that differ.
+
+
+def _upsert_counts(dialect):
+    if dialect == 'sqlite':
+        return ("ON CONFLICT (user_id) DO UPDATE SET total = excluded.total, "
+                "completed = excluded.completed, version = version + 1")
+    return ("ON DUPLICATE KEY UPDATE total = VALUES(total), completed = VALUES(completed), "
+            "version = version + 1")
+
+
+def _bump_version(cursor, assignments, where, params, dialect):
+    # Increments the version of the matched stats row and returns the new
+    # value in the same statement, or None if no row matched
+    if dialect == 'sqlite':
+        cursor.execute(
+            f"UPDATE user_task_stats SET {assignments}version = version + 1 WHERE {where} RETURNING version",
+            params
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row['version'] if isinstance(row, dict) else row[0]
+
+    cursor.execute(
+        f"UPDATE user_task_stats SET {assignments}version = LAST_INSERT_ID(version + 1) WHERE {where}",
+        params
+    )
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+def recompute_stats(cursor, user_id=None, dialect='mysql'):
+    # Rebuild counters from the tasks table, for one user or for everyone
+    if user_id is not None:
+        cursor.execute(
+            "INSERT INTO user_task_stats (user_id, total, completed) "
+            "SELECT %s, COUNT(*), COALESCE(SUM(completed), 0) FROM tasks WHERE user_id = %s "
+            + _upsert_counts(dialect),
+            (user_id, user_id)
+        )
+        return
+
+    # Rows are updated in place rather than deleted so versions never go back
+    cursor.execute(
+        "UPDATE user_task_stats SET total = 0, completed = 0, version = version + 1 "
+        "WHERE NOT EXISTS (SELECT 1 FROM tasks WHERE tasks.user_id = user_task_stats.user_id)"
+    )
+    cursor.execute(
+        "INSERT INTO user_task_stats (user_id, total, completed) "
+        "SELECT user_id, COUNT(*), COALESCE(SUM(completed), 0) FROM tasks "
+        "WHERE user_id IS NOT NULL GROUP BY user_id "
+        + _upsert_counts(dialect)
+    )
+
+
+def apply_stats_delta(cursor, user_id, total_delta, completed_delta, dialect='mysql', written=False):
+    # Call before the task write it describes: returns the new data version
+    # to stamp on the written rows. The row lock taken here is held until
+    # commit, so a user's writes commit in version order. written=True when
+    # the write already happened in this transaction (and holds its lock).
+    assignments = "total = total + %s, completed = completed + %s, "
+    params = (total_delta, completed_delta, user_id)
+    version = _bump_version(cursor, assignments, "user_id = %s", params, dialect)
+    if version is None:
+        # No counters yet (user predates the table): build them from the
+        # tasks table as it is before this write, then apply the delta
+        # (unless the rebuild already saw the write). Once per user, so not
+        # counted against the query budget.
+        logger.info("Initializing task stats for user %s", user_id)
+        if written:
+            params = (0, 0, user_id)
+        with query_budget.paused():
+            recompute_stats(cursor, user_id, dialect)
+            version = _bump_version(cursor, assignments, "user_id = %s", params, dialect)
+    return version
+
+
+def get_data_version(cursor, user_id):
+    # Single primary key lookup; None if the user has no stats row yet
+    cursor.execute("SELECT version FROM user_task_stats WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return int(row['version'] if isinstance(row, dict) else row[0])
+
+
+def get_stats(cursor, user_id):
+    cursor.execute("SELECT total, completed FROM user_task_stats WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    total, completed = (row['total'], row['completed']) if isinstance(row, dict) else row
+    return {
+        'total': int(total),
+        'completed': int(completed),
+        'pending': int(total) - int(completed)
+    }
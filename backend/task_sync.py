@@ -0,0 +1,111 @@
+# Delta sync over the per-user data version. Created and updated tasks carry
+# the version of their last write in tasks.row_version; deleted tasks leave a
+# tombstone with the version of the delete. Both are indexed by
+# (user_id, version), so a sync reads only what changed.
+
+
+class ResyncRequired(Exception):
+    """The client's version is too old to be served as a delta."""
+
+
+def record_tombstones(cursor, user_id, task_ids, version):
+    if not task_ids:
+        return
+    placeholders = ', '.join(['(%s, %s, %s)'] * len(task_ids))
+    params = []
+    for task_id in task_ids:
+        params.extend([task_id, user_id, version])
+    cursor.execute(
+        f"INSERT INTO task_tombstones (task_id, user_id, version) VALUES {placeholders}",
+        params
+    )
+
+
+def get_changes(cursor, user_id, since, max_items):
+    # Returns (version, changed tasks, deleted task ids) for everything after
+    # `since`. The caller runs it in a read transaction (see
+    # Storage.read_transaction): all reads then share one snapshot, so the
+    # returned version exactly covers the returned changes.
+    cursor.execute(
+        "SELECT version, pruned_version FROM user_task_stats WHERE user_id = %s",
+        (user_id,)
+    )
+    row = cursor.fetchone()
+    version, pruned_version = (row['version'], row['pruned_version']) if row else (0, 0)
+
+    if since > version:
+        raise ResyncRequired("Version is newer than the server's")
+    if since < pruned_version:
+        raise ResyncRequired("Deletions after this version have been compacted")
+    if since == version:
+        return version, [], []
+
+    cursor.execute(
+        "SELECT id, title, description, completed, user_id FROM tasks "
+        "WHERE user_id = %s AND row_version > %s ORDER BY row_version LIMIT %s",
+        (user_id, since, max_items + 1)
+    )
+    changed = cursor.fetchall()
+
+    cursor.execute(
+        "SELECT task_id FROM task_tombstones "
+        "WHERE user_id = %s AND version > %s ORDER BY version LIMIT %s",
+        (user_id, since, max_items + 1)
+    )
+    deleted = [r['task_id'] if isinstance(r, dict) else r[0] for r in cursor.fetchall()]
+
+    # Too far behind: a full reload is cheaper than a huge delta
+    if len(changed) + len(deleted) > max_items:
+        raise ResyncRequired("Too many changes since this version")
+
+    for task in changed:
+        task['completed'] = bool(task['completed'])
+    return version, changed, deleted
+
+
+def compact_tombstones(conn, older_than_days, batch_size=1000, dialect='mysql'):
+    # Deletes tombstones older than the cutoff in bounded batches, committing
+    # after each one. Each user's pruned_version is raised first so clients
+    # that could have missed those deletions are told to resync.
+    cursor = conn.cursor()
+    try:
+        # Fix the cutoff once so every batch removes exactly what was pruned
+        if dialect == 'sqlite':
+            cursor.execute("SELECT datetime('now', %s)", (f"-{int(older_than_days)} days",))
+        else:
+            cursor.execute("SELECT NOW() - INTERVAL %s DAY", (older_than_days,))
+        cutoff = cursor.fetchone()[0]
+
+        if dialect == 'sqlite':
+            cursor.execute(
+                "UPDATE user_task_stats SET pruned_version = MAX(pruned_version, t.max_version) FROM ("
+                "SELECT user_id, MAX(version) AS max_version FROM task_tombstones "
+                "WHERE deleted_at < %s GROUP BY user_id"
+                ") AS t WHERE t.user_id = user_task_stats.user_id",
+                (cutoff,)
+            )
+            # SQLite has no DELETE ... LIMIT unless compiled in
+            delete_batch = ("DELETE FROM task_tombstones WHERE task_id IN ("
+                            "SELECT task_id FROM task_tombstones WHERE deleted_at < %s LIMIT %s)")
+        else:
+            cursor.execute(
+                "UPDATE user_task_stats s JOIN ("
+                "SELECT user_id, MAX(version) AS max_version FROM task_tombstones "
+                "WHERE deleted_at < %s GROUP BY user_id"
+                ") t ON t.user_id = s.user_id "
+                "SET s.pruned_version = GREATEST(s.pruned_version, t.max_version)",
+                (cutoff,)
+            )
+            delete_batch = "DELETE FROM task_tombstones WHERE deleted_at < %s LIMIT %s"
+        conn.commit()
+
+        total = 0
+        while True:
+            cursor.execute(delete_batch, (cutoff, batch_size))
+            deleted = cursor.rowcount
+            conn.commit()
+            if not deleted:
+                return total
+            total += deleted
+    finally:
+        cursor.close()
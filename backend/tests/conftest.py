@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+# The suite runs against SQLite, one database file per test. config.py reads
+# the environment at import time, so it is set up before the app is imported.
+os.environ.update(
+    STORAGE_BACKEND='sqlite',
+    MIGRATE_ON_START='1',
+    BCRYPT_ROUNDS='4',
+    RATE_LIMIT_ENABLED='0',
+    QUERY_BUDGET_MODE='strict',
+    LOG_LEVEL='WARNING',
+    ACCESS_LOG_LEVEL='WARNING'
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.SQLITE_CONFIG, 'path', str(tmp_path / 'quicktask.db'))
+    flask_app = app_module.create_app()
+    yield flask_app
+    if app_module.coalescer is not None:
+        app_module.coalescer.close()
+        app_module.coalescer = None
+    app_module.storage.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def signup(client, email='user@example.com'):
+    # Returns the Authorization header of a new user
+    response = client.post('/api/auth/signup', json={'name': email.split('@')[0], 'email': email, 'password': 'pw'})
+    assert response.status_code == 201, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+
+@pytest.fixture
+def auth(client):
+    return signup(client)
@@ -0,0 +1,74 @@
+from conftest import app_module
+
+
+def archive_old_tasks(app, titles, batch_size):
+    # Backdates the completion of the named tasks, then runs the archiver
+    conn = app_module.storage.acquire()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"UPDATE tasks SET completed_at = '2000-01-01 00:00:00' "
+            f"WHERE title IN ({', '.join(['%s'] * len(titles))})",
+            titles
+        )
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    result = app.test_cli_runner().invoke(args=['archive-tasks', '--days', '30', '--batch-size', str(batch_size)])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def make_tasks(client, auth):
+    # Returns {title: id}; 'old 1' and 'old 2' are completed
+    ids = {}
+    for title in ('old 1', 'old 2', 'open', 'done recently'):
+        ids[title] = client.post('/api/tasks', json={'title': title}, headers=auth).get_json()['id']
+    for title in ('old 1', 'old 2', 'done recently'):
+        client.put(f'/api/tasks/{ids[title]}', json={'completed': True}, headers=auth)
+    return ids
+
+
+def test_archiving_moves_old_completed_tasks(app, client, auth):
+    ids = make_tasks(client, auth)
+    output = archive_old_tasks(app, ['old 1', 'old 2'], batch_size=1)
+    assert 'Archived 2 tasks' in output
+
+    live = client.get('/api/tasks', headers=auth).get_json()
+    assert sorted(task['title'] for task in live) == ['done recently', 'open']
+    archived = client.get('/api/tasks/archive', headers=auth).get_json()
+    assert [task['id'] for task in archived['tasks']] == [ids['old 2'], ids['old 1']]
+    assert archived['next_cursor'] is None
+
+    # Archived tasks are read-only
+    assert client.put(f"/api/tasks/{ids['old 1']}", json={'title': 'x'}, headers=auth).status_code == 404
+    assert client.delete(f"/api/tasks/{ids['old 1']}", headers=auth).status_code == 404
+
+
+def test_archived_tasks_leave_tombstones_and_counters(app, client, auth):
+    ids = make_tasks(client, auth)
+    version = int(client.get('/api/tasks', headers=auth).headers['X-Data-Version'])
+    archive_old_tasks(app, ['old 1', 'old 2'], batch_size=10)
+
+    changes = client.get(f'/api/tasks/changes?since={version}', headers=auth).get_json()
+    assert changes['changed'] == []
+    assert sorted(changes['deleted']) == sorted([ids['old 1'], ids['old 2']])
+    # Stats count live tasks only
+    assert client.get('/api/tasks/stats', headers=auth).get_json() == {'total': 2, 'completed': 1, 'pending': 1}
+
+
+def test_include_archived_pages_through_live_and_archived_tasks(app, client, auth):
+    ids = make_tasks(client, auth)
+    archive_old_tasks(app, ['old 1', 'old 2'], batch_size=10)
+
+    seen = []
+    url = '/api/tasks?include_archived=1&limit=3'
+    while url:
+        page = client.get(url, headers=auth).get_json()
+        seen += [task['id'] for task in page['tasks']]
+        url = page['next_cursor'] and f"/api/tasks?include_archived=1&limit=3&cursor={page['next_cursor']}"
+    assert seen == sorted(ids.values(), reverse=True)
+
+    completed = client.get('/api/tasks?include_archived=1&completed=true', headers=auth).get_json()
+    assert sorted(task['title'] for task in completed) == ['done recently', 'old 1', 'old 2']
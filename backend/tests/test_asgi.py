@@ -0,0 +1,151 @@
+import asyncio
+import contextlib
+import json
+
+import pytest
+
+from conftest import app_module, signup
+
+# The asyncio task routes (asgi.py) against the Flask ones: the same
+# requests must get the same answers. aiomysql needs a MySQL server, so the
+# async storage here runs the sync SQLite storage's methods.
+
+
+class SyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+    async def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    async def close(self):
+        self._cursor.close()
+
+
+class SyncBackedAsyncStorage:
+    has_replicas = False
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.Error = storage.Error
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, readonly=False):
+        conn = self.storage.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    async def get_user(self, conn, user_id):
+        return self.storage.get_user(conn, user_id)
+
+    async def get_data_version(self, conn, user_id):
+        return self.storage.get_data_version(conn, user_id)
+
+    async def get_stats(self, conn, user_id):
+        return self.storage.get_stats(conn, user_id)
+
+    async def query_tasks(self, conn, *args, **kwargs):
+        return SyncCursor(self.storage.query_tasks(conn, *args, **kwargs))
+
+    async def get_task(self, conn, task_id):
+        return self.storage.get_task(conn, task_id)
+
+    async def create_task(self, conn, *args):
+        return self.storage.create_task(conn, *args)
+
+    async def update_task(self, conn, *args):
+        return self.storage.update_task(conn, *args)
+
+    async def delete_task(self, conn, *args):
+        return self.storage.delete_task(conn, *args)
+
+
+@pytest.fixture
+def asgi_app(app):
+    import asgi
+    return asgi.AsyncTaskApp(app, SyncBackedAsyncStorage(app_module.storage))
+
+
+def call_asgi(asgi_app, method, url, headers, body=None):
+    path, _, query = url.partition('?')
+    raw = json.dumps(body).encode() if body is not None else b''
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'root_path': '',
+        'method': method, 'path': path, 'query_string': query.encode(),
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(raw)).encode())]
+        + [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    }
+    messages = [{'type': 'http.request', 'body': raw}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    response_headers = {name.decode().lower(): value.decode() for name, value in sent[0]['headers']}
+    return sent[0]['status'], response_headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def call_flask(client, method, url, headers, body=None):
+    response = client.open(url, method=method, headers=headers, json=body)
+    return response.status_code, {name.lower(): value for name, value in response.headers}, response.get_data()
+
+
+COMPARED_HEADERS = ('etag', 'x-data-version', 'content-type')
+
+
+def assert_same(client, asgi_app, method, url, headers, body=None):
+    flask_status, flask_headers, flask_body = call_flask(client, method, url, headers, body)
+    asgi_status, asgi_headers, asgi_body = call_asgi(asgi_app, method, url, headers, body)
+    assert asgi_status == flask_status, url
+    assert json_lines(asgi_body) == json_lines(flask_body), url
+    for name in COMPARED_HEADERS:
+        assert asgi_headers.get(name) == flask_headers.get(name), (url, name)
+
+
+def json_lines(body):
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+LIST_QUERIES = [
+    '', '?limit=1', '?limit=', '?limit=x', '?limit=1&limit=5', '?cursor=', '?completed=', '?completed=true',
+    '?completed=maybe', '?include_archived=', '?stream=', '?stream=0', '?stream=1', '?format=ndjson', '?format='
+]
+
+
+def test_task_lists_match(client, asgi_app):
+    auth = signup(client)
+    for n in range(3):
+        client.post('/api/tasks', json={'title': f'Task {n}', 'completed': n == 1}, headers=auth)
+    for query in LIST_QUERIES:
+        assert_same(client, asgi_app, 'GET', f'/api/tasks{query}', auth)
+    assert_same(client, asgi_app, 'GET', '/api/tasks/stats', auth)
+
+
+def test_missing_or_bad_token_matches(client, asgi_app):
+    assert_same(client, asgi_app, 'GET', '/api/tasks', {})
+    assert_same(client, asgi_app, 'GET', '/api/tasks', {'Authorization': 'Bearer not-a-token'})
+
+
+def test_writes_match(client, asgi_app):
+    auth = signup(client)
+    first = client.post('/api/tasks', json={'title': 'A'}, headers=auth).get_json()
+    # Each write goes to both apps, so the results differ only in ids
+    for app_call in (call_flask, call_asgi):
+        target = client if app_call is call_flask else asgi_app
+        status, _, body = app_call(target, 'POST', '/api/tasks', auth, {'title': 'B', 'completed': True})
+        assert status == 201 and json.loads(body)['title'] == 'B'
+    assert_same(client, asgi_app, 'POST', '/api/tasks', auth, {'description': 'no title'})
+    assert_same(client, asgi_app, 'PUT', '/api/tasks/999', auth, {'completed': True})
+    assert_same(client, asgi_app, 'PUT', f"/api/tasks/{first['id']}", auth, {})
+    assert_same(client, asgi_app, 'PUT', f"/api/tasks/{first['id']}", auth, {'completed': True})
+    assert_same(client, asgi_app, 'DELETE', '/api/tasks/999', auth)
+    assert_same(client, asgi_app, 'GET', '/api/tasks/stats', auth)
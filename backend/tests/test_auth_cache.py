@@ -0,0 +1,98 @@
+import time
+
+import auth_cache
+from auth_cache import AuthCache, TTLCache
+from conftest import app_module
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth_cache.time, 'monotonic', clock)
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=5)
+    cache.set('c', 3, ttl=600)  # capped at the cache's ttl
+    cache.set('d', 4, ttl=0)  # never stored
+
+    clock.now += 10
+    assert (cache.get('a'), cache.get('b'), cache.get('c'), cache.get('d')) == (1, None, 3, None)
+    clock.now += 60
+    assert cache.get('c') is None
+    assert cache.stats()['size'] == 1  # 'a' expired but is only dropped when read
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_tokens_are_cached_until_their_exp():
+    cache = AuthCache(ttl=60)
+    cache.put_token('header.payload.sig1', 7, time.time() + 30)
+    cache.put_token('header.payload.sig2', 8, time.time() - 1)
+    assert cache.get_token_user_id('other.payload.sig1') == 7  # keyed by signature
+    assert cache.get_token_user_id('header.payload.sig2') is None
+
+
+def test_cached_users_are_copies_and_can_be_invalidated():
+    cache = AuthCache()
+    cache.put_user({'id': 1, 'username': 'a@example.com'})
+    user = cache.get_user(1)
+    user['username'] = 'changed'
+    assert cache.get_user(1)['username'] == 'a@example.com'
+    cache.invalidate_user(1)
+    assert cache.get_user(1) is None
+
+
+def test_disabled_cache_stores_nothing():
+    cache = AuthCache(enabled=False)
+    cache.put_token('h.p.s', 1, time.time() + 30)
+    cache.put_user({'id': 1})
+    assert cache.get_token_user_id('h.p.s') is None and cache.get_user(1) is None
+
+
+def test_warm_cache_skips_the_user_lookup(client, auth, monkeypatch):
+    lookups = []
+    get_user = app_module.storage.get_user
+
+    def counting_get_user(conn, user_id):
+        lookups.append(user_id)
+        return get_user(conn, user_id)
+
+    monkeypatch.setattr(app_module.storage, 'get_user', counting_get_user)
+    app_module.auth_cache.clear()
+    for _ in range(3):
+        assert client.get('/api/tasks/stats', headers=auth).status_code == 200
+    assert len(lookups) == 1
+    assert app_module.auth_cache.stats()['tokens']['hits'] >= 2
+
+
+def test_invalidated_user_is_looked_up_again(client, auth, monkeypatch):
+    client.get('/api/tasks/stats', headers=auth)
+    user_id = client.post('/api/tasks', json={'title': 'x'}, headers=auth).get_json()['user_id']
+    monkeypatch.setattr(app_module.storage, 'get_user', lambda conn, user_id: None)
+    # Still served from the cache
+    assert client.get('/api/tasks/stats', headers=auth).status_code == 200
+    app_module.auth_cache.invalidate_user(user_id)
+    response = client.get('/api/tasks/stats', headers=auth)
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'User not found'}
+
+
+def test_bad_tokens_are_not_cached(client, auth):
+    forged = auth['Authorization'][:-2] + ('AA' if not auth['Authorization'].endswith('AA') else 'BB')
+    for _ in range(2):
+        assert client.get('/api/tasks/stats', headers={'Authorization': forged}).status_code == 401
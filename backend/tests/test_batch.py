@@ -0,0 +1,89 @@
+import sqlite3
+
+import task_batch
+from conftest import app_module, signup
+
+
+def create(client, auth, title, completed=False):
+    return client.post('/api/tasks', json={'title': title, 'completed': completed}, headers=auth).get_json()
+
+
+def batch(client, auth, operations):
+    return client.post('/api/tasks/batch', json={'operations': operations}, headers=auth)
+
+
+def test_mixed_batch_returns_one_result_per_operation(client, auth):
+    keep = create(client, auth, 'keep')
+    drop = create(client, auth, 'drop', completed=True)
+
+    response = batch(client, auth, [
+        {'op': 'create', 'title': 'new 1'},
+        {'op': 'update', 'id': keep['id'], 'completed': True},
+        {'op': 'create', 'title': 'new 2', 'description': 'd', 'completed': True},
+        {'op': 'delete', 'id': drop['id']}
+    ])
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['index'] for result in results] == [0, 1, 2, 3]
+    assert [result['status'] for result in results] == [201, 200, 201, 200]
+    assert results[1]['task'] == {**keep, 'completed': True}
+    assert results[3] == {'index': 3, 'status': 200, 'id': drop['id']}
+
+    # The returned ids are those of the stored tasks
+    tasks = {task['id']: task for task in client.get('/api/tasks', headers=auth).get_json()}
+    for result in (results[0], results[2]):
+        assert tasks[result['task']['id']] == result['task']
+    assert (results[0]['task']['title'], results[0]['task']['completed']) == ('new 1', False)
+    assert (results[2]['task']['title'], results[2]['task']['description']) == ('new 2', 'd')
+    assert results[0]['task']['id'] < results[2]['task']['id']
+    assert drop['id'] not in tasks
+    assert client.get('/api/tasks/stats', headers=auth).get_json() == {'total': 3, 'completed': 2, 'pending': 1}
+
+
+def test_invalid_operations_get_their_own_errors(client, auth):
+    task = create(client, auth, 'mine')
+    untouched = create(client, auth, 'untouched')
+    foreign = create(client, signup(client, 'other@example.com'), 'theirs')
+
+    results = batch(client, auth, [
+        {'op': 'create'},
+        {'op': 'rename', 'id': task['id']},
+        {'op': 'update', 'id': foreign['id'], 'title': 'x'},
+        {'op': 'update', 'id': task['id'], 'title': 'renamed'},
+        {'op': 'delete', 'id': task['id']},
+        {'op': 'update', 'id': untouched['id']},
+        'not an object'
+    ]).get_json()['results']
+    assert [result['status'] for result in results] == [400, 400, 404, 200, 409, 400, 400]
+    assert all('error' in result for result in results if result['status'] != 200)
+
+    # The valid operation is still applied; the foreign task is untouched
+    assert [t['title'] for t in client.get('/api/tasks', headers=auth).get_json()] == ['untouched', 'renamed']
+    assert results[3]['task']['title'] == 'renamed'
+
+
+def test_batch_is_committed_all_or_nothing(client, auth, monkeypatch):
+    keep = create(client, auth, 'keep')
+    drop = create(client, auth, 'drop')
+    before = client.get('/api/tasks', headers=auth).get_json()
+
+    def failing_tombstones(*args):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(task_batch, 'record_tombstones', failing_tombstones)
+    response = batch(client, auth, [
+        {'op': 'create', 'title': 'new'},
+        {'op': 'update', 'id': keep['id'], 'title': 'changed'},
+        {'op': 'delete', 'id': drop['id']}
+    ])
+    assert response.status_code == 500
+
+    assert client.get('/api/tasks', headers=auth).get_json() == before
+    assert client.get('/api/tasks/stats', headers=auth).get_json() == {'total': 2, 'completed': 0, 'pending': 2}
+
+
+def test_batch_request_validation(client, auth, monkeypatch):
+    assert batch(client, auth, []).status_code == 400
+    assert client.post('/api/tasks/batch', json={}, headers=auth).status_code == 400
+    monkeypatch.setattr(app_module, 'BATCH_MAX_OPERATIONS', 2)
+    assert batch(client, auth, [{'op': 'create', 'title': str(i)} for i in range(3)]).status_code == 400
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import benchmark
+from conftest import app_module
+
+
+def test_parse_mix():
+    assert benchmark.parse_mix('list=3, create=1') == {'list': 3.0, 'create': 1.0}
+    with pytest.raises(SystemExit):
+        benchmark.parse_mix('list=1,upload=2')
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([7], 95) == 7
+    assert benchmark.percentile([], 50) is None
+
+
+def test_summarize():
+    endpoints, overall = benchmark.summarize({'list': [0.003, 0.001, 0.002], 'stats': []}, {'list': 1, 'stats': 0}, 2)
+    assert endpoints['list'] == {
+        'count': 3, 'errors': 1, 'throughput_rps': 1.5, 'mean_ms': 2.0, 'p50_ms': 2.0, 'p95_ms': 3.0, 'p99_ms': 3.0
+    }
+    assert endpoints['stats']['count'] == 0 and endpoints['stats']['p50_ms'] is None
+    assert (overall['count'], overall['errors']) == (3, 1)
+
+
+def test_in_process_run(tmp_path, monkeypatch, capsys):
+    # Seeds through the API, runs the mix against an in-process server and
+    # writes the results, then compares against them as a baseline
+    monkeypatch.setitem(app_module.SQLITE_CONFIG, 'path', str(tmp_path / 'quicktask.db'))
+    output = tmp_path / 'results.json'
+    args = ['--users', '2', '--tasks-per-user', '3', '--seed-batch-size', '2', '--threads', '2',
+            '--duration', '0.3', '--warmup', '0', '--seed', '1', '--mix', 'list=1,list_all=1,stats=1,create=1,login=1']
+    try:
+        benchmark.main(args + ['--output', str(output)])
+        results = json.loads(output.read_text())
+        assert results['config']['users'] == 2
+        assert set(results['endpoints']) == {'list', 'list_all', 'stats', 'create', 'login'}
+        assert results['overall']['count'] > 0
+        assert results['overall']['errors'] == 0
+
+        app_module.storage.dispose()
+        benchmark.main(args + ['--compare', str(output)])
+        assert 'vs baseline' in capsys.readouterr().out
+    finally:
+        app_module.storage.dispose()
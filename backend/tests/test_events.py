@@ -0,0 +1,111 @@
+import threading
+
+from conftest import app_module, signup
+from events import ChangeFeed
+
+ORIGIN = 'http://localhost:5173'
+
+
+def first_message(response):
+    # The first chunk of an open change feed; closing the response ends it
+    try:
+        return next(iter(response.response)).decode('utf-8')
+    finally:
+        response.close()
+
+
+def test_preflight_allows_last_event_id(client):
+    response = client.options('/api/tasks/events', headers={
+        'Origin': ORIGIN,
+        'Access-Control-Request-Method': 'GET',
+        'Access-Control-Request-Headers': 'authorization,last-event-id'
+    })
+    assert response.status_code == 200
+    assert response.headers['Access-Control-Allow-Origin'] == ORIGIN
+    allowed = {name.strip().lower() for name in response.headers['Access-Control-Allow-Headers'].split(',')}
+    assert {'authorization', 'last-event-id'} <= allowed
+
+
+def test_new_feed_starts_with_ready(client, auth):
+    client.post('/api/tasks', json={'title': 'A'}, headers=auth)
+    message = first_message(client.get('/api/tasks/events', headers=auth))
+    assert 'event: ready\n' in message
+    assert '"version":1' in message
+
+
+def test_resume_replays_changes_after_last_event_id(client, auth):
+    first = client.post('/api/tasks', json={'title': 'A'}, headers=auth).get_json()
+    second = client.post('/api/tasks', json={'title': 'B'}, headers=auth).get_json()
+    client.delete(f"/api/tasks/{first['id']}", headers=auth)
+
+    message = first_message(client.get('/api/tasks/events', headers={**auth, 'Last-Event-ID': '1'}))
+    assert 'id: 3\nevent: changes\n' in message
+    assert f'"id":{second["id"]}' in message
+    assert f'"deleted":[{first["id"]}]' in message
+    assert f'"title":"A"' not in message
+
+
+def test_resume_from_query_parameter(client, auth):
+    client.post('/api/tasks', json={'title': 'A'}, headers=auth)
+    client.post('/api/tasks', json={'title': 'B'}, headers=auth)
+    message = first_message(client.get('/api/tasks/events?last_event_id=1', headers=auth))
+    assert 'id: 2\nevent: changes\n' in message
+    assert '"title":"B"' in message
+
+
+def test_invalid_last_event_id(client, auth):
+    response = client.get('/api/tasks/events', headers={**auth, 'Last-Event-ID': 'x'})
+    assert response.status_code == 400
+
+
+def test_feed_only_replays_own_changes(client, auth):
+    other = signup(client, 'other@example.com')
+    client.post('/api/tasks', json={'title': 'mine'}, headers=auth)
+    client.post('/api/tasks', json={'title': 'theirs'}, headers=other)
+    message = first_message(client.get('/api/tasks/events', headers={**auth, 'Last-Event-ID': '0'}))
+    assert '"title":"mine"' in message
+    assert 'theirs' not in message
+
+
+def test_feed_catches_up_on_changes_published_out_of_order(app, client, auth, monkeypatch):
+    user_id = client.post('/api/tasks', json={'title': 'first'}, headers=auth).get_json()['user_id']
+    subscription = app_module.event_broker.subscribe(user_id)
+
+    # Writer A commits first but publishes only after writer B has
+    # committed and published
+    a_committed, b_published = threading.Event(), threading.Event()
+    publish = app_module.event_broker.publish
+
+    def ordered_publish(user_id, changes):
+        if changes['changed'][0]['title'] == 'A':
+            a_committed.set()
+            assert b_published.wait(5)
+        publish(user_id, changes)
+        if changes['changed'][0]['title'] == 'B':
+            b_published.set()
+
+    monkeypatch.setattr(app_module.event_broker, 'publish', ordered_publish)
+
+    def write_b():
+        assert a_committed.wait(5)
+        client.post('/api/tasks', json={'title': 'B'}, headers=auth)
+
+    def write_a():
+        client.post('/api/tasks', json={'title': 'A'}, headers=auth)
+
+    writers = [threading.Thread(target=write_a), threading.Thread(target=write_b)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(10)
+    app_module.event_broker.unsubscribe(subscription)
+
+    with app.app_context():
+        feed = ChangeFeed(app_module.json_encoder(), 1)
+        events = subscription.get(0)
+        assert [event['version'] for event in events] == [3, 2]
+        message, catch_up = feed.messages(events)
+        assert catch_up and b'"title":"A"' not in message
+        message += app_module.read_feed_changes(feed, user_id)
+    assert b'"title":"A"' in message and b'"title":"B"' in message
+    assert feed.last_id == 3
@@ -0,0 +1,114 @@
+import json
+
+from conftest import app_module, signup
+
+TASKS = [
+    {'title': 'Plain', 'description': '', 'completed': False},
+    {'title': 'Done', 'description': 'with, a comma', 'completed': True},
+    {'title': 'Quoted "title"', 'description': 'two\nlines', 'completed': False},
+    {'title': 'Ünïcode ✓', 'description': 'é', 'completed': True}
+]
+
+
+def progress(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def import_file(client, auth, body, fmt='ndjson'):
+    response = client.post(f'/api/tasks/import?format={fmt}', data=body, headers=auth)
+    assert response.status_code == 200
+    return progress(response)
+
+
+def stored(client, auth):
+    tasks = client.get('/api/tasks', headers=auth).get_json()
+    return sorted((t['title'], t['description'], t['completed']) for t in tasks)
+
+
+def seed(client, auth):
+    for task in TASKS:
+        client.post('/api/tasks', json=task, headers=auth)
+
+
+def test_ndjson_round_trip(client, auth):
+    seed(client, auth)
+    export = client.get('/api/tasks/export', headers=auth)
+    assert export.status_code == 200
+    rows = [json.loads(line) for line in export.get_data(as_text=True).splitlines()]
+    assert [set(row) for row in rows] == [{'id', 'title', 'description', 'completed'}] * len(TASKS)
+
+    other = signup(client, 'other@example.com')
+    lines = import_file(client, other, export.get_data())
+    assert lines[-1]['done'] and lines[-1]['imported'] == len(TASKS)
+    assert stored(client, other) == stored(client, auth)
+    assert client.get('/api/tasks/stats', headers=other).get_json() == {'total': 4, 'completed': 2, 'pending': 2}
+
+
+def test_csv_round_trip(client, auth):
+    seed(client, auth)
+    export = client.get('/api/tasks/export?format=csv', headers=auth)
+    assert export.status_code == 200
+    assert export.get_data(as_text=True).splitlines()[0] == 'id,title,description,completed'
+
+    other = signup(client, 'other@example.com')
+    response = client.post('/api/tasks/import', data=export.get_data(),
+                           headers={**other, 'Content-Type': 'text/csv'})
+    assert progress(response)[-1]['done']
+    assert stored(client, other) == stored(client, auth)
+
+
+def test_export_include_archived_parameter(client, auth):
+    seed(client, auth)
+    assert client.get('/api/tasks/export?include_archived=maybe', headers=auth).status_code == 400
+    rows = client.get('/api/tasks/export?include_archived=false', headers=auth).get_data(as_text=True)
+    assert len(rows.splitlines()) == len(TASKS)
+
+
+def test_each_batch_is_committed_and_reported(client, auth, monkeypatch):
+    monkeypatch.setattr(app_module, 'IMPORT_BATCH_SIZE', 2)
+    body = ''.join(json.dumps({'title': f'Task {i}'}) + '\n' for i in range(5))
+    lines = import_file(client, auth, body)
+    assert [line['imported'] for line in lines] == [2, 4, 5, 5]
+    assert lines[-1]['done']
+    # One data version per committed batch
+    versions = [line['version'] for line in lines[:-1]]
+    assert versions == sorted(set(versions))
+    assert len(client.get('/api/tasks', headers=auth).get_json()) == 5
+
+
+def test_malformed_ndjson_reports_its_line(client, auth, monkeypatch):
+    monkeypatch.setattr(app_module, 'IMPORT_BATCH_SIZE', 2)
+    body = '{"title": "a"}\n\n{"title": "b"}\n{"title": "c"}\n{"title": \n{"title": "never"}\n'
+    lines = import_file(client, auth, body)
+    assert lines[-1]['line'] == 5
+    assert 'Invalid JSON' in lines[-1]['error']
+    assert 'done' not in lines[-1]
+    # The tasks before the bad line stay imported
+    assert lines[-1]['imported'] == 3
+    assert [t[0] for t in stored(client, auth)] == ['a', 'b', 'c']
+
+
+def test_invalid_rows_are_rejected(client, auth):
+    for body, message in (
+        ('{"description": "no title"}\n', 'Title is required'),
+        ('{"title": "x", "completed": "maybe"}\n', 'completed must be true or false'),
+        ('["title"]\n', 'Task must be an object'),
+        ('{"title": "%s"}\n' % ('x' * 256), 'longer than 255')
+    ):
+        last = import_file(client, auth, body)[-1]
+        assert last['line'] == 1 and message in last['error'], last
+    assert stored(client, auth) == []
+
+
+def test_malformed_csv_reports_its_line(client, auth):
+    last = import_file(client, auth, 'name\nx\n', fmt='csv')[-1]
+    assert last['line'] == 1 and 'title column' in last['error']
+
+    body = 'title,description,completed\nok,"multi\nline",1\n,missing title,0\n'
+    last = import_file(client, auth, body, fmt='csv')[-1]
+    assert last['line'] == 4 and last['imported'] == 1
+    assert stored(client, auth) == [('ok', 'multi\nline', True)]
+
+
+def test_unknown_import_format(client, auth):
+    assert client.post('/api/tasks/import?format=xml', data='', headers=auth).status_code == 400
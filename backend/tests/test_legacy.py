@@ -0,0 +1,52 @@
+from conftest import signup
+
+
+def stats(client, auth):
+    response = client.get('/api/tasks/stats', headers=auth)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_legacy_update_keeps_counters(client, auth):
+    task = client.post('/api/tasks', json={'title': 'A'}, headers=auth).get_json()
+    assert stats(client, auth)['completed'] == 0
+
+    response = client.put(f"/tasks/{task['id']}", json={'title': 'A', 'description': '', 'completed': True})
+    assert response.status_code == 200
+    after = stats(client, auth)
+    assert (after['total'], after['completed']) == (1, 1)
+
+    client.put(f"/tasks/{task['id']}", json={'title': 'A', 'description': '', 'completed': False})
+    assert stats(client, auth)['completed'] == 0
+
+
+def test_legacy_delete_keeps_counters_and_feed(client, auth):
+    task = client.post('/api/tasks', json={'title': 'A', 'completed': True}, headers=auth).get_json()
+    client.post('/api/tasks', json={'title': 'B'}, headers=auth)
+    client.put(f"/api/tasks/{task['id']}", json={'completed': True}, headers=auth)
+    before = client.get('/api/tasks/changes?since=0', headers=auth).get_json()
+
+    assert client.delete(f"/tasks/{task['id']}").status_code == 200
+    after = stats(client, auth)
+    assert (after['total'], after['completed']) == (1, 0)
+
+    changes = client.get(f"/api/tasks/changes?since={before['version']}", headers=auth).get_json()
+    assert changes['deleted'] == [task['id']]
+
+
+def test_legacy_writes_leave_other_users_alone(client, auth):
+    other = signup(client, 'other@example.com')
+    client.post('/api/tasks', json={'title': 'Theirs'}, headers=other)
+    task = client.post('/api/tasks', json={'title': 'Mine'}, headers=auth).get_json()
+
+    client.delete(f"/tasks/{task['id']}")
+    client.delete('/tasks/999')
+    assert stats(client, auth)['total'] == 0
+    assert stats(client, other)['total'] == 1
+
+
+def test_legacy_list_returns_the_original_columns(client, auth):
+    client.post('/api/tasks', json={'title': 'A'}, headers=auth)
+    client.post('/tasks', json={'title': 'B', 'description': ''})
+    tasks = client.get('/tasks').get_json()
+    assert [set(task) for task in tasks] == [{'id', 'title', 'description', 'completed', 'user_id'}] * 2
@@ -0,0 +1,72 @@
+from conftest import app_module, signup
+
+
+def make_tasks(client, auth, count):
+    # Returns the ids, oldest first; every third task is completed
+    return [client.post('/api/tasks', json={'title': f'Task {i}', 'completed': i % 3 == 0},
+                        headers=auth).get_json()['id'] for i in range(count)]
+
+
+def pages(client, auth, query):
+    # Follows next_cursor to the end; returns the pages
+    result = []
+    cursor = None
+    while True:
+        url = f'/api/tasks?{query}' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url, headers=auth)
+        assert response.status_code == 200
+        page = response.get_json()
+        result.append(page)
+        cursor = page['next_cursor']
+        if cursor is None:
+            return result
+
+
+def test_pages_cover_every_task_newest_first(client, auth):
+    ids = make_tasks(client, auth, 7)
+    result = pages(client, auth, 'limit=3')
+    assert [len(page['tasks']) for page in result] == [3, 3, 1]
+    assert all(page['limit'] == 3 for page in result)
+    assert [task['id'] for page in result for task in page['tasks']] == ids[::-1]
+
+
+def test_exact_multiple_of_limit_has_no_empty_last_page(client, auth):
+    make_tasks(client, auth, 4)
+    assert [len(page['tasks']) for page in pages(client, auth, 'limit=2')] == [2, 2]
+
+
+def test_completed_filter_pages(client, auth):
+    ids = make_tasks(client, auth, 7)
+    done = [task['id'] for page in pages(client, auth, 'limit=2&completed=true') for task in page['tasks']]
+    assert done == [ids[6], ids[3], ids[0]]
+    pending = [task['id'] for page in pages(client, auth, 'limit=2&completed=false') for task in page['tasks']]
+    assert pending == [ids[5], ids[4], ids[2], ids[1]]
+
+
+def test_limit_is_clamped(client, auth, monkeypatch):
+    monkeypatch.setattr(app_module, 'TASKS_PAGE_MAX_LIMIT', 5)
+    make_tasks(client, auth, 6)
+    assert client.get('/api/tasks?limit=100', headers=auth).get_json()['limit'] == 5
+    assert client.get('/api/tasks?limit=0', headers=auth).get_json()['limit'] == 1
+
+
+def test_unpaginated_list_is_a_plain_array(client, auth):
+    make_tasks(client, auth, 3)
+    assert len(client.get('/api/tasks', headers=auth).get_json()) == 3
+
+
+def test_invalid_pagination_parameters(client, auth):
+    # A limit that is not a number falls back to the default
+    default = app_module.TASKS_PAGE_DEFAULT_LIMIT
+    assert client.get('/api/tasks?limit=x', headers=auth).get_json()['limit'] == default
+    for query in ('cursor=not-a-cursor', 'cursor=' + app_module.encode_cursor(1).swapcase(),
+                  'completed=maybe', 'include_archived=maybe'):
+        assert client.get(f'/api/tasks?{query}', headers=auth).status_code == 400, query
+
+
+def test_pages_only_hold_own_tasks(client, auth):
+    other = signup(client, 'other@example.com')
+    make_tasks(client, other, 3)
+    mine = make_tasks(client, auth, 2)
+    page = client.get('/api/tasks?limit=10', headers=auth).get_json()
+    assert [task['id'] for task in page['tasks']] == mine[::-1]
@@ -0,0 +1,93 @@
+import pytest
+
+from conftest import app_module, signup
+
+# Each budgeted route's statement count on SQLite, in strict mode, with the
+# user not yet in the auth cache (the user lookup is counted too). These are
+# the steady-state costs: building a user's counters is not counted.
+
+
+@pytest.fixture(params=[True, False], ids=['metrics', 'no-metrics'])
+def app(request, app, monkeypatch):
+    # Counting must not depend on METRICS_ENABLED
+    monkeypatch.setattr(app_module.metrics, 'enabled', request.param)
+    return app
+
+
+def task(client, auth, **fields):
+    return client.post('/api/tasks', json={'title': 'Task', **fields}, headers=auth).get_json()
+
+
+def counted(client, method, url, auth, **kwargs):
+    app_module.auth_cache.clear()
+    response = client.open(url, method=method, headers=auth, **kwargs)
+    assert response.status_code < 300, response.get_data(as_text=True)
+    response.get_data()
+    endpoint, _ = client.application.url_map.bind('').match(url.partition('?')[0], method=method)
+    view = client.application.view_functions[endpoint]
+    count = int(response.headers['X-Query-Count'])
+    assert count <= view.query_budget
+    return count
+
+
+def test_reads(client, auth):
+    task(client, auth)
+    assert counted(client, 'GET', '/api/tasks', auth) == 3
+    assert counted(client, 'GET', '/api/tasks?limit=10', auth) == 3
+    assert counted(client, 'GET', '/api/tasks/stats', auth) == 2
+    assert counted(client, 'GET', '/api/tasks/archive', auth) == 2
+    assert counted(client, 'GET', '/api/tasks/export', auth) == 3
+
+
+def test_writes(client, auth):
+    assert counted(client, 'POST', '/api/tasks', auth, json={'title': 'A'}) == 3
+    task_id = task(client, auth)['id']
+    assert counted(client, 'PUT', f'/api/tasks/{task_id}', auth, json={'completed': True}) == 4
+    # SQLite deletes with RETURNING instead of a locking read
+    assert counted(client, 'DELETE', f'/api/tasks/{task_id}', auth) == 4
+
+
+def test_batch(client, auth):
+    update_id, delete_id = task(client, auth)['id'], task(client, auth)['id']
+    operations = [
+        {'op': 'create', 'title': 'B'},
+        {'op': 'update', 'id': update_id, 'completed': True},
+        {'op': 'delete', 'id': delete_id}
+    ]
+    assert counted(client, 'POST', '/api/tasks/batch', auth, json={'operations': operations}) == 8
+
+
+def test_counter_build_is_not_counted(client, auth):
+    # The first request of a user without counters builds them
+    with app_module.storage.transaction(app_module.storage.acquire()) as cursor:
+        cursor.execute("DELETE FROM user_task_stats")
+    assert counted(client, 'GET', '/api/tasks/stats', auth) == 2
+    with app_module.storage.transaction(app_module.storage.acquire()) as cursor:
+        cursor.execute("DELETE FROM user_task_stats")
+    assert counted(client, 'POST', '/api/tasks', auth, json={'title': 'A'}) == 3
+
+
+def test_over_budget_fails_in_strict_mode(client, auth, monkeypatch):
+    monkeypatch.setattr(app_module.get_task_stats, 'query_budget', 1)
+    app_module.auth_cache.clear()
+    response = client.get('/api/tasks/stats', headers=auth)
+    assert response.status_code == 500
+
+
+def test_write_behind_update(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'WRITE_BEHIND_TOGGLES', True)
+    monkeypatch.setitem(app_module.SQLITE_CONFIG, 'path', str(tmp_path / 'quicktask.db'))
+    flask_app = app_module.create_app()
+    try:
+        client = flask_app.test_client()
+        auth = signup(client)
+        first, second = task(client, auth)['id'], task(client, auth)['id']
+        # A toggle is answered from memory after the ownership read
+        assert counted(client, 'PUT', f'/api/tasks/{first}', auth, json={'completed': True}) == 2
+        # A title change needs that read and the write; the pending toggle
+        # of the other task is flushed uncounted
+        assert counted(client, 'PUT', f'/api/tasks/{second}', auth, json={'completed': True, 'title': 'B'}) == 5
+    finally:
+        app_module.coalescer.close()
+        app_module.coalescer = None
+        app_module.storage.dispose()
@@ -0,0 +1,73 @@
+import mysql.connector
+
+from db_pool import PoolTimeoutError
+from storage_mysql import MySQLStorage
+
+# Replica routing of MySQLStorage.acquire(readonly=True), with fake pools in
+# place of the MySQL servers.
+
+
+class FakePool:
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.checkouts = 0
+
+    def acquire(self):
+        self.checkouts += 1
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+    def stats(self):
+        return {}
+
+
+def make_storage(*replicas, retry_after=60.0):
+    storage = MySQLStorage({}, replica_configs=[{}] * len(replicas), replica_retry_after=retry_after)
+    storage.pool = FakePool('primary')
+    storage.replica_pools = list(replicas)
+    return storage
+
+
+def test_reads_round_robin_over_replicas():
+    storage = make_storage(FakePool('r0'), FakePool('r1'))
+    assert [storage.acquire(readonly=True) for _ in range(4)] == ['r0', 'r1', 'r0', 'r1']
+    assert storage.acquire() == 'primary'
+
+
+def test_down_replica_falls_back_to_primary_and_is_skipped():
+    down = FakePool('r0', mysql.connector.errors.InterfaceError('Can\'t connect'))
+    storage = make_storage(down)
+    assert storage.acquire(readonly=True) == 'primary'
+    assert storage.acquire(readonly=True) == 'primary'
+    # Not tried again until replica_retry_after has passed
+    assert down.checkouts == 1
+    assert storage.replica_stats()[0]['up'] == 0
+    assert storage.stats()['replica_fallbacks'] == 2
+
+
+def test_down_replica_is_retried_after_the_window():
+    down = FakePool('r0', mysql.connector.errors.InterfaceError('Can\'t connect'))
+    storage = make_storage(down, retry_after=0)
+    assert storage.acquire(readonly=True) == 'primary'
+    down.error = None
+    assert storage.acquire(readonly=True) == 'r0'
+
+
+def test_busy_replica_is_skipped_for_one_checkout():
+    busy = FakePool('r0', PoolTimeoutError('Timed out'))
+    storage = make_storage(busy, FakePool('r1'))
+    assert storage.acquire(readonly=True) == 'r1'
+    busy.error = None
+    # Busy is not down: r0 serves again on its next turn
+    assert storage.acquire(readonly=True) == 'r1'
+    assert storage.acquire(readonly=True) == 'r0'
+    assert storage.replica_stats()[0]['up'] == 1
+
+
+def test_all_replicas_unavailable_falls_back_to_primary():
+    storage = make_storage(FakePool('r0', PoolTimeoutError('Timed out')),
+                           FakePool('r1', mysql.connector.errors.OperationalError('Lost connection')))
+    assert storage.acquire(readonly=True) == 'primary'
+    assert storage.stats()['replica_fallbacks'] == 1
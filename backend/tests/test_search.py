@@ -0,0 +1,64 @@
+from conftest import app_module, signup
+
+
+def create(client, auth, title, description=''):
+    return client.post('/api/tasks', json={'title': title, 'description': description}, headers=auth).get_json()
+
+
+def search(client, auth, query):
+    response = client.get(f'/api/tasks/search?{query}', headers=auth)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def titles(result):
+    return [task['title'] for task in result['tasks']]
+
+
+def test_every_word_must_match_as_a_prefix(client, auth):
+    create(client, auth, 'Buy groceries', 'milk and bread')
+    create(client, auth, 'Buy a bike')
+    create(client, auth, 'Call the bank')
+
+    assert sorted(titles(search(client, auth, 'q=buy'))) == ['Buy a bike', 'Buy groceries']
+    assert titles(search(client, auth, 'q=buy+mil')) == ['Buy groceries']
+    assert titles(search(client, auth, 'q=bread')) == ['Buy groceries']
+    assert titles(search(client, auth, 'q=nothing')) == []
+
+
+def test_results_follow_task_writes(client, auth):
+    task = create(client, auth, 'Draft report')
+    client.put(f"/api/tasks/{task['id']}", json={'title': 'Final report'}, headers=auth)
+    assert titles(search(client, auth, 'q=draft')) == []
+    assert titles(search(client, auth, 'q=final')) == ['Final report']
+    client.delete(f"/api/tasks/{task['id']}", headers=auth)
+    assert titles(search(client, auth, 'q=report')) == []
+
+
+def test_search_only_returns_own_tasks(client, auth):
+    create(client, auth, 'Shared word mine')
+    create(client, signup(client, 'other@example.com'), 'Shared word theirs')
+    assert titles(search(client, auth, 'q=shared')) == ['Shared word mine']
+
+
+def test_operators_are_searched_as_words(client, auth):
+    create(client, auth, 'Fix "quoted" title')
+    assert titles(search(client, auth, 'q=%22quoted%22+OR+*')) == []
+    assert titles(search(client, auth, 'q=fix+%22quoted')) == ['Fix "quoted" title']
+
+
+def test_results_are_paged_by_offset(client, auth):
+    for i in range(5):
+        create(client, auth, f'Paged task {i}')
+    first = search(client, auth, 'q=paged&limit=2')
+    second = search(client, auth, 'q=paged&limit=2&offset=2')
+    last = search(client, auth, 'q=paged&limit=2&offset=4')
+    assert (first['next_offset'], second['next_offset'], last['next_offset']) == (2, 4, None)
+    found = titles(first) + titles(second) + titles(last)
+    assert sorted(found) == [f'Paged task {i}' for i in range(5)]
+
+
+def test_invalid_search_parameters(client, auth, monkeypatch):
+    monkeypatch.setattr(app_module, 'SEARCH_MAX_OFFSET', 10)
+    for query in ('', 'q=', 'q=' + 'x' * 201, 'q=%21%21', 'q=a&offset=-1', 'q=a&offset=11'):
+        assert client.get(f'/api/tasks/search?{query}', headers=auth).status_code == 400, query
@@ -0,0 +1,157 @@
+import pytest
+
+import task_batch
+from conftest import app_module, signup
+from sharding import ShardedStorage, ShardMap, user_bucket
+from storage import StorageBusyError
+from storage_sqlite import SQLiteStorage
+
+# Three SQLite databases stand in for MySQL shards. MySQL shards get
+# disjoint task ids from auto_increment_offset; here each shard's id
+# sequence starts in its own range instead.
+
+BUCKETS = 16
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    shards = [SQLiteStorage(str(tmp_path / f'shard{index}.db')) for index in range(3)]
+    storage = ShardedStorage(shards, buckets=BUCKETS, map_ttl=0)
+    monkeypatch.setattr(app_module, 'create_storage', lambda *args, **kwargs: storage)
+    return storage
+
+
+@pytest.fixture
+def app(sharded):
+    flask_app = app_module.create_app()
+    for index, shard in enumerate(sharded.shards):
+        conn = shard.acquire()
+        with shard.transaction(conn) as cursor:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('tasks', %s)", (index * 1000000,))
+    yield flask_app
+    sharded.dispose()
+
+
+def count_rows(shard, table, user_id):
+    conn = shard.acquire()
+    with shard._cursor(conn, dictionary=False) as cursor:
+        key = 'id' if table == 'users' else 'user_id'
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {key} = %s", (user_id,))
+        return cursor.fetchone()[0]
+
+
+def user_id(client, email='user@example.com'):
+    return client.post('/api/auth/login', json={'email': email, 'password': 'pw'}).get_json()['user']['id']
+
+
+def test_user_bucket_is_stable():
+    assert user_bucket(42, BUCKETS) == user_bucket(42, BUCKETS)
+    assert {user_bucket(user_id, BUCKETS) for user_id in range(1, 200)} == set(range(BUCKETS))
+
+
+def test_shard_map_needs_a_first_load():
+    def fail():
+        raise RuntimeError('catalog down')
+    shard_map = ShardMap(fail, BUCKETS, ttl=0)
+    with pytest.raises(StorageBusyError):
+        shard_map.lookup(0)
+    assert shard_map.stats()['load_errors'] == 1
+
+
+def test_buckets_without_a_row_are_on_the_catalog(client, sharded):
+    signup(client)
+    uid = user_id(client)
+    assert sharded.shard_index(uid) == 0
+    assert count_rows(sharded.shards[0], 'users', uid) == 1
+
+
+def test_plan_rebalance_spreads_buckets_evenly(app, sharded):
+    moves = sharded.plan_rebalance()
+    assert len(moves) == BUCKETS - 6
+    assert list(moves.values()).count(1) == 5 and list(moves.values()).count(2) == 5
+
+
+def test_rebalance_moves_users_with_their_rows(client, sharded):
+    users = [signup(client, f'user{n}@example.com') for n in range(8)]
+    for auth in users:
+        first = client.post('/api/tasks', json={'title': 'A'}, headers=auth).get_json()
+        client.post('/api/tasks', json={'title': 'B'}, headers=auth)
+        client.delete(f"/api/tasks/{first['id']}", headers=auth)
+    before = [(client.get('/api/tasks', headers=auth).get_json(), client.get('/api/tasks/stats', headers=auth).get_json())
+              for auth in users]
+
+    runner = client.application.test_cli_runner()
+    output = runner.invoke(args=['rebalance-shards', '--wait', '0', '--batch-size', '4']).output
+
+    ids = [user_id(client, f'user{n}@example.com') for n in range(len(users))]
+    moved = [uid for uid in ids if sharded.shard_index(uid) != 0]
+    assert moved and f'Moved {len(moved)} users' in output
+    for uid in ids:
+        shard = sharded.shard_index(uid)
+        for index, storage in enumerate(sharded.shards):
+            expected = 1 if index == shard else 0
+            assert count_rows(storage, 'users', uid) == expected
+            assert count_rows(storage, 'tasks', uid) == expected
+            assert count_rows(storage, 'task_tombstones', uid) == expected
+    after = [(client.get('/api/tasks', headers=auth).get_json(), client.get('/api/tasks/stats', headers=auth).get_json())
+             for auth in users]
+    assert after == before
+
+
+def test_moving_bucket_answers_503_until_the_move_is_resumed(client, sharded):
+    auth = signup(client)
+    client.post('/api/tasks', json={'title': 'A'}, headers=auth)
+    uid = user_id(client)
+    bucket = sharded.shard_map.bucket(uid)
+    # A move interrupted after its bucket was blocked
+    sharded._update_buckets([(bucket, 0, 2, None)])
+
+    response = client.get('/api/tasks', headers=auth)
+    assert response.status_code == 503
+
+    assert sharded.resume_moves() == 1
+    assert sharded.shard_index(uid) == 2
+    assert count_rows(sharded.shards[0], 'tasks', uid) == 0
+    assert [task['title'] for task in client.get('/api/tasks', headers=auth).get_json()] == ['A']
+
+
+class StridedIdCursor:
+    """Gives new tasks ids `stride` apart, as a MySQL shard with
+    auto_increment_increment = stride does; lastrowid is the first one."""
+
+    def __init__(self, cursor, first_id, stride):
+        self._cursor = cursor
+        self._next_id = first_id
+        self._stride = stride
+        self.lastrowid = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query, params=()):
+        if not query.startswith("INSERT INTO tasks (title"):
+            return self._cursor.execute(query, params)
+        self.lastrowid = self._next_id
+        for start in range(0, len(params), 5):
+            self._cursor.execute(
+                "INSERT INTO tasks (id, title, description, completed, user_id, row_version) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                [self._next_id] + list(params[start:start + 5])
+            )
+            self._next_id += self._stride
+
+
+def test_batch_create_returns_the_ids_of_a_strided_shard(client):
+    signup(client)
+    uid = user_id(client)
+    storage = app_module.storage
+    operations = [{'op': 'create', 'title': title} for title in ('A', 'B', 'C')]
+    conn = storage.acquire(user_id=uid)
+    with storage.transaction(conn, dictionary=True) as cursor:
+        results, _ = task_batch.apply_batch(StridedIdCursor(cursor, 65, 64), uid, operations, storage.dialect)
+
+    assert [result['task']['id'] for result in results] == [65, 129, 193]
+    with storage._cursor(conn, dictionary=False) as cursor:
+        cursor.execute("SELECT id, title FROM tasks WHERE user_id = %s ORDER BY id", (uid,))
+        stored = cursor.fetchall()
+    assert [(result['task']['id'], result['task']['title']) for result in results] == [tuple(row) for row in stored]
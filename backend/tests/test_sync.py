@@ -0,0 +1,50 @@
+import contextlib
+import threading
+
+from conftest import app_module
+
+
+class RacingCursor:
+    """Runs `race` (in another thread) just before the wrapped cursor reads tasks."""
+
+    def __init__(self, cursor, race):
+        self._cursor = cursor
+        self._race = race
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query, *args, **kwargs):
+        if 'FROM tasks' in query:
+            thread = threading.Thread(target=self._race)
+            thread.start()
+            thread.join()
+        return self._cursor.execute(query, *args, **kwargs)
+
+
+def test_changes_are_read_from_one_snapshot(client, auth, monkeypatch):
+    client.post('/api/tasks', json={'title': 'A'}, headers=auth)
+    user_id = client.post('/api/auth/login', json={'email': 'user@example.com', 'password': 'pw'}).get_json()['user']['id']
+    storage = app_module.storage
+
+    def write():
+        conn = storage.acquire()
+        storage.create_task(conn, user_id, 'Written during the sync')
+        conn.close()
+
+    read_transaction = storage.read_transaction
+
+    @contextlib.contextmanager
+    def racing_read_transaction(conn, **kwargs):
+        with read_transaction(conn, **kwargs) as cursor:
+            yield RacingCursor(cursor, write)
+
+    monkeypatch.setattr(storage, 'read_transaction', racing_read_transaction)
+    conn = storage.acquire()
+    version, changed, _ = storage.get_changes(conn, user_id, 0, 100)
+    monkeypatch.undo()
+
+    # The task written after the version was read belongs to the next delta
+    assert [task['title'] for task in changed] == ['A']
+    response = client.get(f'/api/tasks/changes?since={version}', headers=auth).get_json()
+    assert [task['title'] for task in response['changed']] == ['Written during the sync']
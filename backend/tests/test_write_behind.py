@@ -0,0 +1,79 @@
+import pytest
+
+from conftest import app_module, signup
+from write_behind import ToggleCoalescer
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeStorage:
+    def __init__(self):
+        self.checkouts = []
+        self.written = []
+
+    def acquire(self):
+        conn = FakeConnection()
+        self.checkouts.append(conn)
+        return conn
+
+    def apply_toggles(self, conn, toggles):
+        self.written.append((conn, toggles))
+        return len(toggles)
+
+
+@pytest.fixture
+def coalescer():
+    coalescer = ToggleCoalescer(FakeStorage(), window=60)
+    yield coalescer
+    coalescer.close()
+
+
+def test_flush_writes_on_the_callers_connection(coalescer):
+    coalescer.toggle({'id': 1, 'user_id': 7, 'title': 'A', 'description': '', 'completed': False}, True)
+    conn = FakeConnection()
+    assert coalescer.flush(7, conn) == 1
+    assert coalescer.storage.written == [(conn, {1: (7, True)})]
+    assert coalescer.storage.checkouts == [] and not conn.closed
+
+
+def test_flush_without_a_connection_checks_one_out(coalescer):
+    coalescer.toggle({'id': 1, 'user_id': 7, 'title': 'A', 'description': '', 'completed': False}, True)
+    assert coalescer.flush() == 1
+    [conn] = coalescer.storage.checkouts
+    assert conn.closed
+
+
+def test_request_flush_reuses_the_request_connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'WRITE_BEHIND_TOGGLES', True)
+    monkeypatch.setitem(app_module.WRITE_BEHIND_CONFIG, 'window', 60)
+    monkeypatch.setitem(app_module.SQLITE_CONFIG, 'path', str(tmp_path / 'quicktask.db'))
+    flask_app = app_module.create_app()
+    try:
+        client = flask_app.test_client()
+        auth = signup(client)
+        task = client.post('/api/tasks', json={'title': 'A'}, headers=auth).get_json()
+        client.put(f"/api/tasks/{task['id']}", json={'completed': True}, headers=auth)
+        assert app_module.coalescer.stats()['pending'] == 1
+
+        checkouts = []
+        acquire = app_module.storage.acquire
+
+        def counting_acquire(*args, **kwargs):
+            checkouts.append(args)
+            return acquire(*args, **kwargs)
+
+        monkeypatch.setattr(app_module.storage, 'acquire', counting_acquire)
+        tasks = client.get('/api/tasks', headers=auth).get_json()
+        assert tasks[0]['completed'] is True
+        assert app_module.coalescer.stats()['pending'] == 0
+        assert len(checkouts) == 1
+    finally:
+        app_module.coalescer.close()
+        app_module.coalescer = None
+        app_module.storage.dispose()
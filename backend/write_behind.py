@@ -0,0 +1,208 @@
+import atexit
+import logging
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Write-behind for completion toggles. A PUT that only flips `completed` is
+# acknowledged from memory: the toggle is recorded per task (a later toggle
+# of the same task replaces it, last write wins) and every `window` seconds
+# a background thread writes all pending toggles in one transaction
+# (Storage.apply_toggles). Reads stay consistent within the worker: stats
+# add the pending deltas to the stored counters, and every other read or
+# write of a user with pending toggles flushes them first.
+#
+# Durability: an acknowledged toggle lives only in this worker's memory
+# until its window is flushed. It is written on graceful shutdown, and kept
+# and retried on the next window if the database fails, but it is lost if
+# the process is killed first. Other workers see it after the flush.
+
+_coalescers = weakref.WeakSet()
+
+
+class PendingToggle:
+    __slots__ = ('user_id', 'completed', 'base', 'task')
+
+    def __init__(self, user_id, completed, base, task):
+        self.user_id = user_id
+        self.completed = completed
+        # Stored value the toggle is applied over, for the stats overlay
+        self.base = base
+        self.task = task
+
+
+class ToggleCoalescer:
+    """Coalesces completion toggles in memory and flushes them in batches.
+
+    Holds at most `max_pending` tasks; beyond that toggle() returns None and
+    the caller writes synchronously. `on_flush` is called with the ids of
+    the users whose toggles were committed.
+    """
+
+    def __init__(self, storage, window=0.2, max_pending=10000, on_flush=None):
+        self.storage = storage
+        self.window = window
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self._pending = {}  # task_id -> PendingToggle
+        self._by_user = {}  # user_id -> {task_id}
+        self._flushing = {}  # task_id -> PendingToggle, being written now
+        self._flushing_users = set()
+        self._lock = threading.Lock()
+        # Held for the whole of a flush, so a reader that waits on it sees
+        # either none or all of a batch
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._acked = 0
+        self._coalesced = 0
+        self._overflows = 0
+        self._flushes = 0
+        self._written = 0
+        self._failures = 0
+        _coalescers.add(self)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Write-behind flush failed, retrying in %ss: %s", self.window, e)
+
+    def has_pending(self, user_id):
+        with self._lock:
+            return user_id in self._by_user or user_id in self._flushing_users
+
+    def get(self, user_id, task_id):
+        # The task as last acknowledged, or None if it has no pending toggle
+        with self._lock:
+            entry = self._pending.get(task_id)
+            if entry is None or entry.user_id != user_id:
+                return None
+            return dict(entry.task, completed=entry.completed)
+
+    def toggle(self, task, completed):
+        # Records a toggle of `task` (as currently stored, or as returned by
+        # get()) and returns the acknowledged task, or None when full
+        task_id = task['id']
+        with self._lock:
+            entry = self._pending.get(task_id)
+            if entry is None:
+                if len(self._pending) >= self.max_pending:
+                    self._overflows += 1
+                    return None
+                flushing = self._flushing.get(task_id)
+                base = flushing.completed if flushing is not None else task['completed']
+                entry = self._pending[task_id] = PendingToggle(task['user_id'], completed, base, dict(task))
+                self._by_user.setdefault(task['user_id'], set()).add(task_id)
+            else:
+                entry.completed = completed
+                self._coalesced += 1
+            self._acked += 1
+            return dict(entry.task, completed=completed)
+
+    def flush(self, user_id=None, conn=None):
+        # Writes the pending toggles of one user (or of everyone) and returns
+        # the number of tasks written. On failure they stay pending and the
+        # storage error is raised. A caller that holds a connection passes
+        # it as `conn`, so the flush cannot wait on the pool for a second one
+        # (and block forever once the caller's checkout exhausted it).
+        with self._flush_lock:
+            with self._lock:
+                if user_id is None:
+                    taken, self._pending, self._by_user = self._pending, {}, {}
+                else:
+                    taken = {task_id: self._pending.pop(task_id) for task_id in self._by_user.pop(user_id, ())}
+                if not taken:
+                    return 0
+                self._flushing = taken
+                self._flushing_users = {entry.user_id for entry in taken.values()}
+
+            try:
+                own_conn = conn is None
+                if own_conn:
+                    conn = self.storage.acquire()
+                try:
+                    written = self.storage.apply_toggles(
+                        conn, {task_id: (entry.user_id, entry.completed) for task_id, entry in taken.items()}
+                    )
+                finally:
+                    if own_conn:
+                        conn.close()
+            except BaseException:
+                with self._lock:
+                    for task_id, entry in taken.items():
+                        newer = self._pending.get(task_id)
+                        if newer is not None:
+                            newer.base = entry.base
+                        else:
+                            self._pending[task_id] = entry
+                            self._by_user.setdefault(entry.user_id, set()).add(task_id)
+                    self._flushing, self._flushing_users = {}, set()
+                    self._failures += 1
+                raise
+
+            with self._lock:
+                for task_id, entry in taken.items():
+                    newer = self._pending.get(task_id)
+                    if newer is not None:
+                        newer.base = entry.completed
+                users = self._flushing_users
+                self._flushing, self._flushing_users = {}, set()
+                self._flushes += 1
+                self._written += written
+
+        if self.on_flush is not None:
+            self.on_flush(users)
+        return written
+
+    def read_stats(self, user_id, read):
+        # read() returns the stored {'total', 'completed', 'pending'}; the
+        # user's pending toggles are added on top
+        if not self.has_pending(user_id):
+            return read()
+        with self._flush_lock:
+            # No flush can commit between the read and the overlay
+            stats = read()
+            with self._lock:
+                delta = sum(
+                    int(entry.completed) - int(entry.base)
+                    for entry in (self._pending[task_id] for task_id in self._by_user.get(user_id, ()))
+                )
+        stats['completed'] += delta
+        stats['pending'] -= delta
+        return stats
+
+    def close(self):
+        # Stops the flush thread and writes what is left
+        _coalescers.discard(self)
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            with self._lock:
+                lost = len(self._pending)
+            logger.error("Write-behind flush at shutdown failed, %s toggles lost: %s", lost, e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'acked': self._acked,
+                'coalesced': self._coalesced,
+                'overflows': self._overflows,
+                'flushes': self._flushes,
+                'written': self._written,
+                'failures': self._failures
+            }
+
+
+@atexit.register
+def _close_coalescers():
+    # Flushes acknowledged toggles before the process exits
+    for coalescer in list(_coalescers):
+        coalescer.close()
@@ -0,0 +1,7 @@
+from app import create_app
+
+# Production entry point for a pre-fork server: `gunicorn -c gunicorn.conf.py wsgi:app`.
+# gunicorn imports this module in each worker after forking (preload_app is
+# off), so every worker builds its own connection pool, bcrypt threads and
+# log listener.
+app = create_app()
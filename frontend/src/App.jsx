@@ -3,12 +3,13 @@ import { Routes, Route, Navigate } from "react-router-dom";
 import Login from "./components/Auth/Login";
 import Register from "./components/Auth/Signup";
 import Dashboard from "./components/Dashboard";
-import api from "./api";
+import api, { subscribeToTaskEvents } from "./api";
 
 function App() {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [error, setError] = useState(null);
   const [tasks, setTasks] = useState([]);
+  const [stats, setStats] = useState(null);
 
   useEffect(() => {
     // Check if user is authenticated
@@ -19,6 +20,30 @@ function App() {
     }
   }, []);
 
+  // Keep the list in sync with changes made in other tabs and devices
+  useEffect(() => {
+    if (!isAuthenticated) return;
+    return subscribeToTaskEvents((event, data) => {
+      if (event === 'resync') {
+        fetchTasks();
+      } else if (event === 'changes') {
+        const changed = new Map(data.changed.map(task => [task.id, task]));
+        const deleted = new Set(data.deleted);
+        setTasks(prevTasks => {
+          const added = new Map(changed);
+          const kept = prevTasks
+            .filter(task => !deleted.has(task.id))
+            .map(task => {
+              added.delete(task.id);
+              return changed.get(task.id) || task;
+            });
+          return [...kept, ...added.values()];
+        });
+        fetchStats();
+      }
+    });
+  }, [isAuthenticated]);
+
   const fetchTasks = async () => {
     try {
       const response = await api.get('/api/tasks');
@@ -28,6 +53,18 @@ function App() {
       console.error('Error fetching tasks:', error);
       setError(error.response?.data?.error || 'Failed to fetch tasks');
     }
+    fetchStats();
+  };
+
+  // Stats come from server-side counters instead of filtering the task list
+  const fetchStats = async () => {
+    try {
+      const response = await api.get('/api/tasks/stats');
+      setStats(response.data);
+    } catch (error) {
+      console.error('Error fetching stats:', error);
+      setStats(null);
+    }
   };
 
   const handleAddTask = async (newTask) => {
@@ -35,6 +72,7 @@ function App() {
       const response = await api.post('/api/tasks', newTask);
       setTasks(prevTasks => [...prevTasks, response.data]);
       setError(null);
+      fetchStats();
     } catch (error) {
       console.error('Error adding task:', error);
       setError(error.response?.data?.error || 'Failed to add task');
@@ -50,6 +88,7 @@ function App() {
         )
       );
       setError(null);
+      fetchStats();
     } catch (error) {
       console.error('Error updating task:', error);
       setError(error.response?.data?.error || 'Failed to update task');
@@ -61,6 +100,7 @@ function App() {
       await api.delete(`/api/tasks/${taskId}`);
       setTasks(prevTasks => prevTasks.filter(task => task.id !== taskId));
       setError(null);
+      fetchStats();
     } catch (error) {
       console.error('Error deleting task:', error);
       setError(error.response?.data?.error || 'Failed to delete task');
@@ -99,6 +139,7 @@ function App() {
     localStorage.removeItem('token');
     setIsAuthenticated(false);
     setTasks([]); // Clear tasks on logout
+    setStats(null);
   };
 
   return (
@@ -130,6 +171,7 @@ function App() {
             isAuthenticated ? (
               <Dashboard 
                 tasks={tasks}
+                stats={stats}
                 onAddTask={handleAddTask}
                 onUpdateTask={handleUpdateTask}
                 onDeleteTask={handleDeleteTask}
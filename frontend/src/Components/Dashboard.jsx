@@ -4,11 +4,13 @@ import TaskForm from "./TaskForm";
 import TaskList from "./TaskList";
 import StatsCard from "./StatsCard";
 
-export default function Dashboard({ tasks = [], onAddTask, onUpdateTask, onDeleteTask, onLogout, error: propError }) {
+export default function Dashboard({ tasks = [], stats, onAddTask, onUpdateTask, onDeleteTask, onLogout, error: propError }) {
   const [error, setError] = useState(null);
 
-  const completedTasks = tasks.filter((t) => t.completed).length;
-  const pendingTasks = tasks.length - completedTasks;
+  // Prefer server-side counters; fall back to counting the loaded tasks
+  const totalTasks = stats ? stats.total : tasks.length;
+  const completedTasks = stats ? stats.completed : tasks.filter((t) => t.completed).length;
+  const pendingTasks = stats ? stats.pending : totalTasks - completedTasks;
 
   return (
     <motion.div
@@ -41,7 +43,7 @@ export default function Dashboard({ tasks = [], onAddTask, onUpdateTask, onDelet
           transition={{ delay: 0.2 }}
         >
           <StatsCard
-            total={tasks.length}
+            total={totalTasks}
             completed={completedTasks}
             pending={pendingTasks}
           />
@@ -103,4 +103,65 @@ const checkServerStatus = async () => {
   }
 };
 
+// Live task changes from GET /api/tasks/events (Server-Sent Events).
+// EventSource cannot send the Authorization header, so the stream is read
+// with fetch. Reconnects resume from the last event id.
+export const subscribeToTaskEvents = (onEvent) => {
+  const controller = new AbortController();
+  let lastEventId = null;
+
+  const dispatch = (message) => {
+    let event = 'message';
+    let id = null;
+    const data = [];
+    for (const line of message.split('\n')) {
+      if (line.startsWith(':')) continue; // keep-alive
+      const [field, ...rest] = line.split(':');
+      const value = rest.join(':').replace(/^ /, '');
+      if (field === 'event') event = value;
+      else if (field === 'id') id = value;
+      else if (field === 'data') data.push(value);
+    }
+    if (id !== null) lastEventId = id;
+    if (data.length) onEvent(event, JSON.parse(data.join('\n')));
+  };
+
+  const connect = async () => {
+    const token = localStorage.getItem('token');
+    if (!token) return;
+    const headers = { Authorization: `Bearer ${token}`, Accept: 'text/event-stream' };
+    if (lastEventId !== null) headers['Last-Event-ID'] = lastEventId;
+    try {
+      const response = await fetch(`${api.defaults.baseURL}/api/tasks/events`, {
+        headers,
+        credentials: 'include',
+        signal: controller.signal,
+      });
+      if (response.status === 401) return;
+      if (!response.ok) throw new Error(`Change feed returned ${response.status}`);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+          dispatch(buffer.slice(0, end));
+          buffer = buffer.slice(end + 2);
+        }
+      }
+    } catch (error) {
+      if (controller.signal.aborted) return;
+      console.error('Change feed error:', error);
+    }
+    if (!controller.signal.aborted) setTimeout(connect, 3000);
+  };
+
+  connect();
+  return () => controller.abort();
+};
+
 export default api;
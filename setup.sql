@@ -1,27 +1,8 @@
 -- setup.sql → QuickTask MySQL Database Setup
 
--- Create database
-CREATE DATABASE quicktask;
+-- Creates the (empty) database only. Tables and indexes are created by the
+-- versioned migrations in backend/migrations.py:
+--
+--   cd backend && flask --app app migrate
 
--- Use database
-USE quicktask;
-
--- Create users table
-CREATE TABLE users (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    name VARCHAR(255) NOT NULL,
-    email VARCHAR(255) NOT NULL UNIQUE,
-    password VARCHAR(255) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
--- Create tasks table
-CREATE TABLE tasks (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    user_id INT NOT NULL,
-    title VARCHAR(255) NOT NULL,
-    description TEXT,
-    completed BOOLEAN DEFAULT FALSE,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
-);
+CREATE DATABASE IF NOT EXISTS quicktask;